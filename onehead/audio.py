@@ -0,0 +1,258 @@
+import asyncio
+import subprocess
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from logging import Logger
+from pathlib import Path
+from typing import Literal
+
+from discord.channel import VoiceChannel
+from discord.errors import ClientException
+from discord.opus import Encoder
+from discord.player import AudioSource
+from discord.voice_client import VoiceClient
+from structlog import get_logger
+
+
+log: Logger = get_logger()
+
+
+class BufferedPCMAudio(AudioSource):
+    """
+    Plays audio that has already been decoded to 48KHz 16-bit stereo PCM and split into 20ms frames.
+    """
+
+    def __init__(self, frames: tuple[bytes, ...]) -> None:
+        self._frames: tuple[bytes, ...] = frames
+        self._position: int = 0
+
+    def read(self) -> bytes:
+        if self._position >= len(self._frames):
+            return b""
+
+        frame: bytes = self._frames[self._position]
+        self._position += 1
+        return frame
+
+    def is_opus(self) -> bool:
+        return False
+
+
+class SoundBank:
+    """
+    In-memory cache of decoded sounds, so that each cue only has to be decoded by ffmpeg once rather than every time
+    it is played. Entries are evicted least recently used first once the cache exceeds its size limit.
+    """
+
+    DEFAULT_MAX_BYTES: Literal[33554432] = 33554432
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory: Path = directory
+        self.max_bytes: int = max_bytes
+        self._sounds: OrderedDict[str, tuple[bytes, ...]] = OrderedDict()
+        self._size: int = 0
+
+    def _decode(self, file_name: str) -> tuple[bytes, ...]:
+        """
+        Decodes a sound file to raw PCM and splits it into frames.
+
+        opus.Encoder hands each frame to ctypes, which needs a real bytes object, so each frame is sliced out of the
+        decoded buffer once here rather than every time the sound is played.
+
+        :param file_name: Name of a file in the sounds directory.
+        :return: 20ms PCM frames, the last of which is padded with silence.
+        """
+
+        result: subprocess.CompletedProcess = subprocess.run(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "warning",
+                "-i",
+                str(Path(self.directory, file_name)),
+                "-f",
+                "s16le",
+                "-ar",
+                str(Encoder.SAMPLING_RATE),
+                "-ac",
+                str(Encoder.CHANNELS),
+                "pipe:1",
+            ],
+            capture_output=True,
+            check=True,
+        )
+
+        pcm: bytes = result.stdout
+        frames: list[bytes] = [
+            pcm[offset : offset + Encoder.FRAME_SIZE] for offset in range(0, len(pcm), Encoder.FRAME_SIZE)
+        ]
+
+        if frames and len(frames[-1]) < Encoder.FRAME_SIZE:
+            frames[-1] = frames[-1].ljust(Encoder.FRAME_SIZE, b"\x00")
+
+        return tuple(frames)
+
+    def _store(self, file_name: str, frames: tuple[bytes, ...]) -> None:
+        if file_name in self._sounds:
+            return
+
+        self._sounds[file_name] = frames
+        self._size += len(frames) * Encoder.FRAME_SIZE
+
+        while self._size > self.max_bytes and len(self._sounds) > 1:
+            evicted_name, evicted_frames = self._sounds.popitem(last=False)
+            self._size -= len(evicted_frames) * Encoder.FRAME_SIZE
+            log.info(f"Evicted {evicted_name} from the sound bank.")
+
+    async def get(self, file_name: str) -> BufferedPCMAudio:
+        """
+        Obtains a playable source for a sound, decoding it first if it is not already cached.
+
+        :param file_name: Name of a file in the sounds directory.
+        :return: Audio source positioned at the start of the sound.
+        """
+
+        frames: tuple[bytes, ...] | None = self._sounds.get(file_name)
+
+        if frames is None:
+            frames = await asyncio.to_thread(self._decode, file_name)
+            self._store(file_name, frames)
+        else:
+            self._sounds.move_to_end(file_name)
+
+        return BufferedPCMAudio(frames)
+
+    async def prewarm(self) -> None:
+        """
+        Decodes every sound in the sounds directory ahead of time.
+        """
+
+        for path in sorted(self.directory.glob("*.mp3")):
+            try:
+                await self.get(path.name)
+            except (OSError, subprocess.CalledProcessError) as ex:
+                log.error(f"Failed to decode {path.name} due to {ex}.")
+
+        log.info(f"Sound bank warmed with {len(self._sounds)} sounds ({self._size} bytes).")
+
+
+@dataclass
+class Cue:
+    file_name: str
+    channel: VoiceChannel
+    done: asyncio.Future
+
+
+class VoiceSession:
+    """
+    Long-lived voice connection for a guild. Cues are queued and played back to back by a single worker task, which
+    keeps the voice client connected between cues instead of reconnecting for each one.
+
+    Under load a cue that is already waiting to be played in the same channel absorbs any duplicates, and once
+    MAX_QUEUED_CUES are waiting the oldest is dropped. The bot leaves voice once nothing has been played for
+    idle_timeout seconds, e.g. after a game has ended.
+    """
+
+    MAX_QUEUED_CUES: Literal[4] = 4
+    DEFAULT_IDLE_TIMEOUT: Literal[300] = 300
+
+    def __init__(self, sound_bank: SoundBank, idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> None:
+        self.sound_bank: SoundBank = sound_bank
+        self.idle_timeout: float = idle_timeout
+        self._queue: deque[Cue] = deque()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._worker: asyncio.Task | None = None
+        self._voice_client: VoiceClient | None = None
+
+    def enqueue(self, channel: VoiceChannel, file_name: str) -> asyncio.Future:
+        """
+        Queues a sound to be played in a voice channel.
+
+        :param channel: Voice channel to play the sound in.
+        :param file_name: Name of a file in the sounds directory.
+        :return: Future that completes once the sound has finished playing (or has been dropped).
+        """
+
+        for cue in self._queue:
+            if cue.file_name == file_name and cue.channel.id == channel.id:
+                return cue.done
+
+        if len(self._queue) >= self.MAX_QUEUED_CUES:
+            dropped: Cue = self._queue.popleft()
+            dropped.done.set_result(None)
+            log.info(f"Dropped {dropped.file_name} as the audio queue is full.")
+
+        done: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queue.append(Cue(file_name, channel, done))
+        self._wakeup.set()
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        return done
+
+    async def _run(self) -> None:
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await self._leave()
+                    # A cue may have been queued while leaving, otherwise the next one starts a new worker.
+                    if not self._queue:
+                        return
+
+            cue: Cue = self._queue.popleft()
+
+            try:
+                await self._play(cue)
+            except (ClientException, OSError, subprocess.CalledProcessError, asyncio.TimeoutError) as ex:
+                log.error(f"Failed to play {cue.file_name} due to {ex}.")
+            finally:
+                if cue.done.done() is False:
+                    cue.done.set_result(None)
+
+    async def _connect(self, channel: VoiceChannel) -> VoiceClient:
+        voice_client: VoiceClient | None = self._voice_client or channel.guild.voice_client  # type: ignore[assignment]
+
+        if voice_client is None or voice_client.is_connected() is False:
+            voice_client = await channel.connect()
+        elif voice_client.channel.id != channel.id:
+            await voice_client.move_to(channel)
+
+        self._voice_client = voice_client
+        return voice_client
+
+    async def _play(self, cue: Cue) -> None:
+        voice_client: VoiceClient = await self._connect(cue.channel)
+        source: BufferedPCMAudio = await self.sound_bank.get(cue.file_name)
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        finished: asyncio.Future = loop.create_future()
+
+        def after(ex: Exception | None) -> None:
+            loop.call_soon_threadsafe(finished.set_result, ex)
+
+        voice_client.play(source, after=after)
+        await finished
+
+    async def _leave(self) -> None:
+        if self._voice_client is not None and self._voice_client.is_connected():
+            await self._voice_client.disconnect()
+
+        self._voice_client = None
+
+    async def disconnect(self) -> None:
+        """
+        Drops any queued cues and leaves voice, e.g. when the bot is shutting down.
+        """
+
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+        while self._queue:
+            self._queue.popleft().done.set_result(None)
+
+        await self._leave()
@@ -15,7 +15,8 @@ from onehead.common import (
     OneHeadException
 )
 from onehead.game import Game
-from onehead.protocols.database import OneHeadDatabase, Operation
+from onehead.messaging import Priority, send
+from onehead.protocols.database import OneHeadDatabase, Operation, WriteClass
 
 if TYPE_CHECKING:
     from onehead.core import Core
@@ -53,7 +54,7 @@ class Behaviour(Cog):
 
         bot: Bot = get_bot_instance()
         core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        previous_game: Game | None = core.previous_game
+        previous_game: Game | None = core.previous_game_for(ctx)
 
         if previous_game is None or previous_game.radiant is None or previous_game.dire is None:
             await ctx.send("Unable to commend as a game is yet to be played.")
@@ -100,14 +101,14 @@ class Behaviour(Cog):
 
         new_score: int = min(current_behaviour_score + self.COMMEND_MODIFIER, self.MAX_BEHAVIOUR_SCORE)
 
-        self.database.modify(commendee.id, "behaviour", new_score)
-        self.database.modify(commendee.id, "commends", 1, operation=Operation.ADD)
+        self.database.modify(commendee.id, "behaviour", new_score, write_class=WriteClass.COSMETIC)
+        self.database.modify(commendee.id, "commends", 1, Operation.ADD, WriteClass.COSMETIC)
 
         previous_game.add_commend(commender.display_name, commendee.display_name)
 
         log.info(f"{commender.display_name} commended {commendee.display_name}.")
 
-        await ctx.send(f"{commendee.mention} has been commended by {commender.mention}.")
+        send(ctx, f"{commendee.mention} has been commended by {commender.mention}.", Priority.COSMETIC)
 
     @has_role(Roles.MEMBER)
     @command()
@@ -118,7 +119,7 @@ class Behaviour(Cog):
 
         bot: Bot = get_bot_instance()
         core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        previous_game: Game | None = core.previous_game
+        previous_game: Game | None = core.previous_game_for(ctx)
 
         if previous_game is None or previous_game.radiant is None or previous_game.dire is None:
             await ctx.send("Unable to report as a game is yet to be played.")
@@ -167,11 +168,11 @@ class Behaviour(Cog):
 
         new_score: int = max(current_behaviour_score + self.REPORT_MODIFIER, self.MIN_BEHAVIOUR_SCORE)
 
-        self.database.modify(reported.id, "behaviour", new_score)
-        self.database.modify(reported.id, "reports", 1, Operation.ADD)
+        self.database.modify(reported.id, "behaviour", new_score, write_class=WriteClass.COSMETIC)
+        self.database.modify(reported.id, "reports", 1, Operation.ADD, WriteClass.COSMETIC)
 
         previous_game.add_report(reporter.display_name, reported.display_name)
 
         log.info(f"{reporter.display_name} reported {reported.display_name} for the following reason: {reason}.")
 
-        await ctx.send(f"{reported.mention} has been reported.")
+        send(ctx, f"{reported.mention} has been reported.", Priority.COSMETIC)
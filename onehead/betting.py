@@ -1,15 +1,30 @@
-from dataclasses import asdict
+from collections import Counter
+from datetime import datetime
+from enum import auto
 from logging import Logger
-from typing import Literal, TYPE_CHECKING, Any
+from typing import Iterable, Iterator, Literal, TYPE_CHECKING, Any
 
 from discord import Embed, colour
-from discord.member import Member
 from discord.ext.commands import Bot, Cog, Context, command, has_role
+from strenum import LowercaseStrEnum
 from structlog import get_logger
 from tabulate import tabulate
 
-from onehead.common import Bet, Player, Roles, Side, get_bot_instance, get_discord_member_from_name, play_sound
-from onehead.protocols.database import OneHeadDatabase, Operation
+from onehead.common import (
+    Bet,
+    EnumeratorMeta,
+    LedgerEntry,
+    OneHeadException,
+    Player,
+    Roles,
+    Side,
+    Team,
+    get_bot_instance,
+    play_sound,
+    record_checkpoint,
+)
+from onehead.messaging import Priority, send
+from onehead.protocols.database import LedgerReason, OneHeadDatabase, WriteClass
 
 
 if TYPE_CHECKING:
@@ -21,35 +36,173 @@ if TYPE_CHECKING:
 log: Logger = get_logger()
 
 
+class Market(LowercaseStrEnum, metaclass=EnumeratorMeta):
+    FIXED = auto()
+    PARIMUTUEL = auto()
+    MODEL = auto()
+
+
+class BetBook:
+    """
+    Bets placed on a game, along with totals that are kept up to date as each bet is placed: the pool and number of
+    bets on each side, how much each player has staked, and what each player would be paid out if either side won.
+    Settling the book and summarising it read these totals rather than going back over every bet. Players are keyed by
+    Discord id, with their display name kept in names for reports.
+
+    How bets are priced depends on the market:
+
+    - FIXED pays every winning bet at PRICE.
+    - PARIMUTUEL shares the whole pool between the winning bets in proportion to their stakes, so the price of a side
+      is the total pool divided by the pool on that side and is only settled once betting closes.
+    - MODEL prices each bet when it is placed from the chance of each side winning, which starts from the difference
+      in the teams' adjusted MMR and shifts towards the split of the pool as it grows past MODEL_LIQUIDITY RBUCKS.
+
+    Every price is a function of the running totals, so quoting one is O(1) however many bets have been placed. Prices
+    are locked when betting closes, after which no more bets are taken.
+    """
+
+    PRICE: float = 2.0
+    MODEL_SCALE: Literal[400] = 400
+    MODEL_LIQUIDITY: Literal[1000] = 1000
+
+    def __init__(self, bets: Iterable[Bet] = (), market: Market = Market.FIXED) -> None:
+        self.market: Market = market
+        self._bets: list[Bet] = []
+        self.pools: Counter[str] = Counter()
+        self.counts: Counter[str] = Counter()
+        self.exposure: Counter[int] = Counter()
+        self.names: dict[int, str] = {}
+        self._stakes: dict[str, Counter[int]] = {side: Counter() for side in Side}
+        self._payouts: dict[str, Counter[int]] = {side: Counter() for side in Side}
+        self._probabilities: dict[str, float] = {side: 0.5 for side in Side}
+        self._locked: dict[str, float | None] | None = None
+
+        for bet in bets:
+            self.append(bet)
+
+    def __len__(self) -> int:
+        return len(self._bets)
+
+    def __iter__(self) -> Iterator[Bet]:
+        return iter(self._bets)
+
+    def __getitem__(self, index: int) -> Bet:
+        return self._bets[index]
+
+    def set_teams(self, radiant: Team, dire: Team) -> None:
+        """
+        Sets the chance of each side winning that the MODEL market starts from, using an Elo style logistic curve.
+
+        :param radiant: Players on Radiant.
+        :param dire: Players on Dire.
+        """
+
+        radiant_mmr: float = sum(player.get("adjusted_mmr", player["mmr"]) for player in radiant) / len(radiant)
+        dire_mmr: float = sum(player.get("adjusted_mmr", player["mmr"]) for player in dire) / len(dire)
+
+        radiant_probability: float = 1 / (1 + 10 ** ((dire_mmr - radiant_mmr) / self.MODEL_SCALE))
+        self._probabilities = {Side.RADIANT: radiant_probability, Side.DIRE: 1 - radiant_probability}
+
+    def price(self, side: str) -> float | None:
+        """
+        Quotes the current price of a side.
+
+        :param side: Side to price.
+        :return: Decimal odds, or None if there is no parimutuel price yet as nobody has backed the side.
+        """
+
+        if self._locked is not None:
+            return self._locked[side]
+
+        if self.market == Market.PARIMUTUEL:
+            return self.total() / self.pools[side] if self.pools[side] else None
+
+        if self.market == Market.MODEL:
+            probability: float = (self._probabilities[side] * self.MODEL_LIQUIDITY + self.pools[side]) / (
+                self.MODEL_LIQUIDITY + self.total()
+            )
+            return 1 / probability
+
+        return self.PRICE
+
+    def total(self) -> int:
+        return sum(self.pools.values())
+
+    def lock(self) -> None:
+        self._locked = {side: self.price(side) for side in Side}
+
+    def locked(self) -> bool:
+        return self._locked is not None
+
+    def append(self, bet: Bet) -> None:
+        # A stake added once the prices are locked would be paid out of a pool that it was not priced against.
+        if self.locked():
+            raise OneHeadException(f"Betting has closed, unable to accept a bet from {bet.player}.")
+
+        if self.market != Market.PARIMUTUEL:
+            # A bet restored from the checkpoint log keeps the price it was quoted, as the book it is replayed into
+            # may not price it the same way.
+            if bet.price is None:
+                bet.price = self.price(bet.side)
+            self._payouts[bet.side][bet.player_id] += int(bet.stake * bet.price)  # type: ignore[operator]
+
+        self._bets.append(bet)
+        self.pools[bet.side] += bet.stake
+        self.counts[bet.side] += 1
+        self.exposure[bet.player_id] += bet.stake
+        self.names[bet.player_id] = bet.player
+        self._stakes[bet.side][bet.player_id] += bet.stake
+
+    def payouts(self, winner: str) -> dict[int, int]:
+        """
+        Obtains what each player is owed if a side wins, i.e. their returns on that side including their stakes.
+
+        :param winner: Winning side.
+        :return: Amount to credit to each player with a winning bet, keyed by Discord id.
+        """
+
+        if self.market != Market.PARIMUTUEL:
+            return dict(self._payouts[winner])
+
+        price: float | None = self.price(winner)
+        if price is None:
+            # Nobody backed the winner, so there is nobody to share the pool between and every stake is returned.
+            return dict(self.exposure)
+
+        return {player: int(stake * price) for player, stake in self._stakes[winner].items()}
+
+    def net(self, winner: str) -> dict[int, int]:
+        """
+        Obtains how much each player won or lost overall if a side wins.
+
+        :param winner: Winning side.
+        :return: Profit (or loss, if negative) of each player that placed a bet, keyed by Discord id.
+        """
+
+        payouts: dict[int, int] = self.payouts(winner)
+        return {player: payouts.get(player, 0) - stake for player, stake in self.exposure.items()}
+
+    def summary(self) -> str:
+        sides: list[str] = []
+
+        for side in Side:
+            price: float | None = self.price(side)
+            odds: str = "-" if price is None else f"{price:.2f}"
+            sides.append(f"{side.title()} `{self.pools[side]}` RBUCKS (`{self.counts[side]}` bets) @ `{odds}`")
+
+        return f"{self.market.title()} odds - {', '.join(sides)}"
+
+
 class Betting(Cog):
     INITIAL_BALANCE: Literal[100] = 100
     REWARD_ON_WIN: Literal[100] = 100
     REWARD_ON_LOSS: Literal[50] = 50
+    STATEMENT_LENGTH: Literal[10] = 10
 
     def __init__(self, database: OneHeadDatabase, lobby: "Lobby") -> None:
         self.database: OneHeadDatabase = database
         self.lobby: Lobby = lobby
 
-    def get_bet_results(self, radiant_won: bool) -> dict[str, list[float]]:
-        bot: Bot = get_bot_instance()
-        core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game = core.current_game
-
-        active_bets: list[Bet] = current_game.get_bets()
-
-        bet_results: dict[str, list[float]] = {}
-
-        for bet in active_bets:
-            if bet_results.get(bet.player) is None:
-                bet_results[bet.player] = []
-
-            if (radiant_won and bet.side == Side.RADIANT) or (radiant_won is False and bet.side == Side.DIRE):
-                bet_results[bet.player].append(bet.stake * 2.0)
-            else:
-                bet_results[bet.player].append(-1 * bet.stake)
-
-        return bet_results
-
     @has_role(Roles.MEMBER)
     @command()
     async def bets(self, ctx: Context) -> None:
@@ -58,16 +211,17 @@ class Betting(Cog):
         """
         bot: Bot = get_bot_instance()
         core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game = core.current_game
+        current_game: Game = core.game_for(ctx)
 
-        active_bets: list[Bet] = current_game.get_bets()
-        bets: list[dict[str, Any]] = [asdict(bet) for bet in active_bets]
+        book: BetBook = current_game.get_bets()
+        bets: list[dict[str, Any]] = [{"side": bet.side, "stake": bet.stake, "player": bet.player} for bet in book]
 
         table_of_bets: str = tabulate(bets, headers="keys", tablefmt="simple")
 
         # TODO: Can we make Radiant bets green and Dire bets red?
         embed: Embed = Embed(colour=colour.Colour.green())
         embed.add_field(name="Active Bets", value=f"```{table_of_bets}```")
+        embed.add_field(name="Pool", value=book.summary())
 
         await ctx.send(embed=embed)
 
@@ -82,9 +236,9 @@ class Betting(Cog):
 
         bot: Bot = get_bot_instance()
         core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game = core.current_game
+        current_game: Game = core.game_for(ctx)
 
-        bets: list[Bet] = current_game.get_bets()
+        bets: BetBook = current_game.get_bets()
 
         if current_game.betting_window_open() is False:
             await ctx.send("Betting window closed.")
@@ -102,48 +256,76 @@ class Betting(Cog):
         
         side = side.lower()
 
-        record: Player | None = self.database.get(ctx.author.id)
-        if record is None:
-            await ctx.send(f"Unable to find {ctx.author.mention} in database.")
-            return
+        # Hold this player's lock from reading their balance until the stake has been taken, so that two bets sent
+        # at the same time cannot both spend the same RBUCKS.
+        async with self.database.lock(ctx.author.id):
+            # Betting may have closed while waiting for the lock.
+            if bets.locked():
+                await ctx.send("Betting window closed.")
+                return
 
-        available_balance: int = record.get("rbucks", 0)
+            record: Player | None = self.database.get(ctx.author.id)
+            if record is None:
+                await ctx.send(f"Unable to find {ctx.author.mention} in database.")
+                return
 
-        if available_balance == 0:
-            await ctx.send(f"{ctx.author.mention} cannot bet as they have no available RBUCKS.")
-            return
+            available_balance: int = record.get("rbucks", 0)
 
-        if side not in Side:
-            await ctx.send(f"{ctx.author.mention} - Cannot bet on `{side}` - must be either Radiant/Dire.")
-            return
+            if available_balance == 0:
+                await ctx.send(f"{ctx.author.mention} cannot bet as they have no available RBUCKS.")
+                return
 
-        if amount == "all":
-            stake: int = available_balance
-        else:
-            try:
-                stake = int(amount)
-            except ValueError:
+            if side not in Side:
+                await ctx.send(f"{ctx.author.mention} - Cannot bet on `{side}` - must be either Radiant/Dire.")
+                return
+
+            if amount == "all":
+                stake: int = available_balance
+            else:
+                try:
+                    stake = int(amount)
+                except ValueError:
+                    await ctx.send(
+                        f"{ctx.author.mention} - `{amount}` is not a valid number of RBUCKS to place a bet with."
+                    )
+                    return
+
+            if stake <= 0:
+                await ctx.send(f"{ctx.author.mention} - Bet stake must be greater than 0.")
+                return
+
+            if stake > available_balance:
                 await ctx.send(
-                    f"{ctx.author.mention} - `{amount}` is not a valid number of RBUCKS to place a bet with."
+                    f"Unable to place bet - {ctx.author.mention} tried to stake `{stake:.0f}` RBUCKS but only has `{available_balance:.0f}` RBUCKS available."
                 )
                 return
 
-        if stake <= 0:
-            await ctx.send(f"{ctx.author.mention} - Bet stake must be greater than 0.")
-            return
+            if self.database.debit_if_sufficient(ctx.author.id, stake, LedgerReason.BET, current_game.id) is False:
+                await ctx.send(f"Unable to place bet - {ctx.author.mention} no longer has `{stake:.0f}` RBUCKS available.")
+                return
 
-        if stake > available_balance:
-            await ctx.send(
-                f"Unable to place bet - {ctx.author.mention} tried to stake `{stake:.0f}` RBUCKS but only has `{available_balance:.0f}` RBUCKS available."
+            bet: Bet = Bet(side, stake, ctx.author.display_name, ctx.author.id)
+            bets.append(bet)
+            record_checkpoint(
+                "bet",
+                id=current_game.id,
+                side=side,
+                stake=stake,
+                player=ctx.author.display_name,
+                player_id=ctx.author.id,
+                price=bet.price,
             )
-            return
 
-        bets.append(Bet(side, stake, ctx.author.display_name))
-        self.database.modify(ctx.author.id, "rbucks", stake, Operation.SUBTRACT)
+        # Parimutuel prices are not known until betting closes.
+        odds: str = "" if bet.price is None else f" at `{bet.price:.2f}`"
 
         await play_sound(ctx, "bet.mp3")
-        log.info(f"{ctx.author.display_name} has placed a bet of {stake:.0f} RBUCKS on {side.title()}.")
-        await ctx.send(f"{ctx.author.mention} has placed a bet of `{stake:.0f}` RBUCKS on {side.title()}.")
+        log.info(f"{ctx.author.display_name} has placed a bet of {stake:.0f} RBUCKS on {side.title()}{odds}.")
+        send(
+            ctx,
+            f"{ctx.author.mention} has placed a bet of `{stake:.0f}` RBUCKS on {side.title()}{odds}.",
+            Priority.GAME,
+        )
 
     @has_role(Roles.MEMBER)
     @command()
@@ -168,40 +350,60 @@ class Betting(Cog):
 
         await ctx.send(embed=embed)
 
+    @has_role(Roles.MEMBER)
+    @command()
+    async def statement(self, ctx: Context) -> None:
+        """
+        Lists your most recent RBUCKS transactions.
+        """
+
+        entries: list[LedgerEntry] = self.database.get_ledger(ctx.author.id, self.STATEMENT_LENGTH)
+        if not entries:
+            await ctx.send(f"{ctx.author.mention} has no RBUCKS transactions.")
+            return
+
+        rows: list[dict[str, Any]] = [
+            {
+                "date": datetime.fromtimestamp(entry["timestamp"]).strftime("%d/%m %H:%M"),
+                "game": entry["game_id"] or "-",
+                "reason": entry["reason"],
+                "RBUCKS": f"{entry['amount']:+d}",
+            }
+            for entry in reversed(entries)
+        ]
+        table: str = tabulate(rows, headers="keys", tablefmt="simple")
+
+        embed: Embed = Embed(title="**RBUCKS**", colour=colour.Colour.green())
+        embed.add_field(name=f"Statement for {ctx.author.display_name}", value=f"```{table}```")
+
+        await ctx.send(embed=embed)
+
     @staticmethod
-    def create_bet_report(bet_results: dict[str, list[float]]) -> Embed:
+    def create_bet_report(bet_results: dict[str, int]) -> Embed:
         contents: str = ""
 
-        for name, deltas in bet_results.items():
-            for delta in deltas:
-                won_or_lost: str = "won" if delta >= 0 else "lost"
-
-                # All bets are at an assumed price of 2.0, therefore need to divide by 2 to ignore the stake.
-                corrected_delta: int = int(delta) if delta <= 0 else int(delta / 2)
+        for name, delta in bet_results.items():
+            won_or_lost: str = "won" if delta >= 0 else "lost"
 
-                line: str = f"{name} {won_or_lost} {abs(corrected_delta)} RBUCKS!"
-                log.info(line)
-                contents += line
-                contents += "\n"
+            line: str = f"{name} {won_or_lost} {abs(delta)} RBUCKS!"
+            log.info(line)
+            contents += line
+            contents += "\n"
 
         embed: Embed = Embed(title="**RBUCKS**", colour=colour.Colour.green())
         embed.add_field(name="Bet Report", value=f"```{contents}```")
 
         return embed
 
-    async def refund_all_bets(self, ctx: Context) -> None:
-        bot: Bot = get_bot_instance()
-        core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game = core.current_game
-
-        active_bets: list[Bet] = current_game.get_bets()
+    async def refund_all_bets(self, ctx: Context, game: "Game") -> None:
+        book: BetBook = game.get_bets()
 
-        if len(active_bets) == 0:
+        if len(book) == 0:
             return
 
-        for bet in active_bets:
-            m: Member | None = get_discord_member_from_name(ctx, bet.player)
-            self.database.modify(m.id, "rbucks", bet.stake, Operation.ADD)
+        with self.database.transaction(WriteClass.BET) as transaction:
+            for id, stake in book.exposure.items():
+                transaction.credit(id, stake, LedgerReason.BET_REFUND, game.id)
 
         log.info("Refunded all bets.")
 
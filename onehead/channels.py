@@ -1,101 +1,228 @@
+import asyncio
 from logging import Logger
-from typing import TYPE_CHECKING
+from typing import Literal
 
 from discord import VoiceChannel
+from discord.abc import GuildChannel
 from discord.errors import HTTPException
 from discord.ext.commands import Bot, Cog, Context
 from discord.guild import Guild
 from discord.member import Member
 from structlog import get_logger
 
-from onehead.common import OneHeadException, get_bot_instance, get_player_names
+from onehead.common import OneHeadException, Player, get_bot_instance
 from onehead.game import Game
 
-if TYPE_CHECKING:
-    from onehead.core import Core
-
 
 log: Logger = get_logger()
 
 
 class Channels(Cog):
+    # Every move hits the same guild-scoped member route, so discord.py rate limits them as a single bucket per guild.
+    MAX_CONCURRENT_MOVES: Literal[5] = 5
+    MAX_MOVE_ATTEMPTS: Literal[3] = 3
+    MOVE_RETRY_DELAY: float = 0.5
+
     def __init__(self, config: dict) -> None:
         channel_config_settings: dict = config["discord"]["channels"]
-        self.channel_names: list[str] = [f"{channel_config_settings['match']} #{x}" for x in (1, 2)]
+        self.match_name: str = channel_config_settings["match"]
+        self.channel_names: list[str] = self.get_channel_names(1)
         self.lobby_name: str = channel_config_settings["lobby"]
-        self.ihl_discord_channels: list[VoiceChannel]
 
-    def get_discord_members(self, ctx: Context) -> tuple[list[Member], list[Member]]:
+        # Team channels of each game in progress, keyed by game id.
+        self.ihl_discord_channels: dict[int, list[VoiceChannel]] = {}
+        self._move_limits: dict[int, asyncio.Semaphore] = {}
+
+        # Channel ids keyed by guild id and then channel name, kept up to date by the guild channel event listeners
+        # so that starting a game never has to scan every channel in the guild.
+        self._channel_ids: dict[int, dict[str, int]] = {}
+
+    def get_channel_names(self, slot: int) -> list[str]:
+        """
+        Each concurrent game is given its own pair of team channels, the first game uses #1 and #2, the second #3 and
+        #4 and so on.
+
+        :param slot: Slot of the game, starting from 1.
+        :return: Names of the Radiant and Dire channels.
+        """
+
+        return [f"{self.match_name} #{x}" for x in (2 * slot - 1, 2 * slot)]
+
+    def _is_tracked(self, name: str) -> bool:
+        return name == self.lobby_name or name.startswith(f"{self.match_name} #")
+
+    def _get_channel_ids(self, guild: Guild) -> dict[str, int]:
+        channel_ids: dict[str, int] | None = self._channel_ids.get(guild.id)
+
+        if channel_ids is None:
+            channel_ids = {x.name: x.id for x in guild.voice_channels if self._is_tracked(x.name)}
+            self._channel_ids[guild.id] = channel_ids
+
+        return channel_ids
+
+    def get_voice_channel(self, guild: Guild, name: str) -> VoiceChannel | None:
+        channel_id: int | None = self._get_channel_ids(guild).get(name)
+        if channel_id is None:
+            return None
+
+        channel: GuildChannel | None = guild.get_channel(channel_id)
+        return channel if isinstance(channel, VoiceChannel) else None
+
+    @Cog.listener()
+    async def on_ready(self) -> None:
         bot: Bot = get_bot_instance()
-        core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game | None = core.current_game
+        for guild in bot.guilds:
+            await self.ensure_team_channels(guild)
+
+    @Cog.listener()
+    async def on_guild_channel_create(self, channel: GuildChannel) -> None:
+        if isinstance(channel, VoiceChannel) and self._is_tracked(channel.name):
+            self._get_channel_ids(channel.guild)[channel.name] = channel.id
+
+    @Cog.listener()
+    async def on_guild_channel_delete(self, channel: GuildChannel) -> None:
+        channel_ids: dict[str, int] = self._get_channel_ids(channel.guild)
+        if channel_ids.get(channel.name) == channel.id:
+            del channel_ids[channel.name]
+
+    @Cog.listener()
+    async def on_guild_channel_update(self, before: GuildChannel, after: GuildChannel) -> None:
+        if before.name != after.name:
+            await self.on_guild_channel_delete(before)
+            await self.on_guild_channel_create(after)
+
+    async def ensure_team_channels(self, guild: Guild, slot: int = 1) -> list[VoiceChannel]:
+        """
+        Creates any team channels that do not already exist.
+
+        :param guild: Guild to create the channels in.
+        :param slot: Slot of the game the channels are for.
+        :return: Team channels, in the same order as get_channel_names().
+        """
+
+        channels: list[VoiceChannel] = []
+
+        for name in self.get_channel_names(slot):
+            channel: VoiceChannel | None = self.get_voice_channel(guild, name)
+            if channel is None:
+                log.info(f"Creating {name} channel.")
+                channel = await guild.create_voice_channel(name)
+                self._get_channel_ids(guild)[name] = channel.id
 
-        if current_game is None or current_game.radiant is None or current_game.dire is None:
+            channels.append(channel)
+
+        return channels
+
+    def get_discord_members(self, ctx: Context, game: Game) -> tuple[list[Member], list[Member]]:
+        if game.radiant is None or game.dire is None:
             raise OneHeadException("Unable to get discord members due to invalid game state.")
 
-        t1_names: tuple[str, ...]
-        t2_names: tuple[str, ...]
+        guild: Guild | None = ctx.guild
+        if guild is None:
+            raise OneHeadException("No Guild associated with Discord Context")
 
-        t1_names, t2_names = get_player_names(current_game.radiant, current_game.dire)
+        def get_members(team: tuple[Player, ...]) -> list[Member]:
+            members: list[Member | None] = [guild.get_member(player["id"]) for player in team]
+            return [member for member in members if member is not None]
 
-        t1_discord_members: list[Member] = [x for x in ctx.guild.members if x.display_name in t1_names]
-        t2_discord_members: list[Member] = [x for x in ctx.guild.members if x.display_name in t2_names]
+        t1_discord_members: list[Member] = get_members(game.radiant)
+        t2_discord_members: list[Member] = get_members(game.dire)
 
         return t1_discord_members, t2_discord_members
 
-    async def create_discord_channels(self, ctx: Context) -> None:
+    async def _move_member(self, member: Member, channel: VoiceChannel) -> None:
+        if member.voice is None or member.voice.channel is None:
+            log.info(f"Not moving {member.display_name} to {channel.name} as they are not in a voice channel.")
+            return
+
+        if member.voice.channel.id == channel.id:
+            return
+
+        limit: asyncio.Semaphore = self._move_limits.setdefault(
+            channel.guild.id, asyncio.Semaphore(self.MAX_CONCURRENT_MOVES)
+        )
+
+        for attempt in range(1, self.MAX_MOVE_ATTEMPTS + 1):
+            try:
+                async with limit:
+                    await member.move_to(channel)
+                return
+            except HTTPException as ex:
+                # Only rate limits and server errors are worth retrying. Anything else, such as missing permissions or
+                # the member having left voice, fails the same way every time.
+                retryable: bool = ex.status == 429 or ex.status >= 500
+                if retryable is False or attempt == self.MAX_MOVE_ATTEMPTS:
+                    log.error(f"Failed to move {member.display_name} to {channel.name} due to {ex}.")
+                    return
+
+                await asyncio.sleep(self.MOVE_RETRY_DELAY * 2 ** (attempt - 1))
+
+    async def move_members(self, moves: list[tuple[Member, VoiceChannel]]) -> None:
+        """
+        Moves members to voice channels concurrently, with a bound on the number of moves in flight per guild. Failed
+        moves are retried with exponential backoff, members who are not in voice or are already in the target channel
+        are skipped.
+
+        :param moves: Members and the channel each of them should be moved to.
+        """
+
+        await asyncio.gather(*(self._move_member(member, channel) for member, channel in moves))
+
+    async def create_discord_channels(self, ctx: Context, game: Game) -> list[VoiceChannel]:
         """
-        We check if the channels already exist, if not we create them.
+        Resolves the team channels for a game from the channel cache, creating any that do not exist yet.
 
         :param ctx: Discord Context
+        :param game: Game that the channels are for.
+        :return: Radiant and Dire channels.
         """
 
         guild: Guild | None = ctx.guild
         if guild is None:
             raise OneHeadException("No Guild associated with Discord Context")
 
-        expected_ihl_channels: list[str] = [x.name for x in guild.voice_channels if x.name in self.channel_names]
-
-        for channel in self.channel_names:
-            if channel not in expected_ihl_channels:
-                await ctx.send(f"Creating {channel} channel")
-                await guild.create_voice_channel(channel)
+        channel_names: list[str] = self.get_channel_names(game.slot)
+        missing_channels: list[str] = [x for x in channel_names if self.get_voice_channel(guild, x) is None]
+        for channel in missing_channels:
+            await ctx.send(f"Creating {channel} channel")
 
-        self.ihl_discord_channels = [x for x in guild.voice_channels if x.name in self.channel_names]
+        self.ihl_discord_channels[game.id] = await self.ensure_team_channels(guild, game.slot)
+        return self.ihl_discord_channels[game.id]
 
-    async def move_back_to_lobby(self, ctx: Context) -> None:
+    async def move_back_to_lobby(self, ctx: Context, game: Game) -> None:
         """
         Move players back from IHL Team Channels to a communal channel.
 
         :param ctx: Discord Context
+        :param game: Game whose players should be moved.
         """
 
         guild: Guild | None = ctx.guild
         if guild is None:
             raise OneHeadException("No Guild associated with Discord Context")
 
-        lobby: VoiceChannel = [x for x in guild.voice_channels if x.name == self.lobby_name][0]
+        lobby: VoiceChannel | None = self.get_voice_channel(guild, self.lobby_name)
+        if lobby is None:
+            raise OneHeadException(f"Unable to find the {self.lobby_name} voice channel.")
 
         t1_discord_members: list[Member]
         t2_discord_members: list[Member]
 
-        t1_discord_members, t2_discord_members = self.get_discord_members(ctx)
+        t1_discord_members, t2_discord_members = self.get_discord_members(ctx, game)
 
-        for team in (t1_discord_members, t2_discord_members):
-            for player in team:
-                try:
-                    await player.move_to(lobby)
-                except HTTPException as ex:
-                    log.error(f"Failed to move {player.display_name} to {lobby.name} due to {ex}")
+        await self.move_members([(member, lobby) for member in t1_discord_members + t2_discord_members])
+        self.ihl_discord_channels.pop(game.id, None)
 
-    async def move_discord_channels(self, ctx: Context) -> None:
+    async def move_discord_channels(self, ctx: Context, game: Game) -> None:
         """
         Move players to IHL Team Channels.
 
         :param ctx: Discord Context
+        :param game: Game whose players should be moved.
         """
 
-        channel_count: int = len(self.ihl_discord_channels)
+        channels: list[VoiceChannel] = self.ihl_discord_channels.get(game.id, [])
+        channel_count: int = len(channels)
         if channel_count != 2:
             raise OneHeadException(f"Expected 2 Discord Channels, Identified {channel_count}.")
 
@@ -104,19 +231,14 @@ class Channels(Cog):
         t1_discord_members: list[Member]
         t2_discord_members: list[Member]
 
-        t1_discord_members, t2_discord_members = self.get_discord_members(ctx)
+        t1_discord_members, t2_discord_members = self.get_discord_members(ctx, game)
 
         t1_channel: VoiceChannel
         t2_channel: VoiceChannel
 
-        t1_channel, t2_channel = self.ihl_discord_channels
+        t1_channel, t2_channel = channels
 
-        for team, channel in (t1_discord_members, t1_channel), (
-            t2_discord_members,
-            t2_channel,
-        ):
-            for member in team:
-                try:
-                    await member.move_to(channel)
-                except HTTPException as ex:
-                    log.error(f"Failed to move {member.display_name} to {channel.name} due to {ex}.")
+        await self.move_members(
+            [(member, t1_channel) for member in t1_discord_members]
+            + [(member, t2_channel) for member in t2_discord_members]
+        )
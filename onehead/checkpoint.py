@@ -0,0 +1,199 @@
+import json
+import os
+from dataclasses import dataclass, field
+from logging import Logger
+from pathlib import Path
+from typing import IO, Any
+
+from structlog import get_logger
+
+
+log: Logger = get_logger()
+
+
+@dataclass
+class GameCheckpoint:
+    id: int
+    slot: int
+    radiant: list[int]
+    dire: list[int]
+    bets: list[dict[str, Any]] = field(default_factory=list)
+    transfers: list[dict[str, Any]] = field(default_factory=list)
+    windows: dict[str, float] = field(default_factory=dict)
+    closed_windows: list[str] = field(default_factory=list)
+    # Channel and message of the !start command, from which the game is announced.
+    channel: int | None = None
+    message: int | None = None
+    team_channels: list[int] = field(default_factory=list)
+
+
+@dataclass
+class GuildCheckpoint:
+    # Display names of the signups keyed by Discord id, in the order they signed up.
+    signups: dict[int, str] = field(default_factory=dict)
+    signups_disabled: bool = False
+    games: dict[int, GameCheckpoint] = field(default_factory=dict)
+
+
+class CheckpointLog:
+    """
+    Append-only log of lobby and game events, one small JSON line per event, from which signups and any games in
+    progress can be rebuilt after a restart. On recovery the log is folded into the live state and rewritten so that
+    finished games do not accumulate.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path: Path = path
+        self._file: IO[str] | None = None
+
+    def record(self, guild_id: int | None, event: str, fields: dict[str, Any]) -> None:
+        if self._file is None:
+            self._file = open(self._path, "a", encoding="utf-8")
+
+        self._file.write(json.dumps({"g": guild_id, "e": event, **fields}, separators=(",", ":")))
+        self._file.write("\n")
+        self._file.flush()
+
+    @staticmethod
+    def _apply(guilds: dict[int | None, GuildCheckpoint], record: dict[str, Any]) -> None:
+        guild: GuildCheckpoint = guilds.setdefault(record["g"], GuildCheckpoint())
+        event: str = record["e"]
+
+        if event == "signup":
+            guild.signups[record["id"]] = record["name"]
+        elif event == "signout":
+            guild.signups.pop(record["id"], None)
+        elif event == "signups":
+            guild.signups = {id: name for id, name in record["players"]}
+        elif event == "signups_disabled":
+            guild.signups_disabled = True
+        elif event == "signups_cleared":
+            guild.signups = {}
+            guild.signups_disabled = False
+        elif event == "game_started":
+            guild.games[record["id"]] = GameCheckpoint(
+                record["id"],
+                record["slot"],
+                record["radiant"],
+                record["dire"],
+                channel=record.get("channel"),
+                message=record.get("message"),
+            )
+        elif record.get("id") not in guild.games:
+            # Belongs to a game that has already ended.
+            return
+        elif event == "game_ended":
+            del guild.games[record["id"]]
+        elif event == "teams":
+            guild.games[record["id"]].radiant = record["radiant"]
+            guild.games[record["id"]].dire = record["dire"]
+        elif event == "bet":
+            guild.games[record["id"]].bets.append(
+                {
+                    "side": record["side"],
+                    "stake": record["stake"],
+                    "player": record["player"],
+                    "player_id": record["player_id"],
+                    "price": record.get("price"),
+                }
+            )
+        elif event == "transfer":
+            guild.games[record["id"]].transfers.append(
+                {"buyer": record["buyer"], "amount": record["amount"], "buyer_id": record["buyer_id"]}
+            )
+        elif event == "window_opened":
+            guild.games[record["id"]].windows[record["window"]] = record["deadline"]
+        elif event == "window_closed":
+            guild.games[record["id"]].windows.pop(record["window"], None)
+            guild.games[record["id"]].closed_windows.append(record["window"])
+        elif event == "team_channels":
+            guild.games[record["id"]].team_channels = record["channels"]
+        else:
+            log.warning(f"Ignoring unknown checkpoint event {event}.")
+
+    @staticmethod
+    def _snapshot(guilds: dict[int | None, GuildCheckpoint]) -> list[dict[str, Any]]:
+        """
+        Produces the shortest sequence of events that rebuilds the given state.
+
+        :param guilds: State of each guild.
+        :return: Checkpoint records.
+        """
+
+        records: list[dict[str, Any]] = []
+
+        for guild_id, guild in guilds.items():
+            if guild.signups:
+                records.append({"g": guild_id, "e": "signups", "players": list(guild.signups.items())})
+            if guild.signups_disabled:
+                records.append({"g": guild_id, "e": "signups_disabled"})
+
+            for game in guild.games.values():
+                records.append(
+                    {
+                        "g": guild_id,
+                        "e": "game_started",
+                        "id": game.id,
+                        "slot": game.slot,
+                        "radiant": game.radiant,
+                        "dire": game.dire,
+                        "channel": game.channel,
+                        "message": game.message,
+                    }
+                )
+                records.extend({"g": guild_id, "e": "bet", "id": game.id, **bet} for bet in game.bets)
+                records.extend(
+                    {"g": guild_id, "e": "transfer", "id": game.id, **transfer} for transfer in game.transfers
+                )
+                records.extend(
+                    {"g": guild_id, "e": "window_opened", "id": game.id, "window": window, "deadline": deadline}
+                    for window, deadline in game.windows.items()
+                )
+                records.extend(
+                    {"g": guild_id, "e": "window_closed", "id": game.id, "window": window}
+                    for window in game.closed_windows
+                )
+                if game.team_channels:
+                    records.append({"g": guild_id, "e": "team_channels", "id": game.id, "channels": game.team_channels})
+
+        return records
+
+    def recover(self) -> dict[int | None, GuildCheckpoint]:
+        """
+        Rebuilds the state of every guild from the log and then compacts the log down to that state.
+
+        :return: Signups and games in progress, keyed by guild id.
+        """
+
+        guilds: dict[int | None, GuildCheckpoint] = {}
+
+        if self._path.exists():
+            with open(self._path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record: dict[str, Any] = json.loads(line)
+                    except json.JSONDecodeError:
+                        log.warning(f"Discarding incomplete record at the end of {self._path.name}.")
+                        break
+
+                    self._apply(guilds, record)
+
+        guilds = {guild_id: guild for guild_id, guild in guilds.items() if guild.signups or guild.games}
+
+        tmp_path: Path = self._path.with_name(f"{self._path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self._snapshot(guilds):
+                f.write(json.dumps(record, separators=(",", ":")))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.close()
+        os.replace(tmp_path, self._path)
+
+        return guilds
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,18 +1,22 @@
-from asyncio import Event, sleep
+from asyncio import Future, Lock, Task, create_task
 import json
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from enum import EnumMeta, auto
 from pathlib import Path
-from typing import Any, Literal, Optional, TypedDict
+from logging import Logger
+from typing import Any, AsyncGenerator, Callable, Coroutine, Generic, Hashable, Literal, Optional, TypedDict, TypeVar
 
-from discord.channel import VoiceChannel
 from discord.ext.commands import Bot, Context
-from discord.errors import ClientException
+from discord.guild import Guild
 from discord.member import Member
-from discord.player import FFmpegPCMAudio
-from discord.voice_client import VoiceClient
 
 from strenum import LowercaseStrEnum, StrEnum
+from structlog import get_logger
+
+from onehead.audio import SoundBank, VoiceSession
+from onehead.checkpoint import CheckpointLog
 
 Player = TypedDict(
     "Player",
@@ -33,6 +37,17 @@ Player = TypedDict(
     },
 )
 
+LedgerEntry = TypedDict(
+    "LedgerEntry",
+    {
+        "id": int,
+        "amount": int,
+        "reason": str,
+        "game_id": int | None,
+        "timestamp": float,
+    },
+)
+
 Team = tuple[Player, Player, Player, Player, Player]
 TeamCombination = tuple[Team, Team]
 
@@ -46,11 +61,32 @@ Metadata = TypedDict(
     },
 )
 
+log: Logger = get_logger()
+
 # We need a globally accessible reference to the bot instance for event handlers that require Cog functionality.
 bot: Optional[Bot] = None
 
 ROOT_DIR: Path = Path(__file__).resolve().parent.parent
 
+sound_bank: SoundBank = SoundBank(Path(ROOT_DIR, "onehead/sounds"))
+
+voice_sessions: dict[int, VoiceSession] = {}
+
+checkpoint_log: CheckpointLog | None = None
+
+# The event loop only holds weak references to tasks, so tasks that nothing awaits are kept here until they finish.
+background_tasks: set[Task] = set()
+
+# Id of the guild whose event is currently being handled. It is set by the global event handlers and inherited by any
+# task they create, so per-guild state can be found without passing the guild through every call.
+current_guild_id: ContextVar[int | None] = ContextVar("current_guild_id", default=None)
+
+# Guild whose state is used outside of a guild event, such as at startup or for a direct message. Unless
+# discord.default_guild_id is configured, these use a shard of their own.
+default_guild_id: int | None = None
+
+T = TypeVar("T")
+
 
 class EnumeratorMeta(EnumMeta):
     def __contains__(cls, member: Any) -> bool:
@@ -78,6 +114,7 @@ class Side(LowercaseStrEnum, metaclass=EnumeratorMeta):
 class PlayerTransfer:
     buyer: str
     amount: int
+    buyer_id: int
 
 
 @dataclass
@@ -85,12 +122,114 @@ class Bet:
     side: str
     stake: int
     player: str
+    player_id: int
+    # Price the bet was placed at, set when it is added to a book that prices each bet as it is placed.
+    price: float | None = None
 
 
 class OneHeadException(BaseException):
     pass
 
 
+class KeyedLock:
+    """
+    Registry of asyncio locks keyed by an arbitrary value (e.g. a Discord id). Holders of different keys never block
+    each other, holders of the same key are serialised. Locks are discarded once nobody holds or awaits them.
+    """
+
+    def __init__(self) -> None:
+        self._locks: dict[Hashable, Lock] = {}
+        self._users: dict[Hashable, int] = {}
+
+    def locked(self, key: Hashable) -> bool:
+        lock: Lock | None = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def __call__(self, key: Hashable) -> AsyncGenerator[None, None]:
+        lock: Lock = self._locks.setdefault(key, Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                del self._users[key]
+                del self._locks[key]
+
+
+class GuildShards(Generic[T]):
+    """
+    Per-guild instances of a piece of state, keyed by guild id and created the first time a guild uses them. If
+    sharded is False every guild shares a single instance.
+    """
+
+    def __init__(self, factory: Callable[[int | None], T], sharded: bool = True) -> None:
+        self._factory: Callable[[int | None], T] = factory
+        self._sharded: bool = sharded
+        self._shards: dict[int | None, T] = {}
+
+    def get(self, guild_id: int | None = None) -> T:
+        key: int | None = (guild_id or get_current_guild_id()) if self._sharded else None
+        shard: T | None = self._shards.get(key)
+
+        if shard is None:
+            shard = self._factory(key)
+            self._shards[key] = shard
+
+        return shard
+
+    def peek(self, guild_id: int | None) -> T | None:
+        """
+        Looks up the shard of a guild without creating it.
+
+        :param guild_id: Guild to look up.
+        :return: Shard, or None if the guild has not used it yet.
+        """
+
+        return self._shards.get(guild_id if self._sharded else None)
+
+    def values(self) -> list[T]:
+        return list(self._shards.values())
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+
+class GuildAttribute(Generic[T]):
+    """
+    Attribute that is stored on the current guild's shard, found via the owner's _guilds, rather than on the instance.
+    """
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self._name: str = name.lstrip("_")
+
+    def __get__(self, instance: Any, owner: type) -> T:
+        if instance is None:
+            return self  # type: ignore[return-value]
+
+        return getattr(instance._guilds.get(), self._name)
+
+    def __set__(self, instance: Any, value: T) -> None:
+        setattr(instance._guilds.get(), self._name, value)
+
+
+def set_current_guild(guild: Guild | None) -> None:
+    current_guild_id.set(None if guild is None else guild.id)
+
+
+def get_current_guild_id() -> int | None:
+    guild_id: int | None = current_guild_id.get()
+    return default_guild_id if guild_id is None else guild_id
+
+
+def set_default_guild_id(guild_id: int | None) -> None:
+    global default_guild_id
+    default_guild_id = guild_id
+
+
 def get_bot_instance() -> Bot:
     if bot is None:
         raise OneHeadException("Global bot instance is None")
@@ -103,6 +242,64 @@ def set_bot_instance(new_bot_instance: Bot) -> None:
     bot = new_bot_instance
 
 
+def get_sound_bank() -> SoundBank:
+    return sound_bank
+
+
+def set_sound_bank(new_sound_bank: SoundBank) -> None:
+    global sound_bank
+    sound_bank = new_sound_bank
+
+
+def set_checkpoint_log(new_checkpoint_log: CheckpointLog | None) -> None:
+    global checkpoint_log
+    checkpoint_log = new_checkpoint_log
+
+
+def record_checkpoint(event: str, **fields: Any) -> None:
+    """
+    Appends an event to the checkpoint log for the current guild, if checkpointing is enabled.
+
+    :param event: Name of the event, see CheckpointLog._apply.
+    :param fields: Data associated with the event.
+    """
+
+    if checkpoint_log is not None:
+        checkpoint_log.record(get_current_guild_id(), event, fields)
+
+
+def create_background_task(coro: Coroutine[Any, Any, Any]) -> Task:
+    """
+    Starts a task that nothing is going to await, keeping hold of it until it finishes and logging any exception it
+    raises rather than losing it.
+
+    :param coro: Coroutine to run.
+    :return: Task running the coroutine.
+    """
+
+    task: Task = create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def _background_task_done(task: Task) -> None:
+    background_tasks.discard(task)
+
+    if task.cancelled() is False and task.exception() is not None:
+        log.error(f"Background task {task.get_name()} failed due to {task.exception()!r}.")
+
+
+def get_voice_session(guild_id: int) -> VoiceSession:
+    session: VoiceSession | None = voice_sessions.get(guild_id)
+
+    if session is None:
+        session = VoiceSession(sound_bank)
+        voice_sessions[guild_id] = session
+
+    return session
+
+
 def get_player_names(t1: "Team", t2: "Team") -> tuple[tuple[str, ...], tuple[str, ...]]:
     """
     Obtain player names from player profiles.
@@ -153,26 +350,18 @@ def get_discord_member_from_id(ctx: Context, id: int) -> Member | None:
     return None
 
 async def play_sound(ctx: Context, file_name: str, wait: bool = False) -> None:
-    
-    e: Event = Event()
-    
-    def sound_complete_callback(ex: Exception) -> None:
-        e.set()
-    
-    voice_client: VoiceClient | None = ctx.voice_client
-    if voice_client is None:
-        voice_channel: VoiceChannel | None = ctx.author.voice.channel
-        if voice_channel:
-            voice_client = await voice_channel.connect()
-    elif voice_client.channel.name != ctx.author.voice.channel.name:
-        await voice_client.move_to(ctx.author.voice.channel)
-    
-    while e.is_set() is False:   
-        try:
-            voice_client.play(FFmpegPCMAudio(f"onehead/sounds/{file_name}"), after=sound_complete_callback)
-            if wait:
-                await e.wait()
-            else:
-                e.set()
-        except ClientException:
-            await sleep(1)
+    """
+    Queues a sound to be played in the voice channel of whoever invoked the command.
+
+    :param ctx: Discord context.
+    :param file_name: Name of a file in onehead/sounds.
+    :param wait: If True, returns once the sound has finished playing rather than as soon as it is queued.
+    """
+
+    if ctx.guild is None or ctx.author.voice is None or ctx.author.voice.channel is None:
+        return
+
+    done: Future = get_voice_session(ctx.guild.id).enqueue(ctx.author.voice.channel, file_name)
+
+    if wait:
+        await done
@@ -1,8 +1,17 @@
+from asyncio import Future, gather
+from dataclasses import dataclass, field
+from itertools import count
 from logging import Logger
 from datetime import datetime
-
-from discord.member import Member
-from discord import Embed, Intents
+import time
+from pathlib import Path
+from typing import Any, Iterator, Sequence
+
+from discord.member import Member, VoiceState
+from discord import Embed, Intents, Object, VoiceChannel
+from discord.abc import Snowflake
+from discord.errors import HTTPException
+from discord.message import Message
 from discord.ext.commands import (
     Bot,
     BucketType,
@@ -16,28 +25,46 @@ from discord.ext.commands import (
 from structlog import get_logger
 from tabulate import tabulate
 
+from onehead.audio import SoundBank
 from onehead.behaviour import Behaviour
-from onehead.betting import Betting
+from onehead.betting import BetBook, Betting, Market
 from onehead.channels import Channels
+from onehead.checkpoint import CheckpointLog, GuildCheckpoint
 from onehead.common import (
+    Bet,
+    GuildAttribute,
+    GuildShards,
     OneHeadException,
+    Player,
+    PlayerTransfer,
     Roles,
     Side,
+    Team,
+    create_background_task,
     get_player_names,
     load_config,
     set_bot_instance,
     get_discord_member_from_name,
     Metadata,
-    play_sound
+    current_guild_id,
+    play_sound,
+    record_checkpoint,
+    set_checkpoint_log,
+    set_default_guild_id,
+    set_sound_bank,
+    voice_sessions,
+    ROOT_DIR,
 )
 from onehead.database import Database
-from onehead.game import Game
-from onehead.lobby import Lobby, on_presence_update, on_message
+from onehead.game import Game, Window
+from onehead.lobby import Lobby, on_cogs_changed, on_message, on_presence_update
 from onehead.matchmaking import Matchmaking
+from onehead.messaging import Messaging, Priority, send
 from onehead.mental_health import MentalHealth
-from onehead.protocols.database import OneHeadDatabase, Operation
+from onehead.protocols.database import LedgerReason, OneHeadDatabase, Operation
 from onehead.registration import Registration
 from onehead.scoreboard import ScoreBoard
+from onehead.throttle import Throttle
 from onehead.transfers import Transfers
 from version import __changelog__, __version__
 
@@ -45,6 +72,22 @@ from version import __changelog__, __version__
 log: Logger = get_logger()
 
 
+class OneHeadBot(Bot):
+    """
+    Bot that tells the lobby whenever a cog is added or removed, so that the command names it filters messages by are
+    rebuilt.
+    """
+
+    async def add_cog(self, cog: Cog, /, **kwargs: Any) -> None:
+        await super().add_cog(cog, **kwargs)
+        on_cogs_changed()
+
+    async def remove_cog(self, name: str, /, **kwargs: Any) -> Cog | None:
+        cog: Cog | None = await super().remove_cog(name, **kwargs)
+        on_cogs_changed()
+        return cog
+
+
 async def bot_factory() -> Bot:
     """
     Factory method for generating an instance of our Bot.
@@ -55,21 +98,35 @@ async def bot_factory() -> Bot:
     intents: Intents = Intents.all()
     intents.members = True
     intents.presences = True
-    bot: Bot = Bot(command_prefix="!", intents=intents)
+    bot: Bot = OneHeadBot(command_prefix="!", intents=intents)
 
     config: dict = load_config()
+    set_default_guild_id(config["discord"].get("default_guild_id"))
+
+    sound_config: dict = config.get("sounds", {})
+    max_bytes: int = (
+        sound_config["cache_size_mb"] * 1024 * 1024 if "cache_size_mb" in sound_config else SoundBank.DEFAULT_MAX_BYTES
+    )
+    sound_bank: SoundBank = SoundBank(Path(ROOT_DIR, "onehead/sounds"), max_bytes)
+    set_sound_bank(sound_bank)
+    if sound_config.get("prewarm", False):
+        create_background_task(sound_bank.prewarm())
 
     database: Database = Database(config)
     scoreboard: ScoreBoard = ScoreBoard(database)
-    lobby: Lobby = Lobby(database)
+    lobby: Lobby = Lobby(database, config)
     team_balance: Matchmaking = Matchmaking(database, lobby)
     channels: Channels = Channels(config)
-    registration: Registration = Registration(database)
+    registration: Registration = Registration(database, scoreboard)
     mental_health: MentalHealth = MentalHealth()
     betting: Betting = Betting(database, lobby)
     behaviour: Behaviour = Behaviour(database)
     transfers: Transfers = Transfers(database, lobby)
+    messaging: Messaging = Messaging()
+    throttle: Throttle = Throttle(config)
 
+    await bot.add_cog(messaging)
+    await bot.add_cog(throttle)
     await bot.add_cog(database)
     await bot.add_cog(lobby)
     await bot.add_cog(scoreboard)
@@ -86,6 +143,19 @@ async def bot_factory() -> Bot:
     core: Core = Core(bot, token)
     await bot.add_cog(core)
 
+    checkpoint_config: dict | None = config.get("checkpoint")
+    if checkpoint_config is not None:
+        checkpoint_log: CheckpointLog = CheckpointLog(Path(ROOT_DIR, checkpoint_config.get("path", "checkpoint.jsonl")))
+        recovered: dict[int | None, GuildCheckpoint] = checkpoint_log.recover()
+
+        for guild_id, guild_checkpoint in recovered.items():
+            current_guild_id.set(guild_id)
+            lobby.restore(guild_id, guild_checkpoint)
+            core.restore(guild_id, guild_checkpoint)
+        current_guild_id.set(None)
+
+        set_checkpoint_log(checkpoint_log)
+
     # Register events
     bot.event(on_presence_update)
     bot.event(on_message)
@@ -97,15 +167,44 @@ async def bot_factory() -> Bot:
     return bot
 
 
+@dataclass
+class GameState:
+    """
+    Games of a single guild. Started games are keyed by game id, along with indexes that route a player or a team
+    channel to the game they belong to. current_game is the game being organised from the lobby, or the most recently
+    started.
+    """
+
+    current_game: Game
+    previous_game: Game | None = None
+    games: dict[int, Game] = field(default_factory=dict)
+    player_games: dict[int, int] = field(default_factory=dict)
+    channel_games: dict[int, int] = field(default_factory=dict)
+    previous_games: dict[int, Game] = field(default_factory=dict)
+
+
 class Core(Cog):
-    def __init__(self, bot: Bot, token: str) -> None:
-        self.current_game: Game = Game()
-        self.previous_game: Game | None = None
+    # Each guild has its own games, these resolve to the state of the guild currently being handled.
+    current_game: GuildAttribute[Game] = GuildAttribute()
+    previous_game: GuildAttribute[Game | None] = GuildAttribute()
+    games: GuildAttribute[dict[int, Game]] = GuildAttribute()
+    _player_games: GuildAttribute[dict[int, int]] = GuildAttribute()
+    _channel_games: GuildAttribute[dict[int, int]] = GuildAttribute()
+    _previous_games: GuildAttribute[dict[int, Game]] = GuildAttribute()
 
+    def __init__(self, bot: Bot, token: str) -> None:
         self.bot: Bot = bot
         self.token: str = token
 
         self.config: dict = load_config()
+        self._game_ids: Iterator[int] = count(1)
+        self._max_concurrent_games: int = self.config.get("game", {}).get("max_concurrent_games", 1)
+        # Parsed up front, so that a typo in the config stops the bot starting rather than failing in the middle of a
+        # result when the next game is created.
+        self._market: Market = Market(self.config.get("betting", {}).get("market", Market.FIXED))
+        self._guilds: GuildShards[GameState] = GuildShards(lambda guild_id: GameState(self._new_game()))
+        self._resumable: list[tuple[int | None, Game, int, int | None]] = []
+
         self.behaviour: Behaviour = bot.get_cog("Behaviour")  # type: ignore[assignment]
         self.database: OneHeadDatabase = bot.get_cog("Database")  # type: ignore[assignment]
         self.scoreboard: ScoreBoard = bot.get_cog("ScoreBoard")  # type: ignore[assignment]
@@ -129,27 +228,198 @@ class Core(Cog):
         ):
             raise OneHeadException("Unable to find cog(s)")
 
-    async def reset(self, ctx: Context, game_cancelled=False) -> None:
+    async def cog_unload(self) -> None:
+        for session in voice_sessions.values():
+            await session.disconnect()
+
+    async def reset(self, ctx: Context, game: Game, game_cancelled=False) -> None:
+        self.unregister_game(game)
+        record_checkpoint("game_ended", id=game.id)
+
         if game_cancelled:
             self.previous_game = None
         else:
-            self.previous_game = self.current_game
+            self.previous_game = game
+            for player_id in game.player_ids:
+                self._previous_games[player_id] = game
+
+        if game is self.current_game:
+            self.current_game = self._new_game()
+            self.lobby.clear_signups()
+
+    def restore(self, guild_id: int | None, checkpoint: GuildCheckpoint) -> None:
+        """
+        Restores the games that were in progress in a guild when the bot last stopped, along with their bets, player
+        transfers, windows and team channels. Games that were still in their windows carry on with them once the bot
+        has connected, see resume_games.
+
+        :param guild_id: Guild the games belong to.
+        :param checkpoint: State recovered from the checkpoint log.
+        """
+
+        state: GameState = self._guilds.get(guild_id)
+
+        for game_checkpoint in checkpoint.games.values():
+            radiant: list[Player] = self.database.get_many(game_checkpoint.radiant)[0]
+            dire: list[Player] = self.database.get_many(game_checkpoint.dire)[0]
+            if len(radiant) != 5 or len(dire) != 5:
+                log.error(f"Unable to restore game {game_checkpoint.id} as some of its players are missing.")
+                continue
+
+            game: Game = self._new_game()
+            game.id = game_checkpoint.id
+            game.slot = game_checkpoint.slot
+            game.radiant, game.dire = tuple(radiant), tuple(dire)  # type: ignore[assignment]
+            game._bets.set_teams(game.radiant, game.dire)
+            for bet in game_checkpoint.bets:
+                game._bets.append(Bet(**bet))
+            game._player_transfers = [PlayerTransfer(**transfer) for transfer in game_checkpoint.transfers]
+            game.start()
+
+            for window in game_checkpoint.closed_windows:
+                game.restore_closed_window(Window(window))
+            for window, deadline in game_checkpoint.windows.items():
+                game.restore_window(Window(window), deadline - time.time())
+
+            self.register_game(game)
+            self.register_channels(game, [Object(id) for id in game_checkpoint.team_channels])
+            state.current_game = game
+
+            if not game_checkpoint.team_channels and game_checkpoint.channel is not None:
+                self._resumable.append((guild_id, game, game_checkpoint.channel, game_checkpoint.message))
+
+            log.info(
+                f"Restored game {game.id} with {len(game._bets)} bets and {len(game._player_transfers)} transfers."
+            )
+
+        # Game ids are only unique within this process, so carry on from the highest one that was restored.
+        restored_ids: list[int] = [game.id for game in state.games.values()]
+        self._game_ids = count(max(restored_ids + [next(self._game_ids)]) + 1)
+
+    @Cog.listener()
+    async def on_ready(self) -> None:
+        await self.resume_games()
+
+    async def resume_games(self) -> None:
+        """
+        Carries on with the games restored from the checkpoint log that were still in their transfer or betting
+        windows, in the same way as !start. Announcements go to the channel that the game was started from, and the
+        remaining windows are opened before the players are moved into their team channels.
+        """
+
+        while self._resumable:
+            guild_id, game, channel_id, message_id = self._resumable.pop()
+            current_guild_id.set(guild_id)
 
-        self.current_game = Game()
-        self.lobby.clear_signups()
-        await ctx.voice_client.disconnect()
+            channel: Any = self.bot.get_channel(channel_id)
+            if channel is None or message_id is None:
+                log.error(f"Unable to resume game {game.id} as the channel it was started from cannot be found.")
+                continue
+
+            try:
+                message: Message = await channel.fetch_message(message_id)
+            except HTTPException as ex:
+                log.error(f"Unable to resume game {game.id} as its !start message cannot be fetched: {ex}")
+                continue
+
+            ctx: Context = await self.bot.get_context(message)
+            log.info(f"Resuming game {game.id}.")
+            create_background_task(self._run_game(ctx, game, self.database.get_metadata()))
+
+        current_guild_id.set(None)
+
+    def register_game(self, game: Game) -> None:
+        if game.radiant is None or game.dire is None:
+            raise OneHeadException(f"Expected valid teams: {game.radiant}, {game.dire}")
+
+        self.games[game.id] = game
+        game.player_ids = tuple(player["id"] for player in game.radiant + game.dire)
+        for player_id in game.player_ids:
+            self._player_games[player_id] = game.id
+            # Commends and reports apply to a player's last game only until their next one starts.
+            self._previous_games.pop(player_id, None)
+
+    def register_channels(self, game: Game, channels: Sequence[Snowflake]) -> None:
+        game.channel_ids = tuple(channel.id for channel in channels)
+        for channel_id in game.channel_ids:
+            self._channel_games[channel_id] = game.id
+
+    def unregister_game(self, game: Game) -> None:
+        self.games.pop(game.id, None)
+
+        for player_id in game.player_ids:
+            if self._player_games.get(player_id) == game.id:
+                del self._player_games[player_id]
+
+        for channel_id in game.channel_ids:
+            if self._channel_games.get(channel_id) == game.id:
+                del self._channel_games[channel_id]
+
+    def game_for_player(self, player_id: int) -> Game | None:
+        game_id: int | None = self._player_games.get(player_id)
+        return None if game_id is None else self.games.get(game_id)
+
+    def game_for(self, ctx: Context) -> Game:
+        """
+        Routes a command to the game it relates to, which is the game the author is playing in, failing that the game
+        whose team channel the author is sat in, and otherwise the current game.
+
+        :param ctx: Discord context
+        :return: Game that the command applies to.
+        """
+
+        game: Game | None = self.game_for_player(ctx.author.id)
+        if game is not None:
+            return game
+
+        voice: VoiceState | None = getattr(ctx.author, "voice", None)
+        if voice is not None and voice.channel is not None:
+            game_id: int | None = self._channel_games.get(voice.channel.id)
+            if game_id is not None and game_id in self.games:
+                return self.games[game_id]
+
+        # Commands from anyone else, such as an admin who is not playing, are unambiguous while only one game is live.
+        if self.current_game.in_progress() is False and len(self.games) == 1:
+            return next(iter(self.games.values()))
+
+        return self.current_game
+
+    def _resolve_game(self, ctx: Context, game_id: int | None) -> Game | None:
+        return self.game_for(ctx) if game_id is None else self.games.get(game_id)
+
+    def previous_game_for(self, ctx: Context) -> Game | None:
+        return self._previous_games.get(ctx.author.id, self.previous_game)
+
+    def _free_slot(self) -> int:
+        slots: set[int] = {game.slot for game in self.games.values()}
+        return next(slot for slot in count(1) if slot not in slots)
+
+    def _new_game(self) -> Game:
+        game_config: dict = self.config.get("game", {})
+
+        window_durations: dict[Window, int] | None = None
+        if "window_durations" in game_config:
+            window_durations = {Window(name): seconds for name, seconds in game_config["window_durations"].items()}
+
+        window_sequence: tuple[tuple[Window, ...], ...] | None = None
+        if "window_sequence" in game_config:
+            window_sequence = tuple(tuple(Window(name) for name in stage) for stage in game_config["window_sequence"])
+
+        return Game(window_durations, window_sequence, next(self._game_ids), self._market)
 
     async def show_teams(self, ctx: Context) -> None:
         status: Command = self.bot.get_command("status")  # type: ignore[assignment]
         await Command.invoke(status, ctx)
     
-    async def setup_team_channels(self, ctx: Context) -> None:        
-        await self.channels.create_discord_channels(ctx)
+    async def setup_team_channels(self, ctx: Context, game: Game) -> None:
+        channels: list[VoiceChannel] = await self.channels.create_discord_channels(ctx, game)
+        self.register_channels(game, channels)
+        record_checkpoint("team_channels", id=game.id, channels=list(game.channel_ids))
 
-        if self.current_game.radiant is None or self.current_game.dire is None:
-            raise OneHeadException(f"Expected valid teams: {self.current_game.radiant}, {self.current_game.dire}")
+        if game.radiant is None or game.dire is None:
+            raise OneHeadException(f"Expected valid teams: {game.radiant}, {game.dire}")
 
-        await self.channels.move_discord_channels(ctx)
+        await self.channels.move_discord_channels(ctx, game)
         await ctx.send("Create Dota 2 Lobby and join with the above teams.")
     
     @has_role(Roles.ADMIN)
@@ -160,10 +430,17 @@ class Core(Cog):
         Starts an IHL game.
         """
 
+        live_games: set[int] = set(self.games)
         if self.current_game.in_progress():
+            live_games.add(self.current_game.id)
+
+        if len(live_games) >= self._max_concurrent_games:
             await ctx.send("Game already in progress...")
             return
 
+        if self.current_game.in_progress():
+            self.current_game = self._new_game()
+
         signup_threshold_met: bool = await self.lobby.signup_check(ctx)
         if signup_threshold_met is False:
             return
@@ -174,25 +451,56 @@ class Core(Cog):
         
         await self.lobby.select_players(ctx)
 
-        self.current_game.start()
+        game: Game = self.current_game
+        game.start()
         self.lobby.disable_signups()
 
-        (
-            self.current_game.radiant,
-            self.current_game.dire,
-        ) = await self.matchmaking.balance(ctx)
-        
+        game.radiant, game.dire = await self.matchmaking.balance(ctx)
+        game.slot = self._free_slot()
+        self.register_game(game)
+        record_checkpoint(
+            "game_started",
+            id=game.id,
+            slot=game.slot,
+            radiant=[player["id"] for player in game.radiant],
+            dire=[player["id"] for player in game.dire],
+            channel=ctx.channel.id,
+            message=ctx.message.id,
+        )
+
         await self.show_teams(ctx)
-        await self.current_game.open_transfer_window(ctx)
-        await self.current_game.open_betting_window(ctx)
-        await self.setup_team_channels(ctx)
 
-        if self.current_game.in_progress():
+        # The windows stay open for minutes, so they run after !start returns rather than holding up other commands.
+        create_background_task(self._run_game(ctx, game, metadata))
+
+    async def _run_game(self, ctx: Context, game: Game, metadata: Metadata) -> None:
+        """
+        Runs the transfer and betting windows of a game that has just been started, then moves its players into their
+        team channels.
+
+        :param ctx: Discord context.
+        :param game: Game that has been started.
+        :param metadata: Season and game number being played.
+        """
+
+        await game.run_windows(ctx)
+
+        # The game may have been stopped while its windows were open, in which case there are no teams to move.
+        if game.in_progress() is False:
+            return
+
+        await self.setup_team_channels(ctx, game)
+
+        if game.in_progress():
             await ctx.send("GLHF")
 
+            # Open the lobby back up so that the next game can be organised while this one is being played.
+            if len(self.games) < self._max_concurrent_games:
+                self.lobby.clear_signups()
+
             radiant: tuple[str, ...]
             dire: tuple[str, ...]
-            radiant, dire = get_player_names(self.current_game.radiant, self.current_game.dire)
+            radiant, dire = get_player_names(game.radiant, game.dire)
 
             log.info(f"Season {metadata['season']}, Game {metadata['game_id']} has started.")
             log.info(f"Radiant: {', '.join(radiant)}, Dire: {', '.join(dire)}.")
@@ -200,41 +508,94 @@ class Core(Cog):
     @has_role(Roles.ADMIN)
     @command()
     @max_concurrency(1, per=BucketType.default, wait=False)
-    async def stop(self, ctx: Context) -> None:
+    async def stop(self, ctx: Context, game_id: int | None = None) -> None:
         """
         Cancels an IHL game.
         """
 
-        if self.current_game.in_progress():
-            self.current_game.cancel()
+        game: Game | None = self._resolve_game(ctx, game_id)
+
+        if game is not None and game.in_progress():
+            game.cancel()
             log.info(f"Game was cancelled by {ctx.author.display_name}.")
             await ctx.send("Game cancelled.")
-            await self.betting.refund_all_bets(ctx)
-            await self.transfers.refund_transfers(ctx)
-            await self.channels.move_back_to_lobby(ctx)
-            await self.reset(ctx, game_cancelled=True)
+            await self.betting.refund_all_bets(ctx, game)
+            await self.transfers.refund_transfers(ctx, game)
+            await self.channels.move_back_to_lobby(ctx, game)
+            await self.reset(ctx, game, game_cancelled=True)
         else:
             await ctx.send("No currently active game.")
 
+    @has_role(Roles.ADMIN)
+    @command(aliases=["extend"])
+    async def extend_window(self, ctx: Context, window: str, seconds: int = 60, game_id: int | None = None) -> None:
+        """
+        Extends an open transfer or betting window by a number of seconds.
+        """
+
+        window = window.lower()
+        game: Game | None = self._resolve_game(ctx, game_id)
+
+        if game is None:
+            await ctx.send("No currently active game.")
+            return
+
+        if window not in Window:
+            await ctx.send(f"Must be either {Window.TRANSFER} or {Window.BETTING}.")
+            return
+
+        if game.window_open(Window(window)) is False:
+            await ctx.send(f"The {window} window is not currently open.")
+            return
+
+        remaining: float = game.extend_window(Window(window), seconds)
+        await ctx.send(f"The {window} window has been extended and now closes in `{int(remaining)}` seconds.")
+
+    @has_role(Roles.ADMIN)
+    @command(aliases=["close"])
+    async def close_window(self, ctx: Context, window: str, game_id: int | None = None) -> None:
+        """
+        Closes an open transfer or betting window early.
+        """
+
+        window = window.lower()
+        game: Game | None = self._resolve_game(ctx, game_id)
+
+        if game is None:
+            await ctx.send("No currently active game.")
+            return
+
+        if window not in Window:
+            await ctx.send(f"Must be either {Window.TRANSFER} or {Window.BETTING}.")
+            return
+
+        if game.window_open(Window(window)) is False:
+            await ctx.send(f"The {window} window is not currently open.")
+            return
+
+        await game.close_window(Window(window))
+
     @has_role(Roles.ADMIN)
     @command()
     @max_concurrency(1, per=BucketType.default, wait=False)
-    async def result(self, ctx: Context, result: str) -> None:
+    async def result(self, ctx: Context, result: str, game_id: int | None = None) -> None:
         """
         Provide the result of game that has finished.
         """
 
-        if self.current_game.in_progress() is False:
+        game: Game | None = self._resolve_game(ctx, game_id)
+
+        if game is None or game.in_progress() is False:
             await ctx.send("No currently active game.")
             return
 
-        if self.current_game.transfer_window_open():
+        if game.transfer_window_open():
             await ctx.send(
                 "Cannot enter result as the transfer window for the game is currently open. Use the `!stop` command if you wish to abort the game."
             )
             return
 
-        if self.current_game.betting_window_open():
+        if game.betting_window_open():
             await ctx.send(
                 "Cannot enter result as the betting window for the game is currently open. Use the `!stop` command if you wish to abort the game."
             )
@@ -246,81 +607,108 @@ class Core(Cog):
             await ctx.send(f"Must be either {Side.RADIANT} or {Side.DIRE}.")
             return
 
-        await self.channels.move_back_to_lobby(ctx)
-
         log.info(f"{ctx.author.display_name} entered a result of {result}.")
 
-        if self.current_game.radiant is None or self.current_game.dire is None:
-            raise OneHeadException(f"Expected valid teams: {self.current_game.radiant}, {self.current_game.dire}")
+        if game.radiant is None or game.dire is None:
+            raise OneHeadException(f"Expected valid teams: {game.radiant}, {game.dire}")
 
+        start: float = time.perf_counter()
         metadata: Metadata = self.database.get_metadata()
 
         log.info(f"Game {metadata['game_id']} has ended.")
 
-        radiant_names: tuple[str, ...]
-        dire_names: tuple[str, ...]
-
-        radiant_names, dire_names = get_player_names(self.current_game.radiant, self.current_game.dire)
-       
-        await play_sound(ctx, "result.mp3", wait=True)
-       
-        if result == Side.RADIANT:
-            await ctx.send("`Radiant` victory!")
-            for player in radiant_names:
-                m: Member | None = get_discord_member_from_name(ctx, player)
-                self.database.modify(m.id, "win", 1, Operation.ADD)
-                self.database.modify(m.id, "win_streak", 1, Operation.ADD)
-                self.database.modify(m.id, "loss_streak", 0)
-                self.database.modify(m.id, "rbucks", Betting.REWARD_ON_WIN, Operation.ADD)
-            for player in dire_names:
-                m: Member | None = get_discord_member_from_name(ctx, player)
-                self.database.modify(m.id, "loss", 1, Operation.ADD)
-                self.database.modify(m.id, "loss_streak", 1, Operation.ADD)
-                self.database.modify(m.id, "win_streak", 0)
-                self.database.modify(m.id, "rbucks", Betting.REWARD_ON_LOSS, Operation.ADD)
-        elif result == Side.DIRE:
-            await ctx.send("`Dire` victory!")
-            for player in radiant_names:
-                m: Member | None = get_discord_member_from_name(ctx, player)
-                self.database.modify(m.id, "loss", 1, Operation.ADD)
-                self.database.modify(m.id, "loss_streak", 1, Operation.ADD)
-                self.database.modify(m.id, "win_streak", 0)
-                self.database.modify(m.id, "rbucks", Betting.REWARD_ON_LOSS, Operation.ADD)
-            for player in dire_names:
-                m: Member | None = get_discord_member_from_name(ctx, player)
-                self.database.modify(m.id, "win", 1, Operation.ADD)
-                self.database.modify(m.id, "win_streak", 1, Operation.ADD)
-                self.database.modify(m.id, "loss_streak", 0)
-                self.database.modify(m.id, "rbucks", Betting.REWARD_ON_WIN, Operation.ADD)
-
-        await ctx.send("Updating scores...")
-        scoreboard: Command = self.bot.get_command("scoreboard")  # type: ignore[assignment]
-        await Command.invoke(scoreboard, ctx)
-        
-        bet_results: dict = self.betting.get_bet_results(result == Side.RADIANT)
+        winners: Team
+        losers: Team
+        winners, losers = (game.radiant, game.dire) if result == Side.RADIANT else (game.dire, game.radiant)
 
-        for name, bets in bet_results.items():
-            for bet_result in bets:
-                if bet_result > 0:
-                    m: Member | None = get_discord_member_from_name(ctx, name)
-                    self.database.modify(m.id, "rbucks", bet_result, Operation.ADD)
+        book: BetBook = game.get_bets()
+        bet_results: dict[str, int] = {book.names[id]: net for id, net in book.net(result).items()}
+        player_ids: list[int] = [player["id"] for player in winners + losers]
+        self.scoreboard.prepare_delta(player_ids)
 
-        if len(bet_results) > 0:
-            report: Embed = self.betting.create_bet_report(bet_results)
-            await ctx.send(embed=report)
-            
-        await self.reset(ctx)
-        
         metadata["game_id"] += 1
-        self.database.update_metadata(metadata)
-
-        if self.is_end_of_season():
-            await ctx.send(f"Season `{metadata['season']}` has ended!")
+        end_of_season: bool = self.is_end_of_season(metadata)
+        ended_season: int | None = None
+        if end_of_season:
+            ended_season = metadata["season"]
             metadata["season"] += 1
             metadata["game_id"] = 1
-            self.database.update_metadata(metadata)
+
+        # Stage every change for this result and commit them together before anything else happens, so that commands
+        # such as !sb or !rbucks never observe a half-applied result and nothing below can hold up the commit.
+        with self.database.transaction() as transaction:
+            for player in winners:
+                transaction.modify(player["id"], "win", 1, Operation.ADD)
+                transaction.modify(player["id"], "win_streak", 1, Operation.ADD)
+                transaction.modify(player["id"], "loss_streak", 0)
+                transaction.credit(player["id"], Betting.REWARD_ON_WIN, LedgerReason.WIN_REWARD, game.id)
+            for player in losers:
+                transaction.modify(player["id"], "loss", 1, Operation.ADD)
+                transaction.modify(player["id"], "loss_streak", 1, Operation.ADD)
+                transaction.modify(player["id"], "win_streak", 0)
+                transaction.credit(player["id"], Betting.REWARD_ON_LOSS, LedgerReason.LOSS_REWARD, game.id)
+
+            for id, payout in book.payouts(result).items():
+                transaction.credit(id, payout, LedgerReason.BET_PAYOUT, game.id)
+
+            transaction.update_metadata(metadata)
+
+        leaderboard_changes: list[dict[str, Any]] = self.scoreboard.apply_delta(self.database.get_many(player_ids)[0])
+        # Check the balances this result moved against the ledger, any mismatch is logged for an admin to look at with
+        # !reconcile.
+        self.database.reconcile(ids=player_ids + list(book.exposure))
+        await self.reset(ctx, game)
+
+        # Everything else only presents the committed result, so the steps run side by side rather than one after the
+        # other, and a failure in one of them does not stop the rest.
+        outcomes: list = await gather(
+            self.channels.move_back_to_lobby(ctx, game),
+            play_sound(ctx, "result.mp3", wait=True),
+            self._announce_result(ctx, result, leaderboard_changes, bet_results, ended_season),
+            return_exceptions=True,
+        )
+
+        # OneHeadException is a BaseException, so checking for Exception would miss it.
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                log.error(f"Failed to complete result handling due to {outcome}.")
+
+        log.info(f"Result of game {game.id} handled in {time.perf_counter() - start:.2f}s.")
+
+    async def _announce_result(
+        self,
+        ctx: Context,
+        result: str,
+        leaderboard_changes: list[dict[str, Any]],
+        bet_results: dict[str, int],
+        ended_season: int | None,
+    ) -> None:
+        """
+        Announces the result of a game along with how the leaderboard changed and the outcome of any bets.
+
+        :param ctx: Discord context.
+        :param result: Winning side.
+        :param leaderboard_changes: Rating and rank changes of the players involved, see ScoreBoard.apply_delta.
+        :param bet_results: Profit or loss of each player that placed a bet.
+        :param ended_season: Season that this game was the last of, if any.
+        """
+
+        changes: str = tabulate(leaderboard_changes, headers="keys", tablefmt="simple")
+
+        # Everything is queued in the admin lane, ahead of anything cosmetic, so it goes out in this order.
+        send(ctx, f"`{result.title()}` victory!", Priority.ADMIN)
+        announced: Future = send(ctx, f"**Leaderboard Changes** ```\n{changes}```", Priority.ADMIN)
+
+        if len(bet_results) > 0:
+            report: Embed = self.betting.create_bet_report(bet_results)
+            announced = send(ctx, "", Priority.ADMIN, report)
+
+        if ended_season is not None:
+            announced = send(ctx, f"Season `{ended_season}` has ended!", Priority.ADMIN)
             # TODO: Make a big song and dance about the end of an IHL season, present winners, go crazy.
 
+        await announced
+
     @has_role(Roles.MEMBER)
     @command()
     async def status(self, ctx: Context) -> None:
@@ -328,24 +716,40 @@ class Core(Cog):
         If a game is active, displays the teams and their respective players.
         """
 
-        if self.current_game.in_progress() and self.current_game.radiant and self.current_game.dire:
+        games: list[Game] = [game for game in self.games.values() if game.in_progress()]
+        if not games and self.current_game.in_progress():
+            games = [self.current_game]
+
+        games = [game for game in games if game.radiant and game.dire]
+        if not games:
+            await ctx.send("No currently active game.")
+            return
+
+        metadata: Metadata = self.database.get_metadata()
+        shown: list[Future] = []
+
+        for game in games:
             t1_names: tuple[str, ...]
             t2_names: tuple[str, ...]
-            t1_names, t2_names = get_player_names(self.current_game.radiant, self.current_game.dire)
-            
+            t1_names, t2_names = get_player_names(game.radiant, game.dire)
+
             players: dict[Side, tuple[str, ...]] = {
                 Side.RADIANT: t1_names,
                 Side.DIRE: t2_names,
             }
             in_game_players: str = tabulate(players, headers="keys", tablefmt="simple")
-            metadata: Metadata = self.database.get_metadata()
-
-            await ctx.send(
-                f"**Current Game** - Season `{metadata['season']}`, Game `{metadata['game_id']}` ```\n"
-                f"{in_game_players}```"
+            heading: str = "**Current Game**" if len(games) == 1 else f"**Game** `#{game.id}`"
+
+            # Sent through the outbox so that the teams follow any announcement queued ahead of them, e.g. a shuffle.
+            shown.append(
+                send(
+                    ctx,
+                    f"{heading} - Season `{metadata['season']}`, Game `{metadata['game_id']}` ```\n"
+                    f"{in_game_players}```",
+                )
             )
-        else:
-            await ctx.send("No currently active game.")
+
+        await gather(*shown)
 
     @has_role(Roles.MEMBER)
     @command()
@@ -375,8 +779,8 @@ class Core(Cog):
 
         await ctx.send(f"Season `{metadata['season']}` started on: `{dt}`")
 
-    def is_end_of_season(self) -> bool:
-        metadata: Metadata = self.database.get_metadata()
+    @staticmethod
+    def is_end_of_season(metadata: Metadata) -> bool:
         return (metadata["game_id"] < metadata["max_game_count"]) is False
 
     @has_role(Roles.ADMIN)
@@ -385,7 +789,7 @@ class Core(Cog):
         """
         For testing purposes.
         """
-        self.lobby._signups += [
+        for name in [
             "ERIC",
             "GEE",
             "JEFFERIES",
@@ -396,4 +800,7 @@ class Core(Cog):
             "JAMES",
             "LUKE",
             "ZEE",
-        ]
+        ]:
+            member: Member | None = get_discord_member_from_name(ctx, name)
+            if member is not None:
+                self.lobby._signups.add(member.id, name)
@@ -1,30 +1,245 @@
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from logging import Logger
 from pathlib import Path
-from typing import cast
+from typing import AsyncContextManager, Callable, ContextManager, Generator, Iterable, cast
 import time
 
 from discord.ext import commands
+from discord.ext.commands import Context, command, has_role
+from structlog import get_logger
+from tabulate import tabulate
 from tinydb import Query, TinyDB
 from tinydb.operations import add, subtract
 from tinydb.table import Document, Table
 
 from onehead.behaviour import Behaviour
 from onehead.betting import Betting
-from onehead.common import OneHeadException, Player, Metadata, ROOT_DIR
-from onehead.protocols.database import Operation
+from onehead.common import (
+    GuildAttribute,
+    GuildShards,
+    KeyedLock,
+    LedgerEntry,
+    OneHeadException,
+    Player,
+    Metadata,
+    ROOT_DIR,
+    Roles,
+)
+from onehead.protocols.database import Durability, LedgerReason, Operation, WriteClass
+from onehead.storage import CommitMetrics, JournaledStorage, Ledger
+
+
+log: Logger = get_logger()
+
+
+def ledger_entry(id: int, amount: int, reason: LedgerReason, game_id: int | None = None) -> LedgerEntry:
+    return {"id": id, "amount": amount, "reason": reason.value, "game_id": game_id, "timestamp": time.time()}
+
+
+def check_key(key: str) -> None:
+    if key == "rbucks":
+        raise OneHeadException("RBUCKS can only be moved with credit or debit_if_sufficient, which record the ledger.")
+
+
+class Transaction:
+    """
+    Stages changes to any number of players (and optionally the season metadata) so that they are committed as one
+    unit. Until the transaction is committed, readers continue to see the previously committed records.
+    """
+
+    def __init__(self) -> None:
+        self.updates: list[tuple[int, str, str | int, Operation]] = []
+        self.entries: list[LedgerEntry] = []
+        self.metadata: Metadata | None = None
+
+    def modify(
+        self,
+        id: int,
+        key: str,
+        value: str | int,
+        operation: Operation = Operation.REPLACE,
+    ) -> None:
+        check_key(key)
+        self.updates.append((id, key, value, operation))
+
+    def credit(self, id: int, amount: int, reason: LedgerReason, game_id: int | None = None) -> None:
+        """
+        Stages a change to a player's RBUCKS, along with the ledger entry that records why.
+
+        :param id: Discord id of the player.
+        :param amount: Number of RBUCKS to add, negative to take RBUCKS away.
+        :param reason: Why the RBUCKS moved.
+        :param game_id: Game the RBUCKS moved for, if any.
+        """
+
+        self.updates.append((id, "rbucks", amount, Operation.ADD))
+        self.entries.append(ledger_entry(id, amount, reason, game_id))
+
+    def update_metadata(self, data: Metadata) -> None:
+        self.metadata = data
+
+
+@dataclass
+class GuildDatabase:
+    db: TinyDB
+    storage: JournaledStorage
+    players: Table
+    metadata: Table
+    ledger: Ledger
+    # Entries are never changed once written, so each player's entries are kept in memory in the order they were
+    # written, along with their running total. Neither ever needs a pass over the ledger file after startup.
+    ledger_index: dict[int, list[LedgerEntry]] = field(default_factory=dict)
+    ledger_totals: Counter[int] = field(default_factory=Counter)
+
+    def record(self, entries: list[LedgerEntry], durability: Durability = Durability.STRICT) -> None:
+        self.ledger.append(cast(list[dict], entries), durability)
+        self.index(entries)
+
+    def index(self, entries: Iterable[LedgerEntry]) -> None:
+        for entry in entries:
+            self.ledger_index.setdefault(entry["id"], []).append(entry)
+            self.ledger_totals[entry["id"]] += entry["amount"]
+
+    def reconcile(self, repair: bool = False, ids: Iterable[int] | None = None) -> dict[int, tuple[int, int]]:
+        """
+        Checks players' materialised balances against the sum of their ledger entries.
+
+        :param repair: Whether to reset mismatched balances to what the ledger says they should be.
+        :param ids: Discord ids of the players to check, or None to check every player.
+        :return: Balance and ledger total of each player whose balance does not match the ledger, keyed by id.
+        """
+
+        documents: list[Document] = self.players.all() if ids is None else self.players.search(Query().id.one_of(ids))
+
+        mismatches: dict[int, tuple[int, int]] = {}
+        for document in documents:
+            if document["rbucks"] != self.ledger_totals[document["id"]]:
+                mismatches[document["id"]] = (document["rbucks"], self.ledger_totals[document["id"]])
+
+        if repair and mismatches:
+            ledger_totals: Counter[int] = self.ledger_totals
+
+            def reset_balances(table: dict[int, dict]) -> None:
+                for document in table.values():
+                    if document["id"] in mismatches:
+                        document["rbucks"] = ledger_totals[document["id"]]
+
+            self.players._update_table(reset_balances)  # type: ignore[arg-type]
+
+        return mismatches
 
 
 class Database(commands.Cog):
+    DEFAULT_DURABILITY: dict[WriteClass, Durability] = {
+        WriteClass.RESULT: Durability.STRICT,
+        WriteClass.BET: Durability.GROUP,
+        WriteClass.COSMETIC: Durability.RELAXED,
+    }
+
+    # With tinydb.shard_by_guild each guild has its own database file, these resolve to that of the current guild.
+    db: GuildAttribute[TinyDB] = GuildAttribute()
+    storage: GuildAttribute[JournaledStorage] = GuildAttribute()
+    players: GuildAttribute[Table] = GuildAttribute()
+    metadata: GuildAttribute[Table] = GuildAttribute()
+
     def __init__(self, config: dict) -> None:
-        
-        db_path: Path = Path(ROOT_DIR, config["tinydb"]["path"])
-        self.db: TinyDB = TinyDB(db_path)
-        self.players: Table = self.db.table("players")
-        self.metadata: Table = self.db.table("metadata")
-        if self.metadata.contains(Query().name == "season") is False:
-            self.metadata.insert(
+        self._db_path: Path = Path(ROOT_DIR, config["tinydb"]["path"])
+        journal_config: dict = config["tinydb"].get("journal", {})
+        self._compaction_threshold: int = journal_config.get(
+            "compaction_threshold", JournaledStorage.DEFAULT_COMPACTION_THRESHOLD
+        )
+        self._group_size: int = journal_config.get("group_size", JournaledStorage.DEFAULT_GROUP_SIZE)
+        self._group_commit_ms: int = journal_config.get("group_commit_ms", JournaledStorage.DEFAULT_GROUP_COMMIT_MS)
+
+        self.durability: dict[WriteClass, Durability] = dict(self.DEFAULT_DURABILITY)
+        for write_class, durability in journal_config.get("durability", {}).items():
+            self.durability[WriteClass(write_class)] = Durability[durability.upper()]
+
+        self._player_locks: KeyedLock = KeyedLock()
+
+        shard_by_guild: bool = config["tinydb"].get("shard_by_guild", False)
+        self._guilds: GuildShards[GuildDatabase] = GuildShards(self._open, shard_by_guild)
+        if shard_by_guild is False:
+            self._guilds.get()
+
+    def _open(self, guild_id: int | None) -> GuildDatabase:
+        """
+        Opens the database for a guild, e.g. db.1234.json for a db_path of db.json, creating it if need be, along with
+        its ledger, e.g. db.1234.ledger.jsonl.
+
+        :param guild_id: Guild the database belongs to, or None for the database shared by every guild.
+        :return: Opened database.
+        """
+
+        db_path: Path = self._db_path
+        if guild_id is not None:
+            db_path = db_path.with_name(f"{db_path.stem}.{guild_id}{db_path.suffix}")
+
+        db: TinyDB = TinyDB(
+            db_path,
+            storage=JournaledStorage,
+            compaction_threshold=self._compaction_threshold,
+            group_size=self._group_size,
+            group_commit_ms=self._group_commit_ms,
+        )
+
+        metadata: Table = db.table("metadata")
+        if metadata.contains(Query().name == "season") is False:
+            metadata.insert(
                 {"name": "season", "season": 1, "game_id": 1, "max_game_count": 100, "timestamp": time.time()}
             )
 
+        ledger: Ledger = Ledger(db_path.with_name(f"{db_path.stem}.ledger.jsonl"))
+        guild_database: GuildDatabase = GuildDatabase(
+            db, db.storage, db.table("players"), metadata, ledger  # type: ignore[arg-type]
+        )
+        guild_database.index(cast(list[LedgerEntry], ledger.read()))
+
+        # Balances from before the ledger existed are carried over as an opening entry, so that from then on every
+        # balance is the sum of its player's entries.
+        opening_balances: list[LedgerEntry] = [
+            ledger_entry(document["id"], document["rbucks"], LedgerReason.OPENING_BALANCE)
+            for document in guild_database.players.all()
+            if document["id"] not in guild_database.ledger_index
+        ]
+        if opening_balances:
+            guild_database.record(opening_balances)
+
+        # Only writes that are STRICT are synced before returning, so after a crash either the ledger or the balances
+        # may be the one that is behind. Which to trust is left to an admin, see !reconcile.
+        for id, (balance, total) in guild_database.reconcile().items():
+            log.error(f"Balance of {id} is {balance} RBUCKS but their ledger adds up to {total} RBUCKS.")
+
+        return guild_database
+
+    def cog_unload(self) -> None:
+        for guild_database in self._guilds.values():
+            guild_database.db.close()
+            guild_database.ledger.close()
+
+    def _write(self, write_class: WriteClass) -> ContextManager[None]:
+        """
+        Opens a journal batch that is synced according to the durability configured for a class of write. Every write
+        goes through one of these, so that a write never picks up the durability of another.
+
+        :param write_class: Class of the write.
+        """
+
+        return self.storage.batch(self.durability[write_class])
+
+    def _record(self, entries: list[LedgerEntry], write_class: WriteClass) -> None:
+        """
+        Appends entries to the ledger. This is done before the balances they account for are written, so that a crash
+        in between leaves a STRICT write's balance behind its ledger, where !reconcile repair can bring it up to date.
+
+        :param entries: Ledger entries.
+        :param write_class: Class of the write the entries account for.
+        """
+
+        self._guilds.get().record(entries, self.durability[write_class])
+
     def _get_document(self, id: int) -> Document | None:
         User: Query = Query()
         result: Document | None = self.players.get(User.id == id)
@@ -35,35 +250,60 @@ class Database(commands.Cog):
         player: Player | None = cast(Player, document)
         return player
 
-    def add(self, id: int, name: str, mmr: int) -> None:
+    def get_many(self, ids: Iterable[int]) -> tuple[list[Player], list[int]]:
+        """
+        Obtains the records for several players in a single pass over the players table.
+
+        :param ids: Discord ids of the players to look up.
+        :return: Records that were found (in the order requested) and the ids that could not be found.
+        """
+
+        requested: list[int] = list(ids)
+
+        User: Query = Query()
+        documents: list[Document] = self.players.search(User.id.one_of(requested))
+        found: dict[int, Player] = {document["id"]: cast(Player, document) for document in documents}
+
+        players: list[Player] = [found[id] for id in requested if id in found]
+        missing: list[int] = [id for id in requested if id not in found]
+
+        return players, missing
+
+    def add(self, id: int, name: str, mmr: int, write_class: WriteClass = WriteClass.RESULT) -> None:
         player: Player | None = self.get(id)
 
         if player:
             raise OneHeadException(f"{id} is already registered.")
 
-        self.players.insert(
-            {
-                "id": id,
-                "name": name,
-                "win": 0,
-                "loss": 0,
-                "mmr": mmr,
-                "win_streak": 0,
-                "loss_streak": 0,
-                "rbucks": Betting.INITIAL_BALANCE,
-                "commends": 0,
-                "reports": 0,
-                "behaviour": Behaviour.MAX_BEHAVIOUR_SCORE,
-            }
-        )
+        self._record([ledger_entry(id, Betting.INITIAL_BALANCE, LedgerReason.REGISTRATION)], write_class)
+        with self._write(write_class):
+            self.players.insert(
+                {
+                    "id": id,
+                    "name": name,
+                    "win": 0,
+                    "loss": 0,
+                    "mmr": mmr,
+                    "win_streak": 0,
+                    "loss_streak": 0,
+                    "rbucks": Betting.INITIAL_BALANCE,
+                    "commends": 0,
+                    "reports": 0,
+                    "behaviour": Behaviour.MAX_BEHAVIOUR_SCORE,
+                }
+            )
 
-    def remove(self, id: int) -> None:
+    def remove(self, id: int, write_class: WriteClass = WriteClass.RESULT) -> None:
         player: Document | None = self._get_document(id)
 
         if player is None:
             raise OneHeadException(f"{id} does not exist in database.")
 
-        self.players.remove(doc_ids=[player.doc_id])
+        # The ledger is append-only, so close the account rather than leave its entries adding up to nothing.
+        if player["rbucks"] != 0:
+            self._record([ledger_entry(id, -player["rbucks"], LedgerReason.DEREGISTRATION)], write_class)
+        with self._write(write_class):
+            self.players.remove(doc_ids=[player.doc_id])
 
     def modify(
         self,
@@ -71,21 +311,142 @@ class Database(commands.Cog):
         key: str,
         value: str | int,
         operation: Operation = Operation.REPLACE,
+        write_class: WriteClass = WriteClass.RESULT,
     ) -> None:
+        check_key(key)
         document: Document | None = self._get_document(id)
 
         if document is None:
             raise OneHeadException(f"{id} does not exist in database.")
 
+        fields: dict | Callable[[dict], None]
         if operation == Operation.REPLACE:
-            self.players.update({key: value}, doc_ids=[document.doc_id])
+            fields = {key: value}
         elif operation == Operation.ADD:
-            self.players.update(add(key, value), doc_ids=[document.doc_id])
+            fields = add(key, value)
         elif operation == Operation.SUBTRACT:
-            self.players.update(subtract(key, value), doc_ids=[document.doc_id])
+            fields = subtract(key, value)
         else:
             raise OneHeadException(f"{operation} is not a valid database operation.")
 
+        with self._write(write_class):
+            self.players.update(fields, doc_ids=[document.doc_id])
+
+    def lock(self, id: int) -> AsyncContextManager[None]:
+        """
+        Serialises balance-sensitive commands for a single player (e.g. a bet and a shuffle issued at the same time)
+        while commands for different players continue to run in parallel.
+
+        :param id: Discord id of the player.
+        """
+
+        return self._player_locks(id)
+
+    def debit_if_sufficient(
+        self,
+        id: int,
+        amount: int,
+        reason: LedgerReason,
+        game_id: int | None = None,
+        write_class: WriteClass = WriteClass.BET,
+    ) -> bool:
+        """
+        Subtracts RBUCKS from a player, provided they can afford it, and records the debit in the ledger. Nothing else
+        runs between the balance being checked and the debit being written, as neither awaits.
+
+        :param id: Discord id of the player.
+        :param amount: Number of RBUCKS to subtract.
+        :param reason: Why the RBUCKS are being taken.
+        :param game_id: Game the RBUCKS are being taken for, if any.
+        :param write_class: Durability class for the write.
+        :return: True if the player was debited, False if their balance was too low.
+        """
+
+        document: Document | None = self._get_document(id)
+
+        if document is None:
+            raise OneHeadException(f"{id} does not exist in database.")
+
+        if document["rbucks"] < amount:
+            return False
+
+        self._record([ledger_entry(id, -amount, reason, game_id)], write_class)
+        with self._write(write_class):
+            self.players.update(subtract("rbucks", amount), doc_ids=[document.doc_id])
+
+        return True
+
+    @contextmanager
+    def transaction(self, write_class: WriteClass = WriteClass.RESULT) -> Generator[Transaction, None, None]:
+        """
+        Context manager that commits all staged changes together when the block exits without an exception.
+
+        :param write_class: Durability class used when committing.
+        """
+
+        transaction: Transaction = Transaction()
+        yield transaction
+        self._commit(transaction, write_class)
+
+    def _commit(self, transaction: Transaction, write_class: WriteClass) -> None:
+        ids: set[int] = {id for id, _, _, _ in transaction.updates}
+
+        User: Query = Query()
+        documents: list[Document] = self.players.search(User.id.one_of(list(ids)))
+        doc_ids: dict[int, int] = {document["id"]: document.doc_id for document in documents}
+
+        missing: set[int] = ids - doc_ids.keys()
+        if missing:
+            raise OneHeadException(f"{', '.join(str(id) for id in missing)} do not exist in database.")
+
+        def apply_updates(table: dict[int, dict]) -> None:
+            for id, key, value, operation in transaction.updates:
+                document: dict = table[doc_ids[id]]
+                if operation == Operation.REPLACE:
+                    document[key] = value
+                elif operation == Operation.ADD:
+                    document[key] += value
+                elif operation == Operation.SUBTRACT:
+                    document[key] -= value
+                else:
+                    raise OneHeadException(f"{operation} is not a valid database operation.")
+
+        if transaction.entries:
+            self._record(transaction.entries, write_class)
+        with self._write(write_class):
+            if transaction.updates:
+                self.players._update_table(apply_updates)  # type: ignore[arg-type]
+            if transaction.metadata is not None:
+                self.metadata.upsert(transaction.metadata, Query().name == "season")
+
+    def get_ledger(self, id: int, limit: int | None = None) -> list[LedgerEntry]:
+        """
+        Obtains a player's ledger entries from the in-memory index, oldest first.
+
+        :param id: Discord id of the player.
+        :param limit: Maximum number of entries to return, the most recent are kept.
+        :return: Ledger entries.
+        """
+
+        entries: list[LedgerEntry] = self._guilds.get().ledger_index.get(id, [])
+        return entries[-limit:] if limit else list(entries)
+
+    def reconcile(self, repair: bool = False, ids: Iterable[int] | None = None) -> dict[int, tuple[int, int]]:
+        """
+        Checks players' balances against their ledger.
+
+        :param repair: Whether to reset mismatched balances to what the ledger says they should be.
+        :param ids: Discord ids of the players to check, or None to check every player.
+        :return: Balance and ledger total of each player whose balance does not match the ledger, keyed by id.
+        """
+
+        with self._write(WriteClass.RESULT):
+            mismatches: dict[int, tuple[int, int]] = self._guilds.get().reconcile(repair, ids)
+        for id, (balance, total) in mismatches.items():
+            log.error(f"Balance of {id} is {balance} RBUCKS but their ledger adds up to {total} RBUCKS.")
+
+        return mismatches
+
     def get_all(self) -> list[Player]:
         table_dict: dict[str, Player] = self.players._read_table()  # type: ignore
         return list(table_dict.values())
@@ -96,6 +457,47 @@ class Database(commands.Cog):
         meta: Metadata | None = cast(Metadata, result)
         return meta
 
-    def update_metadata(self, data: Metadata) -> None:
+    def update_metadata(self, data: Metadata, write_class: WriteClass = WriteClass.RESULT) -> None:
         q: Query = Query()
-        self.metadata.upsert(data, q.name == "season")
+        with self._write(write_class):
+            self.metadata.upsert(data, q.name == "season")
+
+    @has_role(Roles.ADMIN)
+    @command()
+    async def dbstats(self, ctx: Context) -> None:
+        """
+        Shows commit batch sizes and fsync latency for the database journal.
+        """
+
+        metrics: CommitMetrics = self.storage.metrics
+
+        batches: list[dict[str, int]] = [
+            {"batch size": size, "commits": count} for size, count in sorted(metrics.batch_sizes.items())
+        ]
+        table: str = tabulate(batches, headers="keys", tablefmt="simple")
+
+        await ctx.send(
+            f"**Database Commits** - `{metrics.commits}` fsyncs, mean `{metrics.fsync_mean_ms:.2f}ms`, "
+            f"max `{metrics.fsync_max_ms:.2f}ms` ```\n{table}```"
+        )
+
+    @has_role(Roles.ADMIN)
+    @command(aliases=["reconcile"])
+    async def reconcile_ledger(self, ctx: Context, repair: str = "") -> None:
+        """
+        Checks every balance against the RBUCKS ledger. Use !reconcile repair to reset any balance that does not match
+        to what the ledger says it should be.
+        """
+
+        mismatches: dict[int, tuple[int, int]] = self.reconcile(repair == "repair")
+        if not mismatches:
+            await ctx.send("Every balance matches the RBUCKS ledger.")
+            return
+
+        rows: list[dict[str, int]] = [
+            {"id": id, "balance": balance, "ledger": total} for id, (balance, total) in mismatches.items()
+        ]
+        table: str = tabulate(rows, headers="keys", tablefmt="simple")
+        action: str = "have been reset to" if repair == "repair" else "do not match"
+
+        await ctx.send(f"**Ledger** - `{len(mismatches)}` balances {action} the RBUCKS ledger. ```\n{table}```")
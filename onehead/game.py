@@ -1,21 +1,148 @@
 import asyncio
+import time
+from enum import auto
+from heapq import heappop, heappush
+from itertools import count
+from logging import Logger
+from typing import Awaitable, Callable, Iterator, Literal
 
 from discord.ext.commands import Context
+from strenum import LowercaseStrEnum
+from structlog import get_logger
 
-from onehead.common import Bet, PlayerTransfer, Team
+from onehead.betting import BetBook, Market
+from onehead.common import EnumeratorMeta, PlayerTransfer, Team, record_checkpoint
+from onehead.messaging import Priority, send
 
 
-class Game:
+log: Logger = get_logger()
+
+
+class Window(LowercaseStrEnum, metaclass=EnumeratorMeta):
+    TRANSFER = auto()
+    BETTING = auto()
+
+
+class TimerWheel:
+    """
+    Runs coroutine callbacks at their deadlines using a single heap serviced by a single asyncio task, rather than a
+    task per timer. Cancelling an individual timer is lazy, cancelling every timer is O(1).
+    """
+
     def __init__(self) -> None:
+        self._heap: list[tuple[float, int, Callable[[], Awaitable[None]]]] = []
+        # Handles that are in the heap and have not been cancelled. Tracking these rather than the cancelled handles
+        # means cancelling a timer that has already fired, e.g. the one closing a window, leaves nothing behind.
+        self._pending: set[int] = set()
+        self._handles: Iterator[int] = count()
+        self._changed: asyncio.Event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def schedule(self, delay: float, callback: Callable[[], Awaitable[None]]) -> int:
+        """
+        Schedules a callback to be awaited after a delay.
+
+        :param delay: Seconds from now.
+        :param callback: Coroutine function to call.
+        :return: Handle that can be passed to cancel().
+        """
+
+        handle: int = next(self._handles)
+        self._pending.add(handle)
+        heappush(self._heap, (asyncio.get_running_loop().time() + delay, handle, callback))
+        self._changed.set()
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        return handle
+
+    def cancel(self, handle: int) -> None:
+        self._pending.discard(handle)
+
+    def cancel_all(self) -> None:
+        self._heap = []
+        self._pending = set()
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        while self._heap:
+            deadline: float = self._heap[0][0]
+            remaining: float = deadline - loop.time()
+
+            if remaining > 0:
+                # Wake up early if a timer with an earlier deadline is scheduled in the meantime.
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            handle: int
+            callback: Callable[[], Awaitable[None]]
+            _, handle, callback = heappop(self._heap)
+
+            if handle not in self._pending:
+                continue
+
+            self._pending.discard(handle)
+
+            await callback()
+
+
+class Game:
+    DEFAULT_WINDOW_DURATIONS: dict[Window, int] = {Window.TRANSFER: 120, Window.BETTING: 180}
+    DEFAULT_WINDOW_SEQUENCE: tuple[tuple[Window, ...], ...] = ((Window.TRANSFER,), (Window.BETTING,))
+    REMINDER_SECONDS: Literal[60] = 60
+
+    WINDOW_MESSAGES: dict[Window, tuple[str, str, str]] = {
+        Window.TRANSFER: (
+            "Player transfer window is now open for `{minutes}` minutes!",
+            "`1` minute remaining for player transfers!",
+            "Player transfer window has now closed!",
+        ),
+        Window.BETTING: (
+            "Bets are now open for `{minutes}` minutes!",
+            "`1` minute remaining for bets!",
+            "Bets are now closed!",
+        ),
+    }
+
+    def __init__(
+        self,
+        window_durations: dict[Window, int] | None = None,
+        window_sequence: tuple[tuple[Window, ...], ...] | None = None,
+        game_id: int = 0,
+        market: Market = Market.FIXED,
+    ) -> None:
+        self.id: int = game_id
+        self.slot: int = 1
+        self.player_ids: tuple[int, ...] = ()
+        self.channel_ids: tuple[int, ...] = ()
         self._in_progress: bool = False
-        self._cancel_event: asyncio.Event = asyncio.Event()
         self._transfer_window_open: bool = False
         self._betting_window_open: bool = False
-        self._bets: list[Bet] = []
+        self._bets: BetBook = BetBook(market=market)
         self._player_transfers: list[PlayerTransfer] = []
         self._commends: dict[str, list[str]] = {}
         self._reports: dict[str, list[str]] = {}
 
+        self._window_durations: dict[Window, int] = {**self.DEFAULT_WINDOW_DURATIONS, **(window_durations or {})}
+        self._window_sequence: tuple[tuple[Window, ...], ...] = window_sequence or self.DEFAULT_WINDOW_SEQUENCE
+        self._timers: TimerWheel = TimerWheel()
+        self._window_timers: dict[Window, list[int]] = {}
+        self._window_deadlines: dict[Window, float] = {}
+        self._closed_windows: set[Window] = set()
+        self._windows_closed: asyncio.Event = asyncio.Event()
+        self._windows_closed.set()
+        self._context: Context | None = None
+
         self.radiant: Team | None = None
         self.dire: Team | None = None
 
@@ -26,37 +153,140 @@ class Game:
         self._in_progress = True
 
     def cancel(self) -> None:
-        self._cancel_event.set()
+        self._timers.cancel_all()
+        self._window_timers = {}
+        self._window_deadlines = {}
+        self._set_window_open(Window.TRANSFER, False)
+        self._set_window_open(Window.BETTING, False)
         self._in_progress: bool = False
 
-    async def open_transfer_window(self, ctx: Context) -> None:
-        self._transfer_window_open = True
-        await ctx.send("Player transfer window is now open for `2` minutes!")
+    def window_open(self, window: Window) -> bool:
+        return self._transfer_window_open if window == Window.TRANSFER else self._betting_window_open
+
+    def _set_window_open(self, window: Window, is_open: bool) -> None:
+        if window == Window.TRANSFER:
+            self._transfer_window_open = is_open
+        else:
+            self._betting_window_open = is_open
+
+        if self._transfer_window_open or self._betting_window_open:
+            self._windows_closed.clear()
+        else:
+            self._windows_closed.set()
+
+    def _schedule_window_timers(self, window: Window, duration: float) -> None:
+        for handle in self._window_timers.get(window, []):
+            self._timers.cancel(handle)
+
+        handles: list[int] = [self._timers.schedule(duration, lambda: self.close_window(window))]
+        if duration > self.REMINDER_SECONDS:
+            handles.append(self._timers.schedule(duration - self.REMINDER_SECONDS, lambda: self._remind(window)))
+
+        self._window_timers[window] = handles
+        self._window_deadlines[window] = asyncio.get_running_loop().time() + duration
+        record_checkpoint("window_opened", id=self.id, window=window, deadline=time.time() + duration)
+
+    async def _announce(self, message: str) -> None:
+        if self._context is not None:
+            send(self._context, message, Priority.GAME)
+
+    async def _remind(self, window: Window) -> None:
+        await self._announce(self.WINDOW_MESSAGES[window][1])
+
+    async def open_window(self, ctx: Context, window: Window) -> None:
+        """
+        Opens a window and schedules it to close once its configured duration has elapsed.
+
+        :param ctx: Discord context used for announcements.
+        :param window: Window to open.
+        """
+
+        if self.window_open(window):
+            return
+
+        self._context = ctx
+        duration: int = self._window_durations[window]
+
+        if window == Window.BETTING and self.radiant is not None and self.dire is not None:
+            self._bets.set_teams(self.radiant, self.dire)
+
+        self._set_window_open(window, True)
+        self._schedule_window_timers(window, duration)
+
+        minutes: str = f"{duration / 60:g}"
+        await self._announce(self.WINDOW_MESSAGES[window][0].format(minutes=minutes))
+
+    def restore_window(self, window: Window, remaining: float) -> None:
+        """
+        Reopens a window that was open when the bot last stopped, without announcing it again.
+
+        :param window: Window to reopen.
+        :param remaining: Seconds that were left until the window closes.
+        """
+
+        self._set_window_open(window, True)
+        self._schedule_window_timers(window, max(remaining, 0))
+
+    def restore_closed_window(self, window: Window) -> None:
+        """
+        Marks a window that had already closed when the bot last stopped, so that it is not opened again.
+
+        :param window: Window that has closed.
+        """
+
+        self._closed_windows.add(window)
+        if window == Window.BETTING:
+            self._bets.lock()
+
+    async def close_window(self, window: Window) -> None:
+        if self.window_open(window) is False:
+            return
+
+        for handle in self._window_timers.pop(window, []):
+            self._timers.cancel(handle)
+        self._window_deadlines.pop(window, None)
+
+        self._set_window_open(window, False)
+        self._closed_windows.add(window)
+        if window == Window.BETTING:
+            self._bets.lock()
+
+        record_checkpoint("window_closed", id=self.id, window=window)
+        await self._announce(self.WINDOW_MESSAGES[window][2])
+
+    def extend_window(self, window: Window, seconds: int) -> float:
+        """
+        Pushes back the deadline of an open window.
+
+        :param window: Window to extend.
+        :param seconds: Number of seconds to add.
+        :return: Seconds remaining until the window closes.
+        """
+
+        remaining: float = self._window_deadlines[window] - asyncio.get_running_loop().time() + seconds
+        self._schedule_window_timers(window, remaining)
+        return remaining
+
+    async def run_windows(self, ctx: Context) -> None:
+        """
+        Runs each stage of the window sequence in turn. The windows within a stage are open at the same time, and the
+        next stage begins once they have all closed, either on their deadline, early by an admin or by cancellation.
+        Windows that have already closed are skipped, so a restored game carries on from where it left off.
 
-        try:
-            await asyncio.wait_for(self._cancel_event.wait(), timeout=120)
-        except asyncio.TimeoutError:
-            pass
+        :param ctx: Discord context used for announcements.
+        """
 
-        self._transfer_window_open = False
-        await ctx.send("Player transfer window has now closed!")
+        self._context = ctx
 
-    async def open_betting_window(self, ctx: Context) -> None:
-        self._betting_window_open = True
+        for stage in self._window_sequence:
+            if self._in_progress is False:
+                return
 
-        await ctx.send("Bets are now open for `3` minutes!")
+            for window in stage:
+                if window not in self._closed_windows:
+                    await self.open_window(ctx, window)
 
-        try:
-            await asyncio.wait_for(self._cancel_event.wait(), timeout=120)
-        except asyncio.TimeoutError:
-            await ctx.send("`1` minute remaining for bets!")
-            try:
-                await asyncio.wait_for(self._cancel_event.wait(), timeout=60)
-            except asyncio.TimeoutError:
-                pass
-        finally:
-            self._betting_window_open = False
-            await ctx.send("Bets are now closed!")
+            await self._windows_closed.wait()
 
     def betting_window_open(self) -> bool:
         return self._betting_window_open
@@ -64,7 +294,7 @@ class Game:
     def transfer_window_open(self) -> bool:
         return self._transfer_window_open
 
-    def get_bets(self) -> list[Bet]:
+    def get_bets(self) -> BetBook:
         return self._bets
 
     def get_player_transfers(self) -> list[PlayerTransfer]:
@@ -1,14 +1,22 @@
-from asyncio import sleep
+from asyncio import Event, TimeoutError, sleep, wait_for
+from collections import Counter
+from copy import copy
+from dataclasses import dataclass, field
+from heapq import heapify, heappop
 from logging import Logger
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Iterator, Literal
 
 from discord import Status
+from discord.abc import Messageable
+from discord.errors import NotFound
 from discord.ext.commands import (
     Bot,
     BucketType,
+    CheckFailure,
     Cog,
     Command,
     Context,
+    MaxConcurrencyReached,
     command,
     cooldown,
     has_role,
@@ -21,15 +29,22 @@ from structlog import get_logger
 from tabulate import tabulate
 
 from onehead.common import (
+    GuildAttribute,
+    GuildShards,
     OneHeadException,
     Player,
     Roles,
+    create_background_task,
     get_bot_instance,
-    get_discord_member_from_name,
-    play_sound
+    get_discord_member_from_id,
+    play_sound,
+    record_checkpoint,
+    set_current_guild,
 )
+from onehead.checkpoint import GuildCheckpoint
 from onehead.game import Game
 from onehead.protocols.database import OneHeadDatabase
+from onehead.throttle import allow_command
 
 if TYPE_CHECKING:
     from discord.member import Member
@@ -37,25 +52,245 @@ if TYPE_CHECKING:
 
 log: Logger = get_logger()
 
+# Presence updates arrive at a far higher rate than anything else, so on_presence_update reaches the lobby through
+# this reference rather than looking the cog up via the bot for every event.
+lobby_instance: "Lobby | None" = None
+
+
+@dataclass
+class PresenceMetrics:
+    filtered: int = 0
+    handled: int = 0
+    signouts: int = 0
+    messages: int = 0
+
+
+class MessageFilter:
+    """
+    Restricts the configured authors to sending messages that are either not commands or are valid commands, anything
+    else from them is deleted. Command names and aliases are looked up in a frozen set that is built on first use and
+    invalidated whenever a cog is added or removed, see OneHeadBot.
+    """
+
+    # Authors that were always restricted before this could be configured, an empty list turns the filter off.
+    DEFAULT_RESTRICTED_AUTHORS: tuple[str, ...] = ("ERIC", "SCOUT")
+
+    def __init__(self, config: dict) -> None:
+        filter_config: dict = config.get("discord", {}).get("message_filter", {})
+        self.restricted_authors: frozenset[str] = frozenset(
+            filter_config.get("restricted_authors", self.DEFAULT_RESTRICTED_AUTHORS)
+        )
+        self._command_names: frozenset[str] | None = None
+
+    def invalidate(self) -> None:
+        self._command_names = None
+
+    def _get_command_names(self, bot: Bot) -> frozenset[str]:
+        if self._command_names is None:
+            # all_commands maps every name and alias to its command.
+            self._command_names = frozenset(bot.all_commands)
+
+        return self._command_names
+
+    def allow(self, message: Message, bot: Bot) -> bool:
+        if message.author.display_name not in self.restricted_authors:
+            return True
+
+        prefix: str = bot.command_prefix  # type: ignore[assignment]
+        if message.content.startswith(prefix) is False:
+            return True
+
+        command: list[str] = message.content[len(prefix) :].split(None, 1)
+        return len(command) > 0 and command[0] in self._get_command_names(bot)
+
+
+class SignupQueue:
+    """
+    Signed up players in the order they signed up, keyed by Discord id so that membership checks, signups and signouts
+    are O(1) and a player who changes their display name mid-lobby is still recognised.
+
+    When more players sign up than can play, the players to keep are popped off a heap ordered by behaviour score plus
+    BENCH_PRIORITY for every game the player has been benched from since they last played, with ties going to whoever
+    signed up first. Bench counts survive the signups being cleared so that they carry over to the next lobby.
+    """
+
+    BENCH_PRIORITY: Literal[500] = 500
+
+    def __init__(self, signups: dict[int, str] | None = None) -> None:
+        self._names: dict[int, str] = dict(signups or {})
+        self._benched: Counter[int] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, id: object) -> bool:
+        return id in self._names
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._names)
+
+    def add(self, id: int, name: str) -> bool:
+        """
+        Signs a player up, or refreshes their name if they are already signed up.
+
+        :param id: Discord id of the player.
+        :param name: Display name of the player.
+        :return: True if the player was not already signed up.
+        """
+
+        added: bool = id not in self._names
+        self._names[id] = name
+        return added
+
+    def remove(self, id: int) -> str | None:
+        return self._names.pop(id, None)
+
+    def find(self, name: str) -> int | None:
+        for id, signup_name in self._names.items():
+            if signup_name == name:
+                return id
+
+        return None
+
+    def items(self) -> list[tuple[int, str]]:
+        return list(self._names.items())
+
+    def names(self) -> list[str]:
+        return list(self._names.values())
+
+    def clear(self) -> None:
+        self._names = {}
+
+    def select(self, behaviour: dict[int, int], count: int) -> list[str]:
+        """
+        Keeps the count players with the highest priority signed up and benches everyone else.
+
+        :param behaviour: Behaviour score of each signed up player, keyed by Discord id.
+        :param count: Number of players to keep.
+        :return: Names of the benched players, in the order they signed up.
+        """
+
+        heap: list[tuple[int, int, int]] = [
+            (-(behaviour[id] + self.BENCH_PRIORITY * self._benched[id]), position, id)
+            for position, id in enumerate(self._names)
+        ]
+        heapify(heap)
+        selected: set[int] = {heappop(heap)[2] for _ in range(min(count, len(heap)))}
+
+        benched: list[str] = []
+        for id, name in list(self._names.items()):
+            if id in selected:
+                del self._benched[id]
+            else:
+                self._benched[id] += 1
+                benched.append(name)
+                del self._names[id]
+
+        return benched
+
+
+@dataclass
+class LobbyState:
+    signups: SignupQueue = field(default_factory=SignupQueue)
+    pending_signouts: list[tuple[str, str]] = field(default_factory=list)
+    players_ready: set[int] = field(default_factory=set)
+    all_ready: Event = field(default_factory=Event)
+    ready_check_in_progress: bool = False
+    context: Context | None = None
+    signups_disabled: bool = False
+    status_message: Message | None = None
+    status_update_pending: bool = False
+
 
 class Lobby(Cog):
-    def __init__(self, database: OneHeadDatabase) -> None:
+    DEFAULT_READY_CHECK_TIMEOUT: Literal[30] = 30
+    SIGNOUT_COALESCE_SECONDS: float = 2.0
+    STATUS_DEBOUNCE_SECONDS: float = 3.0
+
+    # Each guild has its own lobby, these resolve to the state of the guild currently being handled.
+    _signups: GuildAttribute[SignupQueue] = GuildAttribute()
+    _players_ready: GuildAttribute[set[int]] = GuildAttribute()
+    _all_ready: GuildAttribute[Event] = GuildAttribute()
+    _ready_check_in_progress: GuildAttribute[bool] = GuildAttribute()
+    _context: GuildAttribute[Context | None] = GuildAttribute()
+    _signups_disabled: GuildAttribute[bool] = GuildAttribute()
+    _status_message: GuildAttribute[Message | None] = GuildAttribute()
+
+    def __init__(self, database: OneHeadDatabase, config: dict) -> None:
         self.database: OneHeadDatabase = database
-        self._signups: list[str] = []
-        self._players_ready: list[str] = []
-        self._ready_check_in_progress: bool = False
-        self._context: Context | None = None
-        self._signups_disabled: bool = False
+        self._guilds: GuildShards[LobbyState] = GuildShards(lambda guild_id: LobbyState())
+        self.presence_metrics: PresenceMetrics = PresenceMetrics()
+        self.message_filter: MessageFilter = MessageFilter(config)
+
+        global lobby_instance
+        lobby_instance = self
+        self._ready_check_timeout: int = config.get("lobby", {}).get(
+            "ready_check_timeout", self.DEFAULT_READY_CHECK_TIMEOUT
+        )
+        self._auto_start: bool = config.get("lobby", {}).get("auto_start", False)
 
     def disable_signups(self) -> None:
         self._signups_disabled = True
+        record_checkpoint("signups_disabled")
 
     def clear_signups(self) -> None:
-        self._signups = []
+        self._signups.clear()
         self._signups_disabled = False
+        # The next lobby gets a new status message rather than editing one that has scrolled out of view.
+        self._status_message = None
+        record_checkpoint("signups_cleared")
+
+    def restore(self, guild_id: int | None, checkpoint: GuildCheckpoint) -> None:
+        state: LobbyState = self._guilds.get(guild_id)
+        state.signups = SignupQueue(checkpoint.signups)
+        state.signups_disabled = checkpoint.signups_disabled
 
     def get_signups(self) -> list[str]:
-        return self._signups
+        return self._signups.names()
+
+    def is_signed_up(self, id: int) -> bool:
+        return id in self._signups
+
+    @staticmethod
+    def _render_status(signups: SignupQueue) -> str:
+        signups_dict: list[dict[str, Any]] = [{"#": i, "name": name} for i, name in enumerate(signups.names(), start=1)]
+        table: str = tabulate(signups_dict, headers="keys", tablefmt="simple")
+
+        return f"There are currently `{len(signups)}` players signed up.\n**Current Signups** ```\n{table}```"
+
+    def _update_status(self, channel: Messageable) -> None:
+        """
+        Schedules the lobby status message to be brought up to date. Changes made within STATUS_DEBOUNCE_SECONDS of
+        each other are rendered and sent as a single edit.
+
+        :param channel: Channel to post the status message in if there is not one already.
+        """
+
+        state: LobbyState = self._guilds.get()
+        if state.status_update_pending:
+            return
+
+        state.status_update_pending = True
+        create_background_task(self._flush_status(state, channel))
+
+    async def _flush_status(self, state: LobbyState, channel: Messageable) -> None:
+        await sleep(self.STATUS_DEBOUNCE_SECONDS)
+        state.status_update_pending = False
+
+        content: str = self._render_status(state.signups)
+
+        if state.status_message is not None:
+            try:
+                await state.status_message.edit(content=content)
+                return
+            except NotFound:
+                log.info("Lobby status message has been deleted, sending a new one.")
+
+        state.status_message = await channel.send(content)
+
+    def _check_all_ready(self) -> None:
+        if self._ready_check_in_progress and self._players_ready.issuperset(self._signups):
+            self._all_ready.set()
 
     @has_role(Roles.ADMIN)
     @command()
@@ -89,7 +324,7 @@ class Lobby(Cog):
     async def select_players(self, ctx: Context) -> None:
         """
         Handle the case where there are less than 10 signups, exactly 10 signups or more than 10 signups. If there are
-        more, then players will be randomly removed until there are only 10 players in self.signups.
+        more, then the 10 players with the highest bench priority are kept and everyone else is benched.
 
         :param ctx: Discord context
         """
@@ -101,34 +336,24 @@ class Lobby(Cog):
         await ctx.send(
             f"`{number_of_signups}` Players have signed up and therefore `{number_of_signups - 10}` players will be benched."
         )
+        await ctx.send(
+            "More than `10` signups identified, selecting the top `10` players by behaviour score, prioritising "
+            "players that have been benched recently."
+        )
 
-        if len(self._signups) > 10:
-            await ctx.send(
-                "More than `10` signups identified, selecting the top `10` players with the highest behaviour score."
-            )
-
-            original_signups: list[str] = self._signups
-
-            players: list[Player] = []
-
-            for signup in self._signups:
-                member: Member | None = get_discord_member_from_name(ctx, signup)
-                player: Player | None = self.database.get(member.id)
-
-                if player is None:
-                    raise OneHeadException(f"Unable to find {signup} in database.")
+        players: list[Player]
+        missing: list[int]
+        players, missing = self.database.get_many(self._signups)
 
-                players.append(player)
+        if missing:
+            missing_names: list[str] = [name for id, name in self._signups.items() if id in missing]
+            raise OneHeadException(f"Unable to find {', '.join(missing_names)} in database.")
 
-            # TODO: Need to handle the case where we have > 10 with the same behaviour score.
-            top_10_players_by_behaviour_score: list[Player] = sorted(
-                players, key=lambda d: d["behaviour"], reverse=True
-            )[:10]
-            self._signups = [player["name"] for player in top_10_players_by_behaviour_score]
-            benched_players: list[str] = [x for x in original_signups if x not in self._signups]
+        benched_players: list[str] = self._signups.select({player["id"]: player["behaviour"] for player in players}, 10)
+        record_checkpoint("signups", players=self._signups.items())
 
         await ctx.send(f"**Benched Players:** ```\n{benched_players}```")
-        await ctx.send(f"**Selected Players:** ```\n{self._signups}```")
+        await ctx.send(f"**Selected Players:** ```\n{self._signups.names()}```")
 
     @has_role(Roles.MEMBER)
     @command()
@@ -137,11 +362,8 @@ class Lobby(Cog):
         Shows all players currently signed up to play in the IHL.
         """
 
-        await ctx.send(f"There are currently `{len(self._signups)}` players signed up.")
-        signups_dict: list[dict[str, Any]] = [{"#": i, "name": name} for i, name in enumerate(self._signups, start=1)]
-        signups: str = tabulate(signups_dict, headers="keys", tablefmt="simple")
-
-        await ctx.send(f"**Current Signups** ```\n{signups}```")
+        # Subsequent changes are edited into this message, so it becomes the live status of the lobby.
+        self._status_message = await ctx.send(self._render_status(self._signups))
 
     @cooldown(1, 10, BucketType.user)
     @has_role(Roles.MEMBER)
@@ -161,18 +383,23 @@ class Lobby(Cog):
             await ctx.send("Please register first using the `!register` command.")
             return
 
-        if name in self._signups:
+        if ctx.author.id in self._signups:
+            self._signups.add(ctx.author.id, name)
             await ctx.send(f"{ctx.author.mention} is already signed up.")
             return
+        elif get_bot_instance().get_cog("Core").game_for_player(ctx.author.id) is not None:  # type: ignore[union-attr]
+            await ctx.send(f"{ctx.author.mention} is already playing in a game.")
+            return
         else:
-            self._signups.append(name)
+            self._signups.add(ctx.author.id, name)
+            record_checkpoint("signup", id=ctx.author.id, name=name)
 
         if self._context is None:
             self._context = ctx
 
         log.info(f"{name} has signed up.")
 
-        await Command.invoke(self.who, ctx)
+        self._update_status(ctx.channel)
 
     @cooldown(1, 10, BucketType.user)
     @has_role(Roles.MEMBER)
@@ -188,14 +415,15 @@ class Lobby(Cog):
 
         name: str = ctx.author.display_name
 
-        if name not in self._signups:
+        if self._signups.remove(ctx.author.id) is None:
             await ctx.send(f"{ctx.author.mention} is not currently signed up.")
         else:
-            self._signups.remove(name)
+            record_checkpoint("signout", id=ctx.author.id)
+            self._check_all_ready()
 
         log.info(f"{name} has signed out.")
 
-        await Command.invoke(self.who, ctx)
+        self._update_status(ctx.channel)
 
     @has_role(Roles.ADMIN)
     @command(aliases=["rm"])
@@ -204,16 +432,32 @@ class Lobby(Cog):
         Remove a player who is currently signed up.
         """
 
-        if name not in self._signups:
+        id: int | None = self._signups.find(name)
+        if id is None:
             await ctx.send(f"{name} is not currently signed up.")
             return
 
-        self._signups.remove(name)
+        self._signups.remove(id)
+        record_checkpoint("signout", id=id)
+        self._check_all_ready()
+        self._update_status(ctx.channel)
 
+        member: Member | None = get_discord_member_from_id(ctx, id)
         log.info(f"{name} has been removed from the signup pool by {ctx.author.display_name}.")
+        await ctx.send(f"{name if member is None else member.mention} has been removed from the signup pool.")
 
-        member: Member | None = get_discord_member_from_name(ctx, name)
-        await ctx.send(f"{member.mention} has been removed from the signup pool.")
+    @has_role(Roles.ADMIN)
+    @command()
+    async def presencestats(self, ctx: Context) -> None:
+        """
+        Shows how many presence updates were discarded up front versus handled.
+        """
+
+        metrics: PresenceMetrics = self.presence_metrics
+        await ctx.send(
+            f"**Presence Updates** - `{metrics.filtered}` filtered, `{metrics.handled}` handled, "
+            f"`{metrics.signouts}` signouts announced in `{metrics.messages}` messages."
+        )
 
     @has_role(Roles.MEMBER)
     @command(aliases=["r"])
@@ -223,7 +467,7 @@ class Lobby(Cog):
         """
         name: str = ctx.author.display_name
 
-        if name not in self._signups:
+        if ctx.author.id not in self._signups:
             await ctx.send(f"{ctx.author.mention} needs to sign in first.")
             return
 
@@ -231,41 +475,97 @@ class Lobby(Cog):
             await ctx.send("No ready check initiated.")
             return
 
-        self._players_ready.append(name)
+        self._players_ready.add(ctx.author.id)
 
         log.info(f"{name} is ready.")
 
         await ctx.send(f"{ctx.author.mention} is ready.")
 
+        self._check_all_ready()
+
     @has_role(Roles.MEMBER)
     @command(aliases=["rc"])
     @max_concurrency(1, per=BucketType.default, wait=False)
     async def ready_check(self, ctx: Context) -> None:
         """
-        Initiates a ready check, after approx. 30s the result of the check will be displayed.
+        Initiates a ready check, which completes as soon as every signed up player is ready or after approx. 30s.
         """
-        
+
+        start_game: bool = False
+
         if await self.signup_check(ctx):
             await play_sound(ctx, "ready.mp3")
-            
+
             log.info(f"{ctx.author.display_name} initiated a ready check.")
-            await ctx.send("Ready check started - `30s` remaining - type `!ready` to ready up.")
+            await ctx.send(f"Ready check started - `{self._ready_check_timeout}s` remaining - type `!ready` to ready up.")
+            self._all_ready.clear()
             self._ready_check_in_progress = True
-            await sleep(30)
-
-            players_not_ready: list[str] = [name for name in self._signups if name not in self._players_ready]
-            mentions_not_ready: list[str] = [get_discord_member_from_name(ctx, name).mention for name in players_not_ready]
+            self._check_all_ready()
+
+            try:
+                await wait_for(self._all_ready.wait(), timeout=self._ready_check_timeout)
+            except TimeoutError:
+                pass
+
+            players_not_ready: list[tuple[int, str]] = [
+                (id, name) for id, name in self._signups.items() if id not in self._players_ready
+            ]
+            names_not_ready: list[str] = [name for _, name in players_not_ready]
+            mentions_not_ready: list[str] = [
+                member.mention if (member := get_discord_member_from_id(ctx, id)) is not None else name
+                for id, name in players_not_ready
+            ]
             if len(players_not_ready) == 0:
                 await ctx.send("Ready check complete.")
+                start_game = self._auto_start
             else:
-                log.info(f"{len(players_not_ready)} not ready: {', '.join(players_not_ready)}.")
+                log.info(f"{len(players_not_ready)} not ready: {', '.join(names_not_ready)}.")
                 await ctx.send(f"Still waiting on `{len(players_not_ready)}` players: {', '.join(mentions_not_ready)}.")
 
         self._ready_check_in_progress = False
-        self._players_ready = []
+        self._players_ready = set()
+
+        if start_game:
+            await self._auto_start_game(ctx)
+
+    async def _auto_start_game(self, ctx: Context) -> None:
+        """
+        Starts a game on behalf of whoever initiated a successful ready check. The game is started through the same
+        checks as !start, so the initiator needs the admin role and nothing happens while !start is already running.
+
+        :param ctx: Discord context of the ready check.
+        """
+
+        start: Command = get_bot_instance().get_command("start")  # type: ignore[assignment]
+        start_ctx: Context = copy(ctx)
+        start_ctx.invoked_with = start.name
+
+        log.info("Starting game automatically following a successful ready check.")
+        try:
+            # Command.invoke runs the role check and takes the concurrency slot, both of which Context.invoke skips.
+            await start.invoke(start_ctx)
+        except (CheckFailure, MaxConcurrencyReached):
+            log.info(f"Could not start game automatically for {ctx.author.display_name}.")
+            await ctx.send("Ready check complete - an admin can now `!start` the game.")
 
 
 async def on_presence_update(before: "Member", after: "Member") -> None:
+    # Fires for every status change of every member, so discard anything that cannot sign a player out before doing
+    # any work. Only a drop to offline or idle by someone who is signed up gets past this.
+    state: LobbyState | None = None if lobby_instance is None else lobby_instance._guilds.peek(after.guild.id)
+
+    if (
+        state is None
+        or state.context is None
+        or after.status not in (Status.offline, Status.idle)
+        or after.id not in state.signups
+    ):
+        if lobby_instance is not None:
+            lobby_instance.presence_metrics.filtered += 1
+        return
+
+    lobby_instance.presence_metrics.handled += 1  # type: ignore[union-attr]
+    set_current_guild(after.guild)
     bot: Bot = get_bot_instance()
 
     core: Cog = bot.get_cog("Core")  # type: ignore[assignment]
@@ -274,42 +574,50 @@ async def on_presence_update(before: "Member", after: "Member") -> None:
     if game.in_progress():
         return
 
-    lobby: Lobby = bot.get_cog("Lobby")  # type: ignore[assignment]
-    if lobby._context is None:
-        return
-
-    signups: list[str] = lobby.get_signups()
+    name: str | None = state.signups.remove(after.id)
 
-    name: str = after.display_name
-
-    if after.status in (Status.offline, Status.idle) and name in signups:
+    if name is not None:
         reason: str = "Offline" if after.status == Status.offline else "Idle"
         log.info(f"{name} is now {reason}.")
-        signups.remove(name)
-        await lobby._context.send(f"{after.mention} has been signed out due to being {reason}.")
+        record_checkpoint("signout", id=after.id)
+        lobby_instance._check_all_ready()  # type: ignore[union-attr]
+        lobby_instance._update_status(state.context.channel)  # type: ignore[union-attr]
+        lobby_instance.presence_metrics.signouts += 1  # type: ignore[union-attr]
 
+        # A burst of members going idle or offline (e.g. a network blip) is announced in a single message.
+        state.pending_signouts.append((after.mention, reason))
+        if len(state.pending_signouts) == 1:
+            create_background_task(_announce_signouts(state))
 
-async def allow_message(message: Message, bot: Bot) -> bool:
-    if message.author.display_name not in ("ERIC", "SCOUT"):
-        return True
 
-    commands: list[str] = [command.name for command in bot.commands]
-    command_aliases: list[str] = []
-    for cmd in bot.commands:
-        command_aliases += cmd.aliases
+async def _announce_signouts(state: LobbyState) -> None:
+    await sleep(Lobby.SIGNOUT_COALESCE_SECONDS)
 
-    split_message: list[str] = message.content.split()
-    user_command: str = split_message[0]
+    signouts: list[tuple[str, str]] = state.pending_signouts
+    state.pending_signouts = []
 
-    prefix: str = user_command[0]
-    if prefix != bot.command_prefix:
-        return True
+    if state.context is None or not signouts:
+        return
+
+    lobby_instance.presence_metrics.messages += 1  # type: ignore[union-attr]
+    if len(signouts) == 1:
+        mention, reason = signouts[0]
+        await state.context.send(f"{mention} has been signed out due to being {reason}.")
+    else:
+        mentions: str = ", ".join(f"{mention} ({reason})" for mention, reason in signouts)
+        await state.context.send(f"{mentions} have been signed out due to being idle or offline.")
 
-    user_command = user_command[1:]
-    if user_command not in commands and user_command not in command_aliases:
-        return False
 
-    return True
+def on_cogs_changed() -> None:
+    if lobby_instance is not None:
+        lobby_instance.message_filter.invalidate()
+
+
+async def allow_message(message: Message, bot: Bot) -> bool:
+    if lobby_instance is None:
+        return True
+
+    return lobby_instance.message_filter.allow(message, bot)
 
 
 async def on_message(message: Message) -> None:
@@ -318,9 +626,15 @@ async def on_message(message: Message) -> None:
     if message.author.bot:
         return
 
+    set_current_guild(message.guild)
+
     allow: bool = await allow_message(message, bot)
     if allow is False:
         await message.delete()
         return
 
+    allow = await allow_command(message, bot)
+    if allow is False:
+        return
+
     await bot.process_commands(message)
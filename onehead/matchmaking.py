@@ -3,12 +3,11 @@ import random
 from logging import Logger
 from typing import Any
 
-from discord.member import Member
 from discord.ext.commands import Cog, Context, command, has_role
 from structlog import get_logger
 from tabulate import tabulate
 
-from onehead.common import OneHeadException, Player, Roles, Side, Team, TeamCombination, get_discord_member_from_name
+from onehead.common import OneHeadException, Player, Roles, Side, Team, TeamCombination
 
 from onehead.lobby import Lobby
 from onehead.protocols.database import OneHeadDatabase
@@ -23,19 +22,19 @@ class Matchmaking(Cog):
         self.database: OneHeadDatabase = database
         self.lobby: Lobby = lobby
 
-    def _get_player_records(self, ctx: Context) -> list[Player]:
+    def _get_player_records(self) -> list[Player]:
         """
         Obtains player records for all players that have signed up to play.
 
         :return: Player records for all signed up players.
         """
 
-        players: list[Player] = []
-        for player_name in self.lobby._signups:
-            member: Member | None = get_discord_member_from_name(ctx, player_name)
-            player: Player | None = self.database.get(member.id)
-            if player:
-                players.append(player)
+        players: list[Player]
+        missing: list[int]
+        players, missing = self.database.get_many(self.lobby._signups)
+
+        if missing:
+            log.warning(f"Unable to find player records for: {', '.join(str(id) for id in missing)}.")
 
         return players
 
@@ -86,7 +85,7 @@ class Matchmaking(Cog):
         a rating value associated with each player.
         """
 
-        profiles: list[Player] = self._get_player_records(ctx)
+        profiles: list[Player] = self._get_player_records()
         profile_count: int = len(profiles)
         if profile_count != 10:
             raise OneHeadException(f"Error: Only `{profile_count}` profiles could be found in database.")
@@ -4,6 +4,7 @@ from discord.member import Member
 from discord.ext.commands import Cog, Context, command, has_role
 
 from onehead.common import Roles, get_discord_member_from_name
+from onehead.messaging import Priority, send
 
 
 class MentalHealth(Cog):
@@ -133,4 +134,4 @@ class MentalHealth(Cog):
         else:
             message: str = f"**{name}**\n {quote}"
 
-        await ctx.send(message)
+        send(ctx, message, Priority.COSMETIC)
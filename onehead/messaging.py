@@ -0,0 +1,233 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+from logging import Logger
+from typing import Literal
+
+from discord import Embed
+from discord.abc import Messageable
+from discord.ext.commands import Cog, Context, command, has_role
+from discord.message import Message
+from structlog import get_logger
+
+from onehead.common import GuildShards, Roles, create_background_task
+
+
+log: Logger = get_logger()
+
+# Commands hand messages to the outbox through this reference, so that modules without access to the cogs (e.g. the
+# game's window announcements) can use it too.
+messaging_instance: "Messaging | None" = None
+
+
+class Priority(IntEnum):
+    ADMIN = 0
+    GAME = 1
+    COSMETIC = 2
+
+
+@dataclass
+class OutboundMessage:
+    channel: Messageable
+    content: str
+    enqueued: float
+    done: asyncio.Future
+    embed: Embed | None = None
+
+
+@dataclass
+class OutboxMetrics:
+    sends: int = 0
+    merged: int = 0
+    shed: int = 0
+    max_depth: int = 0
+    latency_total_ms: float = 0.0
+    latency_max_ms: float = 0.0
+    messages: int = 0
+
+    def record(self, latency_ms: float) -> None:
+        self.messages += 1
+        self.latency_total_ms += latency_ms
+        self.latency_max_ms = max(self.latency_max_ms, latency_ms)
+
+    @property
+    def latency_mean_ms(self) -> float:
+        return self.latency_total_ms / self.messages if self.messages else 0.0
+
+
+class Outbox:
+    """
+    Outbound messages for a guild, sent one at a time by a single worker task. Each priority has its own lane and the
+    worker always takes from the highest priority lane that has anything in it, so results and admin output are not
+    stuck behind cosmetic messages in discord.py's rate limiter.
+
+    Consecutive messages in a lane that are bound for the same channel are merged into a single send, as long as they
+    fit in one Discord message and neither has an embed. Once MAX_QUEUED_MESSAGES are waiting the oldest cosmetic
+    message is shed, and a cosmetic message that is identical to one already waiting in the same channel is absorbed by
+    it.
+    """
+
+    MAX_QUEUED_MESSAGES: Literal[25] = 25
+    DISCORD_MAX_MESSAGE_LENGTH: Literal[2000] = 2000
+
+    def __init__(self) -> None:
+        self._lanes: dict[Priority, deque[OutboundMessage]] = {priority: deque() for priority in Priority}
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._worker: asyncio.Task | None = None
+        self.metrics: OutboxMetrics = OutboxMetrics()
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def enqueue(
+        self, channel: Messageable, content: str, priority: Priority, embed: Embed | None = None
+    ) -> asyncio.Future:
+        """
+        Queues a message to be sent.
+
+        :param channel: Channel to send the message to.
+        :param content: Content of the message.
+        :param priority: Lane to queue the message in.
+        :param embed: Embed to send with the message.
+        :return: Future that completes with the sent message, or None if the message was shed. If the message failed to
+        send, the future raises the error.
+        """
+
+        cosmetic: deque[OutboundMessage] = self._lanes[Priority.COSMETIC]
+
+        if priority == Priority.COSMETIC:
+            for queued in cosmetic:
+                if queued.content == content and queued.channel == channel:
+                    return queued.done
+
+        message: OutboundMessage = OutboundMessage(
+            channel, content, time.perf_counter(), asyncio.get_running_loop().create_future(), embed
+        )
+
+        if self.depth() >= self.MAX_QUEUED_MESSAGES:
+            if cosmetic:
+                self._shed(cosmetic.popleft())
+            elif priority == Priority.COSMETIC:
+                self._shed(message)
+                return message.done
+
+        self._lanes[priority].append(message)
+        self.metrics.max_depth = max(self.metrics.max_depth, self.depth())
+        self._wakeup.set()
+
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        return message.done
+
+    def _shed(self, message: OutboundMessage) -> None:
+        self.metrics.shed += 1
+        message.done.set_result(None)
+        log.info(f"Shed message as the outbox is full: {message.content[:50]}")
+
+    def _next_batch(self) -> list[OutboundMessage]:
+        lane: deque[OutboundMessage] = next(lane for lane in self._lanes.values() if lane)
+        batch: list[OutboundMessage] = [lane.popleft()]
+        length: int = len(batch[0].content)
+
+        while (
+            lane
+            and batch[0].embed is None
+            and lane[0].embed is None
+            and lane[0].channel == batch[0].channel
+            and length + 1 + len(lane[0].content) <= self.DISCORD_MAX_MESSAGE_LENGTH
+        ):
+            length += 1 + len(lane[0].content)
+            batch.append(lane.popleft())
+
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            while self.depth() == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            batch: list[OutboundMessage] = self._next_batch()
+            sent: Message | None = None
+            error: Exception | None = None
+
+            try:
+                content: str = "\n".join(message.content for message in batch)
+                sent = await batch[0].channel.send(content or None, embed=batch[0].embed)
+            except Exception as ex:
+                # Anything that escaped here would kill the worker and strand every message queued behind this one.
+                log.error(f"Failed to send message due to {ex}.")
+                error = ex
+            finally:
+                self.metrics.sends += 1
+                self.metrics.merged += len(batch) - 1
+                now: float = time.perf_counter()
+
+                for message in batch:
+                    self.metrics.record((now - message.enqueued) * 1000)
+                    if message.done.done():
+                        continue
+
+                    if error is None:
+                        message.done.set_result(sent)
+                    else:
+                        message.done.set_exception(error)
+
+    def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+        for lane in self._lanes.values():
+            while lane:
+                lane.popleft().done.set_result(None)
+
+
+class Messaging(Cog):
+    def __init__(self) -> None:
+        self._guilds: GuildShards[Outbox] = GuildShards(lambda guild_id: Outbox())
+
+        global messaging_instance
+        messaging_instance = self
+
+    def cog_unload(self) -> None:
+        for outbox in self._guilds.values():
+            outbox.close()
+
+    @has_role(Roles.ADMIN)
+    @command()
+    async def outboxstats(self, ctx: Context) -> None:
+        """
+        Shows the depth of the outbound message queue and how long messages wait before being sent.
+        """
+
+        outbox: Outbox = self._guilds.get()
+        metrics: OutboxMetrics = outbox.metrics
+
+        await ctx.send(
+            f"**Outbox** - `{outbox.depth()}` queued (max `{metrics.max_depth}`), `{metrics.messages}` messages in "
+            f"`{metrics.sends}` sends, `{metrics.shed}` shed, latency mean `{metrics.latency_mean_ms:.0f}ms` max "
+            f"`{metrics.latency_max_ms:.0f}ms`"
+        )
+
+
+def send(ctx: Context, content: str, priority: Priority = Priority.GAME, embed: Embed | None = None) -> asyncio.Future:
+    """
+    Queues a message to the channel of a command through the outbox of its guild.
+
+    :param ctx: Discord context.
+    :param content: Content of the message.
+    :param priority: Lane to queue the message in.
+    :param embed: Embed to send with the message.
+    :return: Future that completes with the sent message, or None if it was shed. If the message failed to send, the
+    future raises the error.
+    """
+
+    if messaging_instance is None:
+        return create_background_task(ctx.send(content or None, embed=embed))
+
+    outbox: Outbox = messaging_instance._guilds.get(None if ctx.guild is None else ctx.guild.id)
+    return outbox.enqueue(ctx.channel, content, priority, embed)
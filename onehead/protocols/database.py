@@ -1,7 +1,7 @@
 from enum import Enum
-from typing import Protocol
+from typing import AsyncContextManager, ContextManager, Iterable, Protocol
 
-from onehead.common import Metadata, Player
+from onehead.common import LedgerEntry, Metadata, Player
 
 
 class Operation(Enum):
@@ -10,30 +10,98 @@ class Operation(Enum):
     SUBTRACT = 2
 
 
+class Durability(Enum):
+    STRICT = 0
+    GROUP = 1
+    RELAXED = 2
+
+
+class WriteClass(Enum):
+    RESULT = "results"
+    BET = "bets"
+    COSMETIC = "cosmetic"
+
+
+class LedgerReason(Enum):
+    OPENING_BALANCE = "opening balance"
+    REGISTRATION = "registration"
+    DEREGISTRATION = "deregistration"
+    BET = "bet"
+    BET_PAYOUT = "bet payout"
+    BET_REFUND = "bet refund"
+    SHUFFLE = "shuffle"
+    SHUFFLE_REFUND = "shuffle refund"
+    WIN_REWARD = "win reward"
+    LOSS_REWARD = "loss reward"
+
+
+class OneHeadTransaction(Protocol):
+    def modify(
+        self,
+        id: int,
+        key: str,
+        value: str | int,
+        operation: Operation = Operation.REPLACE,
+    ) -> None:
+        pass
+
+    def credit(self, id: int, amount: int, reason: LedgerReason, game_id: int | None = None) -> None:
+        pass
+
+    def update_metadata(self, data: Metadata) -> None:
+        pass
+
+
 class OneHeadDatabase(Protocol):
     def get(self, id: int) -> Player | None:
         pass
 
-    def add(self, id: int, name: str, mmr: int) -> None:
+    def get_many(self, ids: Iterable[int]) -> tuple[list[Player], list[int]]:
+        pass
+
+    def add(self, id: int, name: str, mmr: int, write_class: WriteClass = WriteClass.RESULT) -> None:
         pass
 
-    def remove(self, id: int) -> None:
+    def remove(self, id: int, write_class: WriteClass = WriteClass.RESULT) -> None:
         pass
 
     def get_all(self) -> list[Player]:
         pass
 
+    def lock(self, id: int) -> AsyncContextManager[None]:
+        pass
+
+    def debit_if_sufficient(
+        self,
+        id: int,
+        amount: int,
+        reason: LedgerReason,
+        game_id: int | None = None,
+        write_class: WriteClass = WriteClass.BET,
+    ) -> bool:
+        pass
+
+    def get_ledger(self, id: int, limit: int | None = None) -> list[LedgerEntry]:
+        pass
+
+    def reconcile(self, repair: bool = False, ids: Iterable[int] | None = None) -> dict[int, tuple[int, int]]:
+        pass
+
     def modify(
         self,
         id: int,
         key: str,
         value: str | int,
         operation: Operation = Operation.REPLACE,
+        write_class: WriteClass = WriteClass.RESULT,
     ) -> None:
         pass
 
     def get_metadata(self) -> Metadata:
         pass
 
-    def update_metadata(self, data: Metadata) -> None:
+    def update_metadata(self, data: Metadata, write_class: WriteClass = WriteClass.RESULT) -> None:
+        pass
+
+    def transaction(self, write_class: WriteClass = WriteClass.RESULT) -> ContextManager[OneHeadTransaction]:
         pass
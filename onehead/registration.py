@@ -6,6 +6,7 @@ from structlog import get_logger
 
 from onehead.common import Player, Roles, get_discord_member_from_name
 from onehead.protocols.database import OneHeadDatabase
+from onehead.scoreboard import ScoreBoard
 
 
 log: Logger = get_logger()
@@ -15,8 +16,9 @@ class Registration(Cog):
     MIN_MMR: int = 1000
     MAX_MMR: int = 10000
 
-    def __init__(self, database: OneHeadDatabase) -> None:
+    def __init__(self, database: OneHeadDatabase, scoreboard: ScoreBoard) -> None:
         self.database: OneHeadDatabase = database
+        self.scoreboard: ScoreBoard = scoreboard
 
     @has_role(Roles.MEMBER)
     @command(aliases=["reg"])
@@ -44,6 +46,7 @@ class Registration(Cog):
         player: Player | None = self.database.get(id)
         if player is None:
             self.database.add(ctx.author.id, ctx.author.display_name, mmr_int)
+            self.scoreboard.invalidate()
             log.info(f"{ctx.author.display_name} registered with an MMR of {mmr}.")
             await ctx.send(f"{ctx.author.mention} successfully registered.")
         else:
@@ -61,6 +64,7 @@ class Registration(Cog):
 
         if player and member:
             self.database.remove(member.id)
+            self.scoreboard.invalidate()
             log.info(f"{name} has been deregistered by {ctx.author.display_name}.")
             await ctx.send(f"{member.mention} has been deregistered.")
         else:
@@ -1,20 +1,141 @@
+from bisect import bisect_left, insort
 from typing import Any, Literal
 
 from discord.ext.commands import Cog, Context, command, has_role
 from tabulate import tabulate
 
-from onehead.common import OneHeadException, Player, Roles
+from onehead.common import GuildShards, OneHeadException, Player, Roles
 from onehead.protocols.database import OneHeadDatabase
 from onehead.statistics import Statistics
 
 
+class LeaderboardIndex:
+    """
+    Ratings of every player kept sorted in descending order, so that finding a player's rank is a binary search and a
+    change of rating is a single removal and insertion rather than a re-sort of the whole league. Players on the same
+    rating share a rank, as they do on the full scoreboard.
+    """
+
+    def __init__(self) -> None:
+        self._ratings: dict[int, int] = {}
+        self._names: dict[int, str] = {}
+        self._entries: list[tuple[int, int]] = []
+        self.stale: bool = True
+
+    def rebuild(self, players: list[Player]) -> None:
+        self._ratings = {player["id"]: player["rating"] for player in players}
+        self._names = {player["id"]: player["name"] for player in players}
+        self._entries = sorted((-rating, id) for id, rating in self._ratings.items())
+        self.stale = False
+
+    def __contains__(self, id: object) -> bool:
+        return id in self._ratings
+
+    def name(self, id: int) -> str:
+        return self._names[id]
+
+    def rating(self, id: int) -> int:
+        return self._ratings[id]
+
+    def rank(self, id: int) -> int:
+        # (-rating,) sorts before every (-rating, id), so this counts the players with a strictly higher rating.
+        return bisect_left(self._entries, (-self._ratings[id],)) + 1
+
+    def between(self, low: int, high: int) -> list[int]:
+        """
+        Finds the players whose rating lies within a range.
+
+        :param low: Lowest rating, inclusive.
+        :param high: Highest rating, inclusive.
+        :return: Ids of the players, highest rated first.
+        """
+
+        start: int = bisect_left(self._entries, (-high,))
+        end: int = bisect_left(self._entries, (-low + 1,))
+        return [id for _, id in self._entries[start:end]]
+
+    def update(self, id: int, rating: int) -> None:
+        del self._entries[bisect_left(self._entries, (-self._ratings[id], id))]
+        insort(self._entries, (-rating, id))
+        self._ratings[id] = rating
+
+
 class ScoreBoard(Cog):
     # It's actually 2000, but we prepend a small number of characters before our scoreboard so need to take
     # this into account.
     DISCORD_MAX_MESSAGE_LENGTH: Literal[1950] = 1950
+    MAX_SHIFTED_ROWS: Literal[10] = 10
 
     def __init__(self, database: OneHeadDatabase) -> None:
         self.database: OneHeadDatabase = database
+        self._indexes: GuildShards[LeaderboardIndex] = GuildShards(lambda guild_id: LeaderboardIndex())
+
+    def invalidate(self) -> None:
+        """
+        Marks the leaderboard index of the current guild to be rebuilt, for when players are added or removed.
+        """
+
+        self._indexes.get().stale = True
+
+    def prepare_delta(self, ids: list[int]) -> None:
+        """
+        Makes sure the leaderboard index holds the ratings of the given players from before a result is committed.
+
+        :param ids: Players taking part in the game.
+        """
+
+        index: LeaderboardIndex = self._indexes.get()
+
+        if index.stale or any(id not in index for id in ids):
+            scoreboard: list[Player] = self.database.get_all()
+            Statistics.calculate_rating(scoreboard)
+            index.rebuild(scoreboard)
+
+    def apply_delta(self, players: list[Player]) -> list[dict[str, Any]]:
+        """
+        Moves the participants of a game to their new ratings and works out how the leaderboard changed as a result.
+        Only players rated between the lowest and highest of the participants' old and new ratings can have changed
+        rank, so those are the only ones looked at.
+
+        :param players: Records of the participants, as committed.
+        :return: Old and new rating and rank of each participant and anyone else whose rank changed, by new rank.
+        """
+
+        index: LeaderboardIndex = self._indexes.get()
+        Statistics.calculate_rating(players)
+
+        new_ratings: dict[int, int] = {player["id"]: player["rating"] for player in players}
+        old_ratings: dict[int, int] = {id: index.rating(id) for id in new_ratings}
+        ratings: list[int] = [*old_ratings.values(), *new_ratings.values()]
+
+        affected: list[int] = index.between(min(ratings), max(ratings))
+        old_ranks: dict[int, int] = {id: index.rank(id) for id in [*new_ratings, *affected]}
+
+        for id, rating in new_ratings.items():
+            index.update(id, rating)
+
+        rows: list[dict[str, Any]] = []
+        shifted: int = 0
+
+        for id, old_rank in old_ranks.items():
+            new_rank: int = index.rank(id)
+            if id not in new_ratings:
+                if new_rank == old_rank:
+                    continue
+                shifted += 1
+                if shifted > self.MAX_SHIFTED_ROWS:
+                    continue
+
+            rows.append(
+                {
+                    "#": new_rank,
+                    "name": index.name(id),
+                    "rating": f"{old_ratings.get(id, index.rating(id))} -> {index.rating(id)}",
+                    "rank": f"{old_rank} -> {new_rank}",
+                }
+            )
+
+        return sorted(rows, key=lambda row: row["#"])
 
     def _chunk_scoreboard(self, scoreboard: str) -> tuple[str, ...]:
         if len(scoreboard) < self.DISCORD_MAX_MESSAGE_LENGTH:
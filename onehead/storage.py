@@ -0,0 +1,453 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator, MutableMapping
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from logging import Logger
+from pathlib import Path
+from typing import IO, Any, Generator, Literal
+
+from structlog import get_logger
+from tinydb.storages import Storage
+
+from onehead.protocols.database import Durability
+
+
+log: Logger = get_logger()
+
+Tables = dict[str, dict[str, Any]]
+
+
+@dataclass
+class CommitMetrics:
+    commits: int = 0
+    batch_sizes: Counter[int] = field(default_factory=Counter)
+    fsync_total_ms: float = 0.0
+    fsync_max_ms: float = 0.0
+
+    def record(self, batch_size: int, fsync_ms: float) -> None:
+        self.commits += 1
+        self.batch_sizes[batch_size] += 1
+        self.fsync_total_ms += fsync_ms
+        self.fsync_max_ms = max(self.fsync_max_ms, fsync_ms)
+
+    @property
+    def fsync_mean_ms(self) -> float:
+        return self.fsync_total_ms / self.commits if self.commits else 0.0
+
+
+class TablesView(MutableMapping[str, dict[str, Any]]):
+    """
+    What JournaledStorage hands TinyDB when it reads the database. A table is only copied the first time TinyDB looks it
+    up, and its documents are copied one level deep (documents are flat), so an operation costs O(the table it uses)
+    rather than O(the database). The view remembers which tables TinyDB looked up, replaced or dropped, so that a write
+    only has to diff those.
+    """
+
+    def __init__(self, state: Tables) -> None:
+        self._state: Tables = state
+        self.touched: Tables = {}
+        self.dropped: set[str] = set()
+
+    def __getitem__(self, name: str) -> dict[str, Any]:
+        if name in self.touched:
+            return self.touched[name]
+
+        if name in self.dropped or name not in self._state:
+            raise KeyError(name)
+
+        table: dict[str, Any] = {key: dict(document) for key, document in self._state[name].items()}
+        self.touched[name] = table
+        return table
+
+    def __setitem__(self, name: str, table: dict[str, Any]) -> None:
+        self.touched[name] = table
+        self.dropped.discard(name)
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+
+        self.touched.pop(name, None)
+        self.dropped.add(name)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.touched or (name in self._state and name not in self.dropped)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.touched
+        yield from (name for name in self._state if name not in self.touched and name not in self.dropped)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class JournaledStorage(Storage):
+    """
+    TinyDB storage that appends each change to a JSON-lines journal instead of rewriting the whole database file.
+
+    The snapshot file uses the same layout as TinyDB's JSONStorage, so an existing db.json can be used as-is. Once
+    the journal grows past a threshold it is rotated and a background thread atomically rewrites the snapshot.
+    On startup the snapshot is loaded and any journals are replayed on top of it.
+
+    How eagerly a write is fsynced is given by the batch it is made in: STRICT syncs before returning, GROUP waits up to
+    group_commit_ms so that writes landing in the same window share a single fsync, and RELAXED leaves the record in the
+    OS page cache until the next sync of any kind. Writes made outside of a batch are STRICT.
+    """
+
+    DEFAULT_COMPACTION_THRESHOLD: Literal[1048576] = 1048576
+    DEFAULT_GROUP_SIZE: Literal[16] = 16
+    DEFAULT_GROUP_COMMIT_MS: Literal[5] = 5
+
+    def __init__(
+        self,
+        path: str,
+        compaction_threshold: int = DEFAULT_COMPACTION_THRESHOLD,
+        group_size: int = DEFAULT_GROUP_SIZE,
+        group_commit_ms: int = DEFAULT_GROUP_COMMIT_MS,
+        **kwargs: Any,
+    ) -> None:
+        self._path: Path = Path(path)
+        self._journal_path: Path = self._path.with_name(f"{self._path.name}.journal")
+        self._compacting_path: Path = self._path.with_name(f"{self._path.name}.journal.compacting")
+        self._compaction_threshold: int = compaction_threshold
+        self._group_size: int = group_size
+        self._group_commit_s: float = group_commit_ms / 1000
+
+        self._lock: threading.Lock = threading.Lock()
+        self._compactor: threading.Thread | None = None
+        self._commit_timer: threading.Timer | None = None
+        self._unsynced_records: int = 0
+        self._batch: list[dict[str, Any]] | None = None
+
+        self.metrics: CommitMetrics = CommitMetrics()
+
+        self._state: Tables = self._recover()
+        self._journal: IO[str] = open(self._journal_path, "a", encoding="utf-8")
+
+        # Fold a journal left over from an interrupted compaction into the snapshot before it can be rotated over.
+        if self._compacting_path.exists():
+            self._compact(self._state)
+
+    def _recover(self) -> Tables:
+        """
+        Rebuilds the database from the snapshot plus any journals that have not yet been compacted into it.
+
+        :return: Recovered tables.
+        """
+
+        state: Tables = {}
+
+        if self._path.exists() and self._path.stat().st_size > 0:
+            with open(self._path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+
+        # A compaction that was interrupted leaves its journal behind, replay it before the active journal.
+        for journal_path in (self._compacting_path, self._journal_path):
+            if journal_path.exists():
+                self._replay(state, journal_path)
+
+        return state
+
+    @staticmethod
+    def _replay(state: Tables, journal_path: Path) -> None:
+        with open(journal_path, "rb+") as f:
+            offset: int = 0
+            for line in f:
+                try:
+                    record: dict[str, Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line means we crashed mid-append, everything before it is intact. Cut it off so
+                    # that the next record is not appended onto the end of it.
+                    log.warning(f"Discarding incomplete record at the end of {journal_path.name}.")
+                    f.truncate(offset)
+                    break
+
+                JournaledStorage._apply(state, record)
+                offset += len(line)
+
+    @staticmethod
+    def _apply(state: Tables, record: dict[str, Any]) -> None:
+        if "b" in record:
+            for batched_record in record["b"]:
+                JournaledStorage._apply(state, batched_record)
+            return
+
+        table: str = record["t"]
+        key: str | None = record["k"]
+        value: Any = record["v"]
+
+        if key is None:
+            if value is None:
+                state.pop(table, None)
+            else:
+                state[table] = value
+        elif value is None:
+            state.get(table, {}).pop(key, None)
+        else:
+            state.setdefault(table, {})[key] = value
+
+    @staticmethod
+    def _diff_table(table: str, previous: dict[str, Any] | None, documents: dict[str, Any]) -> list[dict[str, Any]]:
+        if previous is None:
+            return [{"t": table, "k": None, "v": documents}]
+
+        records: list[dict[str, Any]] = []
+
+        for key, document in documents.items():
+            if previous.get(key) != document:
+                records.append({"t": table, "k": key, "v": document})
+
+        for key in previous.keys() - documents.keys():
+            records.append({"t": table, "k": key, "v": None})
+
+        return records
+
+    @staticmethod
+    def _diff(before: Tables, after: Tables) -> list[dict[str, Any]]:
+        """
+        Calculates the journal records required to turn one version of the database into another.
+
+        :param before: Last persisted version of the database.
+        :param after: Version of the database that TinyDB has asked us to write.
+        :return: Journal records, one per changed document or table.
+        """
+
+        records: list[dict[str, Any]] = []
+
+        for table, documents in after.items():
+            records.extend(JournaledStorage._diff_table(table, before.get(table), documents))
+
+        for table in before.keys() - after.keys():
+            records.append({"t": table, "k": None, "v": None})
+
+        return records
+
+    def read(self) -> Tables | None:
+        return TablesView(self._state)  # type: ignore[return-value]
+
+    def write(self, data: Tables) -> None:
+        records: list[dict[str, Any]] = []
+
+        if isinstance(data, TablesView):
+            # Only the tables that TinyDB used can have changed, everything else is carried over as it is.
+            state: Tables = dict(self._state)
+
+            for table, documents in data.touched.items():
+                records.extend(self._diff_table(table, self._state.get(table), documents))
+                state[table] = documents
+
+            for table in data.dropped:
+                if table in state:
+                    records.append({"t": table, "k": None, "v": None})
+                    del state[table]
+
+            data = state
+        else:
+            records = self._diff(self._state, data)
+
+        if not records:
+            return
+
+        if self._batch is not None:
+            self._batch.extend(records)
+            self._state = data
+            return
+
+        self._append(records, data, Durability.STRICT)
+
+    @contextmanager
+    def batch(self, durability: Durability = Durability.STRICT) -> Generator[None, None, None]:
+        """
+        Groups every write made inside the block into a single journal line. Replay either applies the whole line or,
+        if it was torn by a crash, none of it, so the writes become visible on disk atomically.
+
+        :param durability: How eagerly the line is synced once the block exits.
+        """
+
+        if self._batch is not None:
+            raise RuntimeError("Journal batches cannot be nested.")
+
+        before: Tables = self._state
+        self._batch = []
+        try:
+            yield
+        except BaseException:
+            # Nothing from the batch has reached the journal, so roll the in-memory state back to match it.
+            self._state = before
+            raise
+        finally:
+            records: list[dict[str, Any]] = self._batch
+            self._batch = None
+
+        if records:
+            self._append([{"b": records}], self._state, durability)
+
+    def _append(self, lines: list[dict[str, Any]], data: Tables, durability: Durability) -> None:
+        with self._lock:
+            for line in lines:
+                self._journal.write(json.dumps(line))
+                self._journal.write("\n")
+
+            self._journal.flush()
+            self._unsynced_records += len(lines)
+
+            if durability == Durability.STRICT or self._unsynced_records >= self._group_size:
+                self._sync()
+            elif durability == Durability.GROUP:
+                self._schedule_group_commit()
+
+            # Never mutated in place from here on, which lets the compactor serialise it without a copy.
+            self._state = data
+
+            if self._journal.tell() >= self._compaction_threshold:
+                self._start_compaction()
+
+    def _sync(self) -> None:
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+
+        if self._unsynced_records == 0:
+            return
+
+        start: float = time.perf_counter()
+        os.fsync(self._journal.fileno())
+        self.metrics.record(self._unsynced_records, (time.perf_counter() - start) * 1000)
+        self._unsynced_records = 0
+
+    def _schedule_group_commit(self) -> None:
+        if self._commit_timer is not None:
+            return
+
+        self._commit_timer = threading.Timer(self._group_commit_s, self._group_commit)
+        self._commit_timer.daemon = True
+        self._commit_timer.start()
+
+    def _group_commit(self) -> None:
+        with self._lock:
+            self._commit_timer = None
+            if not self._journal.closed:
+                self._sync()
+
+    def _start_compaction(self) -> None:
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+
+        self._sync()
+        self._journal.close()
+
+        if self._compacting_path.exists():
+            # The last compaction failed, so the snapshot is still missing the records in its journal. Carry them over
+            # by appending the active journal to it, rather than rotating over the top of it.
+            with open(self._compacting_path, "a", encoding="utf-8") as compacting:
+                with open(self._journal_path, "r", encoding="utf-8") as journal:
+                    shutil.copyfileobj(journal, compacting)
+                compacting.flush()
+                os.fsync(compacting.fileno())
+            os.remove(self._journal_path)
+        else:
+            os.replace(self._journal_path, self._compacting_path)
+
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+        self._compactor = threading.Thread(target=self._run_compaction, args=(self._state,), daemon=True)
+        self._compactor.start()
+
+    def _run_compaction(self, snapshot: Tables) -> None:
+        try:
+            self._compact(snapshot)
+        except Exception as ex:
+            # The journal being compacted is left in place, so it is replayed on startup or merged into the next one.
+            log.error(f"Failed to compact journal into {self._path.name} due to {ex}.")
+
+    def _compact(self, snapshot: Tables) -> None:
+        """
+        Atomically replaces the snapshot file and discards the journal it supersedes.
+
+        :param snapshot: Version of the database at the point the journal was rotated.
+        """
+
+        tmp_path: Path = self._path.with_name(f"{self._path.name}.tmp")
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self._path)
+        os.remove(self._compacting_path)
+
+        log.info(f"Compacted journal into {self._path.name}.")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._journal.closed:
+                return
+
+            self._sync()
+            self._journal.close()
+
+        if self._compactor is not None:
+            self._compactor.join()
+
+
+class Ledger:
+    """
+    Append-only JSON-lines file of RBUCKS ledger entries, kept next to the database rather than in it. Entries are never
+    changed once written, so they are read back once when the ledger is opened and are never part of the tables that
+    JournaledStorage copies and compacts.
+
+    Entries are fsynced before returning for STRICT writes, otherwise they are flushed to the OS and synced by whichever
+    STRICT write comes next.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path: Path = path
+        self._file: IO[str] | None = None
+
+    def read(self) -> list[dict[str, Any]]:
+        """
+        Reads every entry in the ledger, discarding a torn final line left by a crash mid-append.
+
+        :return: Entries, oldest first.
+        """
+
+        entries: list[dict[str, Any]] = []
+        if self._path.exists() is False:
+            return entries
+
+        with open(self._path, "rb+") as f:
+            offset: int = 0
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    log.warning(f"Discarding incomplete entry at the end of {self._path.name}.")
+                    f.truncate(offset)
+                    break
+
+                offset += len(line)
+
+        return entries
+
+    def append(self, entries: list[dict[str, Any]], durability: Durability = Durability.STRICT) -> None:
+        if self._file is None:
+            self._file = open(self._path, "a", encoding="utf-8")
+
+        self._file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self._file.flush()
+        if durability == Durability.STRICT:
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is None or self._file.closed:
+            return
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
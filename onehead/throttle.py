@@ -0,0 +1,218 @@
+import time
+from dataclasses import dataclass
+from logging import Logger
+from typing import Literal
+
+from discord.ext.commands import Bot, Cog, Command, Context, command, has_role
+from discord.member import Member
+from discord.message import Message
+from structlog import get_logger
+
+from onehead.common import GuildShards, OneHeadException, Roles
+from onehead.messaging import Priority, send
+
+
+log: Logger = get_logger()
+
+# Every command passes through on_message, which asks the throttle through this reference before invoking it.
+throttle_instance: "Throttle | None" = None
+
+
+@dataclass
+class Limit:
+    capacity: int
+    per: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.per
+
+
+@dataclass
+class TokenBucket:
+    """
+    Allows a burst of up to capacity calls, after which calls are allowed at the rate the bucket refills. The bucket is
+    only refilled when it is used, so an idle bucket costs nothing.
+    """
+
+    capacity: float
+    rate: float
+    tokens: float
+    updated: float
+    noticed: bool = False
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        self.noticed = False
+        return True
+
+    def retry_after(self) -> float:
+        return max(1 - self.tokens, 0) / self.rate
+
+
+@dataclass
+class ThrottleMetrics:
+    allowed: int = 0
+    throttled: int = 0
+    notices: int = 0
+
+
+class Throttle(Cog):
+    """
+    Limits how often each player can use the commands that read the database or render large tables, using a token
+    bucket per player and command. Limits can be configured per command under throttle.commands, and scaled up for
+    members of a role under throttle.role_multipliers, where the most generous of a player's roles applies.
+
+    A player who goes over the limit is told once when they can next use the command, and their calls are then dropped
+    silently until it is available again.
+    """
+
+    DEFAULT_LIMITS: dict[str, Limit] = {
+        "place_bet": Limit(3, 10),
+        "bets": Limit(2, 30),
+        "rbucks": Limit(2, 30),
+        "statement": Limit(2, 30),
+        "scoreboard": Limit(2, 60),
+        "mmr": Limit(2, 30),
+        "commend": Limit(3, 60),
+        "mental_health": Limit(2, 60),
+    }
+
+    # Once a guild has this many buckets, full ones are dropped as they are no different from a fresh bucket.
+    MAX_BUCKETS: Literal[1000] = 1000
+
+    def __init__(self, config: dict) -> None:
+        throttle_config: dict = config.get("throttle", {})
+
+        self.limits: dict[str, Limit] = dict(self.DEFAULT_LIMITS)
+        for name, limit in throttle_config.get("commands", {}).items():
+            self.limits[name] = Limit(limit["capacity"], limit["per"])
+
+        self.role_multipliers: dict[str, float] = throttle_config.get("role_multipliers", {})
+
+        # Buckets are refilled at capacity / per times the multiplier, which retry_after divides by, so checked here
+        # rather than failing inside a command check. A role is exempted with a large multiplier instead of 0.
+        for name, limit in self.limits.items():
+            if limit.capacity <= 0 or limit.per <= 0:
+                raise OneHeadException(f"throttle.commands.{name} must have a capacity and per greater than 0.")
+        for role, multiplier in self.role_multipliers.items():
+            if multiplier <= 0:
+                raise OneHeadException(f"throttle.role_multipliers.{role} must be greater than 0.")
+        self.metrics: ThrottleMetrics = ThrottleMetrics()
+        self._guilds: GuildShards[dict[tuple[int, str], TokenBucket]] = GuildShards(lambda guild_id: {})
+
+        global throttle_instance
+        throttle_instance = self
+
+    def _get_limit(self, command: Command) -> Limit | None:
+        for name in (command.qualified_name, *command.aliases):
+            if name in self.limits:
+                return self.limits[name]
+
+        return None
+
+    def _get_multiplier(self, author: object) -> float:
+        if isinstance(author, Member) is False:
+            return 1.0
+
+        multipliers: list[float] = [self.role_multipliers.get(role.name, 1.0) for role in author.roles]
+        return max(multipliers, default=1.0)
+
+    def _prune(self, buckets: dict[tuple[int, str], TokenBucket], now: float) -> None:
+        for key, bucket in list(buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del buckets[key]
+
+    async def allow(self, message: Message, bot: Bot) -> bool:
+        """
+        Takes a token from the author's bucket for the command a message invokes, and sends a notice the first time a
+        call is turned away.
+
+        :param message: Discord message, which may or may not be a command.
+        :param bot: OneHead Bot.
+        :return: False if the message invokes a command that the author has used too often, otherwise True.
+        """
+
+        prefix: str = bot.command_prefix  # type: ignore[assignment]
+        if message.content.startswith(prefix) is False:
+            return True
+
+        words: list[str] = message.content[len(prefix) :].split(None, 1)
+        command: Command | None = bot.all_commands.get(words[0]) if words else None
+        limit: Limit | None = None if command is None else self._get_limit(command)
+        if limit is None:
+            return True
+
+        now: float = time.monotonic()
+        buckets: dict[tuple[int, str], TokenBucket] = self._guilds.get()
+        key: tuple[int, str] = (message.author.id, command.qualified_name)  # type: ignore[union-attr]
+
+        bucket: TokenBucket | None = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.MAX_BUCKETS:
+                self._prune(buckets, now)
+
+            multiplier: float = self._get_multiplier(message.author)
+            capacity: float = limit.capacity * multiplier
+            bucket = TokenBucket(capacity, limit.rate * multiplier, capacity, now)
+            buckets[key] = bucket
+
+        if bucket.take(now):
+            self.metrics.allowed += 1
+            return True
+
+        self.metrics.throttled += 1
+        if bucket.noticed is False:
+            bucket.noticed = True
+            self.metrics.notices += 1
+            log.info(f"Throttled {message.author.display_name} using !{words[0]}.")
+
+            # Only build a context when there is a notice to send, so that turning away repeat calls stays cheap.
+            ctx: Context = await bot.get_context(message)
+            send(
+                ctx,
+                f"{message.author.mention} - Slow down! `!{words[0]}` can be used again in "
+                f"`{bucket.retry_after():.0f}s`.",
+                Priority.COSMETIC,
+            )
+
+        return False
+
+    @has_role(Roles.ADMIN)
+    @command()
+    async def throttlestats(self, ctx: Context) -> None:
+        """
+        Shows how many commands have been throttled and who is currently being throttled.
+        """
+
+        now: float = time.monotonic()
+        buckets: dict[tuple[int, str], TokenBucket] = self._guilds.get()
+        throttled: list[str] = []
+
+        for (id, name), bucket in buckets.items():
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                member: Member | None = ctx.guild.get_member(id) if ctx.guild is not None else None
+                throttled.append(f"{id if member is None else member.display_name} (`!{name}`)")
+
+        metrics: ThrottleMetrics = self.metrics
+        await ctx.send(
+            f"**Throttle** - `{metrics.allowed}` allowed, `{metrics.throttled}` throttled, `{metrics.notices}` notices "
+            f"sent, `{len(buckets)}` buckets. Currently throttled: {', '.join(throttled) or 'nobody'}."
+        )
+
+
+async def allow_command(message: Message, bot: Bot) -> bool:
+    if throttle_instance is None:
+        return True
+
+    return await throttle_instance.allow(message, bot)
@@ -1,7 +1,6 @@
 from logging import Logger
 from typing import TYPE_CHECKING, Literal
 
-from discord.member import Member
 from discord.ext.commands import Bot, Cog, Context, command, has_role
 from structlog import get_logger
 
@@ -13,12 +12,13 @@ from onehead.common import (
     Team,
     get_bot_instance,
     get_player_names,
-    get_discord_member_from_name,
-    play_sound
+    play_sound,
+    record_checkpoint,
 )
 from onehead.game import Game
 from onehead.lobby import Lobby
-from onehead.protocols.database import OneHeadDatabase, Operation
+from onehead.messaging import send
+from onehead.protocols.database import LedgerReason, OneHeadDatabase, WriteClass
 
 
 if TYPE_CHECKING:
@@ -36,19 +36,15 @@ class Transfers(Cog):
         self.database: OneHeadDatabase = database
         self.lobby: Lobby = lobby
 
-    async def refund_transfers(self, ctx: Context) -> None:
-        bot: Bot = get_bot_instance()
-        core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game = core.current_game
-
-        transfers: list[PlayerTransfer] = current_game.get_player_transfers()
+    async def refund_transfers(self, ctx: Context, game: Game) -> None:
+        transfers: list[PlayerTransfer] = game.get_player_transfers()
 
         if len(transfers) == 0:
             return
 
-        for transfer in transfers:
-            m: Member | None = get_discord_member_from_name(ctx, transfer.buyer)
-            self.database.modify(m.id, "rbucks", transfer.amount, Operation.ADD)
+        with self.database.transaction(WriteClass.BET) as transaction:
+            for transfer in transfers:
+                transaction.credit(transfer.buyer_id, transfer.amount, LedgerReason.SHUFFLE_REFUND, game.id)
 
         message: str = "All player transactions have been refunded."
         log.info(message)
@@ -63,7 +59,7 @@ class Transfers(Cog):
 
         bot: Bot = get_bot_instance()
         core: Core = bot.get_cog("Core")  # type: ignore[assignment]
-        current_game: Game = core.current_game
+        current_game: Game = core.game_for(ctx)
 
         transfers: list[PlayerTransfer] = current_game.get_player_transfers()
 
@@ -76,29 +72,36 @@ class Transfers(Cog):
 
         name: str = ctx.author.display_name
 
-        if name not in self.lobby.get_signups():
+        # Signups are cleared once a game starts if there is room for another game to be organised alongside it.
+        if self.lobby.is_signed_up(ctx.author.id) is False and core.game_for_player(ctx.author.id) is not current_game:
             await ctx.send(f"{ctx.author.mention} is unable to shuffle are not participating in the current game.")
             return
 
-        profile: Player | None = self.database.get(ctx.author.id)
-        if profile is None:
-            await ctx.send(f"Unable to find {ctx.author.mention} in database.")
-            return
-
-        current_balance: int = profile["rbucks"]
-
-        if current_balance < self.SHUFFLE_COST:
-            await ctx.send(
-                f"{ctx.author.mention} cannot shuffle as they only have {current_balance} "
-                f"RBUCKS. A shuffle costs {Transfers.SHUFFLE_COST} RBUCKS."
+        async with self.database.lock(ctx.author.id):
+            profile: Player | None = self.database.get(ctx.author.id)
+            if profile is None:
+                await ctx.send(f"Unable to find {ctx.author.mention} in database.")
+                return
+
+            if (
+                self.database.debit_if_sufficient(
+                    ctx.author.id, Transfers.SHUFFLE_COST, LedgerReason.SHUFFLE, current_game.id
+                )
+                is False
+            ):
+                await ctx.send(
+                    f"{ctx.author.mention} cannot shuffle as they only have {profile['rbucks']} "
+                    f"RBUCKS. A shuffle costs {Transfers.SHUFFLE_COST} RBUCKS."
+                )
+                return
+
+            transfers.append(PlayerTransfer(name, Transfers.SHUFFLE_COST, ctx.author.id))
+            record_checkpoint(
+                "transfer", id=current_game.id, buyer=name, amount=Transfers.SHUFFLE_COST, buyer_id=ctx.author.id
             )
-            return
 
         await play_sound(ctx, "transfer.mp3")
-        await ctx.send(f"{ctx.author.mention} has spent **{Transfers.SHUFFLE_COST}** RBUCKS to **shuffle** the teams!")
-
-        self.database.modify(ctx.author.id, "rbucks", Transfers.SHUFFLE_COST, Operation.SUBTRACT)
-        transfers.append(PlayerTransfer(name, Transfers.SHUFFLE_COST))
+        send(ctx, f"{ctx.author.mention} has spent **{Transfers.SHUFFLE_COST}** RBUCKS to **shuffle** the teams!")
 
         current_teams_names_only: tuple[tuple[str, ...], tuple[str, ...]] = get_player_names(
             current_game.radiant, current_game.dire
@@ -118,5 +121,11 @@ class Transfers(Cog):
             shuffled_teams_names_only = get_player_names(shuffled_teams[0], shuffled_teams[1])
 
         current_game.radiant, current_game.dire = shuffled_teams
+        record_checkpoint(
+            "teams",
+            id=current_game.id,
+            radiant=[player["id"] for player in current_game.radiant],
+            dire=[player["id"] for player in current_game.dire],
+        )
 
         await core.show_teams(ctx)
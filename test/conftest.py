@@ -7,6 +7,7 @@ from discord.guild import Guild
 from discord.member import Member
 from discord.role import Role
 
+from onehead.common import set_default_guild_id
 from onehead.core import bot_factory
 
 TEST_USER: str = "TestUser0_0_nick"
@@ -23,6 +24,9 @@ async def bot() -> Bot:
     guild: Guild = guilds[0]
     await guild.create_role(name="IHL")
     await guild.create_role(name="IHL Admin")
+
+    # Tests set up state outside of a guild event, which should land on the shard of the test guild.
+    set_default_guild_id(guild.id)
     return bot
 
 
@@ -0,0 +1,90 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from discord.opus import Encoder
+
+from onehead.audio import BufferedPCMAudio, Cue, SoundBank, VoiceSession
+
+
+def frames(count: int) -> tuple[bytes, ...]:
+    return tuple(bytes(Encoder.FRAME_SIZE) for _ in range(count))
+
+
+class TestSoundBank:
+    @pytest.mark.asyncio
+    async def test_decodes_once(self) -> None:
+        sound_bank: SoundBank = SoundBank(Path("."))
+        sound_bank._decode = Mock()
+        sound_bank._decode.return_value = frames(3)
+
+        for _ in range(3):
+            source: BufferedPCMAudio = await sound_bank.get("bet.mp3")
+
+        sound_bank._decode.assert_called_once_with("bet.mp3")
+        assert [source.read() for _ in range(4)][-1] == b""
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used(self) -> None:
+        sound_bank: SoundBank = SoundBank(Path("."), max_bytes=Encoder.FRAME_SIZE * 4)
+        sound_bank._decode = Mock()
+        sound_bank._decode.return_value = frames(2)
+
+        await sound_bank.get("start.mp3")
+        await sound_bank.get("bet.mp3")
+        await sound_bank.get("start.mp3")
+        await sound_bank.get("result.mp3")
+
+        assert list(sound_bank._sounds) == ["start.mp3", "result.mp3"]
+
+
+class TestVoiceSession:
+    @pytest.mark.asyncio
+    async def test_cues_played_in_order_and_merged(self) -> None:
+        session: VoiceSession = VoiceSession(SoundBank(Path(".")))
+        played: list[str] = []
+
+        async def play(cue: Cue) -> None:
+            played.append(cue.file_name)
+
+        session._play = play
+        channel: Mock = Mock(id=1)
+
+        session.enqueue(channel, "start.mp3")
+        first_bet: asyncio.Future = session.enqueue(channel, "bet.mp3")
+        second_bet: asyncio.Future = session.enqueue(channel, "bet.mp3")
+        last: asyncio.Future = session.enqueue(channel, "result.mp3")
+
+        assert first_bet is second_bet
+        await last
+        assert played == ["start.mp3", "bet.mp3", "result.mp3"]
+
+    @pytest.mark.asyncio
+    async def test_oldest_cue_dropped_when_full(self) -> None:
+        session: VoiceSession = VoiceSession(SoundBank(Path(".")))
+        session._play = AsyncMock()
+        channel: Mock = Mock(id=1)
+
+        cues: list[asyncio.Future] = [
+            session.enqueue(channel, f"{i}.mp3") for i in range(VoiceSession.MAX_QUEUED_CUES + 1)
+        ]
+
+        assert cues[0].done()
+        await cues[-1]
+        assert session._play.await_count == VoiceSession.MAX_QUEUED_CUES
+
+    @pytest.mark.asyncio
+    async def test_leaves_voice_when_idle(self) -> None:
+        session: VoiceSession = VoiceSession(SoundBank(Path(".")), idle_timeout=0.01)
+        voice_client: Mock = Mock(is_connected=Mock(return_value=True), disconnect=AsyncMock())
+
+        async def play(cue: Cue) -> None:
+            session._voice_client = voice_client
+
+        session._play = play
+        await session.enqueue(Mock(id=1), "result.mp3")
+        await asyncio.wait_for(session._worker, timeout=1)  # type: ignore[arg-type]
+
+        voice_client.disconnect.assert_awaited_once()
+        assert session._voice_client is None
@@ -1,3 +1,4 @@
+from pathlib import Path
 from unittest.mock import Mock
 
 import discord.ext.test as dpytest
@@ -7,9 +8,11 @@ from discord import Embed, colour
 from discord.ext.commands import Bot, errors
 from discord.member import Member
 
-from onehead.betting import Bet
-from onehead.common import Side
+from onehead.betting import Bet, BetBook, Betting, Market
+from onehead.common import OneHeadException, Side
 from onehead.core import Core
+from onehead.database import Database
+from onehead.protocols.database import LedgerReason
 
 
 class TestBets:
@@ -24,6 +27,10 @@ class TestBets:
 
         embed: Embed = Embed(colour=colour.Colour.green())
         embed.add_field(name="Active Bets", value="``````")
+        embed.add_field(
+            name="Pool",
+            value="Fixed odds - Radiant `0` RBUCKS (`0` bets) @ `2.00`, Dire `0` RBUCKS (`0` bets) @ `2.00`",
+        )
 
         await dpytest.message("!bets")
         assert dpytest.verify().message().embed(embed)
@@ -33,17 +40,83 @@ class TestBets:
         await add_ihl_role(bot, "IHL")
 
         core: Core = bot.get_cog("Core")
-        core.current_game._bets.append(Bet("dire", 1000, "RBEEZAY"))
+        core.current_game._bets.append(Bet("dire", 1000, "RBEEZAY", 1))
 
         embed: Embed = Embed(colour=colour.Colour.green())
         embed.add_field(
             name="Active Bets",
             value="```side      stake  player\n------  -------  --------\ndire       1000  RBEEZAY```",
         )
+        embed.add_field(
+            name="Pool",
+            value="Fixed odds - Radiant `0` RBUCKS (`0` bets) @ `2.00`, Dire `1000` RBUCKS (`1` bets) @ `2.00`",
+        )
         await dpytest.message("!bets")
         assert dpytest.verify().message().embed(embed)
 
 
+class TestBetBook:
+    def test_totals_maintained_per_bet(self) -> None:
+        book: BetBook = BetBook()
+        book.append(Bet(Side.RADIANT, 100, "RBEEZAY", 1))
+        book.append(Bet(Side.DIRE, 500, "RBEEZAY", 1))
+        book.append(Bet(Side.RADIANT, 200, "HARRY", 2))
+
+        assert len(book) == 3
+        assert book.pools == {Side.RADIANT: 300, Side.DIRE: 500}
+        assert book.exposure == {1: 600, 2: 200}
+        assert book.names == {1: "RBEEZAY", 2: "HARRY"}
+
+        assert book.payouts(Side.RADIANT) == {1: 200, 2: 400}
+        assert book.net(Side.RADIANT) == {1: -400, 2: 200}
+        assert book.payouts(Side.DIRE) == {1: 1000}
+        assert book.net(Side.DIRE) == {1: 400, 2: -200}
+
+    def test_parimutuel(self) -> None:
+        book: BetBook = BetBook(market=Market.PARIMUTUEL)
+        assert book.price(Side.RADIANT) is None
+
+        for i in range(500):
+            book.append(Bet(Side.RADIANT if i % 4 else Side.DIRE, 10 + i, f"PLAYER{i}", i))
+
+        total: int = book.total()
+        assert book.price(Side.RADIANT) == pytest.approx(total / book.pools[Side.RADIANT])
+        assert sum(book.payouts(Side.DIRE).values()) == pytest.approx(total, abs=len(book))
+
+        # Prices are fixed once betting closes, and no more bets are taken.
+        book.lock()
+        price: float | None = book.price(Side.DIRE)
+        with pytest.raises(OneHeadException):
+            book.append(Bet(Side.DIRE, 10000, "LATE", 3))
+        assert book.price(Side.DIRE) == price
+        assert book.total() == total
+
+    def test_parimutuel_refunds_if_nobody_backed_the_winner(self) -> None:
+        book: BetBook = BetBook(market=Market.PARIMUTUEL)
+        book.append(Bet(Side.RADIANT, 100, "RBEEZAY", 1))
+        book.append(Bet(Side.RADIANT, 50, "HARRY", 2))
+
+        assert book.payouts(Side.DIRE) == {1: 100, 2: 50}
+        assert book.net(Side.DIRE) == {1: 0, 2: 0}
+
+    def test_model_priced(self) -> None:
+        radiant: list[dict] = [{"mmr": 3000, "adjusted_mmr": 3400}] * 5
+        dire: list[dict] = [{"mmr": 3000}] * 5
+
+        book: BetBook = BetBook(market=Market.MODEL)
+        book.set_teams(radiant, dire)  # type: ignore[arg-type]
+
+        favourite: float | None = book.price(Side.RADIANT)
+        assert favourite == pytest.approx(1.1, abs=0.01)
+        assert book.price(Side.DIRE) == pytest.approx(11, abs=0.1)
+
+        # Money on the underdog shortens its price, and each bet keeps the price it was placed at.
+        book.append(Bet(Side.DIRE, 1000, "RBEEZAY", 1))
+        assert book.payouts(Side.DIRE) == {1: 10999}
+        assert book.price(Side.DIRE) < 11  # type: ignore[operator]
+        assert book.price(Side.RADIANT) > favourite  # type: ignore[operator]
+
+
 class TestPlaceBet:
     @pytest.mark.asyncio
     async def test_no_ihl_role(self, bot: Bot) -> None:
@@ -56,6 +129,20 @@ class TestPlaceBet:
         await dpytest.message("!bet dire all")
         assert dpytest.verify().message().content("Betting window closed.")
 
+    @pytest.mark.asyncio
+    async def test_betting_closed_while_waiting(self, bot: Bot) -> None:
+        await add_ihl_role(bot, "IHL")
+        core: Core = bot.get_cog("Core")
+        core.database.debit_if_sufficient = Mock()
+
+        # The window was open when the command arrived, but the prices were locked before it could be placed.
+        core.current_game._betting_window_open = True
+        core.current_game.get_bets().lock()
+        await dpytest.message(f"!bet {Side.RADIANT} all")
+
+        assert dpytest.verify().message().content("Betting window closed.")
+        core.database.debit_if_sufficient.assert_not_called()
+
     @pytest.mark.asyncio
     async def test_player_does_not_exist(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
@@ -168,7 +255,8 @@ class TestPlaceBet:
         core.database.get = Mock()
         record = {"name": "RBEEZAY", "rbucks": 100}
         core.database.get.return_value = record
-        core.database.modify = Mock()
+        core.database.debit_if_sufficient = Mock()
+        core.database.debit_if_sufficient.return_value = True
 
         core.current_game._betting_window_open = True
         await dpytest.message(f"!bet {Side.RADIANT} all", 0, member)
@@ -176,6 +264,24 @@ class TestPlaceBet:
             dpytest.verify()
             .message()
             .content(
-                f"RBEEZAY has placed a bet of {record['rbucks']:.0f} RBUCKS on {Side.RADIANT.title()}."
+                f"RBEEZAY has placed a bet of {record['rbucks']:.0f} RBUCKS on {Side.RADIANT.title()} at `2.00`."
             )
         )
+
+
+class TestStatement:
+    @pytest.mark.asyncio
+    async def test_statement(self, bot: Bot, tmp_path: Path) -> None:
+        member: Member = await dpytest.member_join(name="LEDGER")
+        await add_ihl_role(bot, "IHL", "LEDGER")
+        betting: Betting = bot.get_cog("Betting")
+        betting.database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        betting.database.add(member.id, "LEDGER", 3000)
+
+        betting.database.debit_if_sufficient(member.id, 40, LedgerReason.BET, game_id=5)
+        await dpytest.message("!statement", 0, member)
+
+        statement: str = dpytest.get_message().embeds[0].fields[0].value
+        assert statement.index("-40") < statement.index(f"+{Betting.INITIAL_BALANCE}")
+
+        betting.database.cog_unload()
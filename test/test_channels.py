@@ -0,0 +1,36 @@
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from discord.errors import HTTPException
+
+from onehead.channels import Channels
+
+
+def http_exception(status: int) -> HTTPException:
+    return HTTPException(Mock(status=status, reason=""), "")
+
+
+def voice_member(move_to: AsyncMock) -> Mock:
+    return Mock(display_name="RBEEZAY", voice=Mock(channel=Mock(id=1)), move_to=move_to)
+
+
+class TestMoveMember:
+    @pytest.mark.asyncio
+    async def test_retries_server_errors(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(Channels, "MOVE_RETRY_DELAY", 0)
+        channels: Channels = Channels({"discord": {"channels": {"lobby": "LOBBY", "match": "MATCH"}}})
+        move_to: AsyncMock = AsyncMock(side_effect=[http_exception(503), None])
+
+        await channels._move_member(voice_member(move_to), Mock(id=2, guild=Mock(id=3)))
+
+        assert move_to.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_fails_fast_on_client_errors(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(Channels, "MOVE_RETRY_DELAY", 0)
+        channels: Channels = Channels({"discord": {"channels": {"lobby": "LOBBY", "match": "MATCH"}}})
+        move_to: AsyncMock = AsyncMock(side_effect=http_exception(403))
+
+        await channels._move_member(voice_member(move_to), Mock(id=2, guild=Mock(id=3)))
+
+        assert move_to.await_count == 1
@@ -1,13 +1,17 @@
-from unittest.mock import AsyncMock
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock, Mock
 
 import discord.ext.test as dpytest
 import pytest
 from conftest import add_ihl_role
 from discord.ext.commands import Bot, errors
+from structlog.testing import capture_logs
 
-from onehead.betting import Bet
-from onehead.common import OneHeadException, Player, Side
+from onehead.betting import Bet, BetBook, Betting
+from onehead.common import OneHeadException, Player, Side, background_tasks
 from onehead.core import Core
+from onehead.database import Database
 from onehead.game import Game
 from onehead.lobby import Lobby
 
@@ -39,7 +43,8 @@ class TestStart:
         await add_ihl_role(bot, "IHL Admin")
 
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups = ["BOB", "BILL"]
+        lobby._signups.add(1, "BOB")
+        lobby._signups.add(2, "BILL")
 
         await dpytest.message("!start")
         assert dpytest.verify().message().content("Only 2 Signup(s), require 8 more.")
@@ -51,17 +56,28 @@ class TestStart:
 
         lobby: Lobby = bot.get_cog("Lobby")
         players: list[Player] = lobby.database.get_all()[:10]
-        lobby._signups = [player["name"] for player in players]
+        for player in players:
+            lobby._signups.add(player["id"], player["name"])
 
         core: Core = bot.get_cog("Core")
         balance: AsyncMock = AsyncMock()
         balance.return_value = [], []
         core.matchmaking.balance = balance
         core.setup_team_channels = AsyncMock()
-        core.current_game.open_transfer_window = AsyncMock()
-        core.current_game.open_betting_window = AsyncMock()
+        windows_closed: asyncio.Event = asyncio.Event()
 
+        async def run_windows(ctx: Mock) -> None:
+            await windows_closed.wait()
+
+        core.current_game.run_windows = run_windows
+
+        # !start returns while the windows are still open, so that it does not hold up other commands.
         await dpytest.message("!start")
+        await dpytest.empty_queue()
+        assert dpytest.verify().message().nothing()
+
+        windows_closed.set()
+        await asyncio.gather(*background_tasks)
         assert dpytest.verify().message().content("GLHF")
 
 
@@ -91,10 +107,55 @@ class TestStop:
         assert core.lobby.get_signups() == []
         assert core.current_game.betting_window_open() is False
         assert core.current_game.transfer_window_open() is False
-        assert core.current_game.get_bets() == []
+        assert len(core.current_game.get_bets()) == 0
         assert core.current_game.get_player_transfers() == []
         assert core.previous_game is None
 
+    @pytest.mark.asyncio
+    async def test_by_game_id(self, bot: Bot) -> None:
+        await add_ihl_role(bot, "IHL Admin")
+
+        core: Core = bot.get_cog("Core")
+        core.channels.move_back_to_lobby = AsyncMock()
+        game: Game = core._new_game()
+        game.radiant = tuple(Player(id=i) for i in range(5))
+        game.dire = tuple(Player(id=i) for i in range(5, 10))
+        game.start()
+        core.register_game(game)
+
+        await dpytest.message(f"!stop {game.id}")
+        assert dpytest.verify().message().content("Game cancelled.")
+        assert game.in_progress() is False
+        assert game.id not in core.games
+
+    @pytest.mark.asyncio
+    async def test_during_windows(self, bot: Bot) -> None:
+        await add_ihl_role(bot, "IHL")
+        await add_ihl_role(bot, "IHL Admin")
+
+        lobby: Lobby = bot.get_cog("Lobby")
+        for player in lobby.database.get_all()[:10]:
+            lobby._signups.add(player["id"], player["name"])
+
+        core: Core = bot.get_cog("Core")
+        balance: AsyncMock = AsyncMock()
+        balance.return_value = [], []
+        core.matchmaking.balance = balance
+        core.setup_team_channels = AsyncMock()
+        core.channels.move_back_to_lobby = AsyncMock()
+        game: Game = core.current_game
+
+        await dpytest.message("!start")
+        assert game.transfer_window_open()
+
+        await dpytest.message("!stop")
+        await asyncio.gather(*background_tasks)
+
+        # The windows end with the game, and its players are not moved into team channels.
+        assert game.in_progress() is False
+        core.setup_team_channels.assert_not_awaited()
+        assert game.id not in core.games
+
 
 class TestResult:
     @pytest.mark.asyncio
@@ -172,10 +233,12 @@ class TestResult:
         current_game._in_progress = True
         current_game.radiant = [Player(name="RBEEZAY")]
         current_game.dire = []
-        current_game._bets = [
-            Bet(Side.RADIANT, 100, "RBEEZAY"),
-            Bet(Side.DIRE, 500, "RBEEZAY"),
-        ]
+        current_game._bets = BetBook(
+            [
+                Bet(Side.RADIANT, 100, "RBEEZAY", 1),
+                Bet(Side.DIRE, 500, "RBEEZAY", 1),
+            ]
+        )
 
         core.scoreboard.scoreboard = AsyncMock()
         core.channels.move_back_to_lobby = AsyncMock()
@@ -187,10 +250,79 @@ class TestResult:
         assert core.lobby.get_signups() == []
         assert core.current_game.betting_window_open() is False
         assert core.current_game.transfer_window_open() is False
-        assert core.current_game.get_bets() == []
+        assert len(core.current_game.get_bets()) == 0
         assert core.current_game.get_player_transfers() == []
         assert core.previous_game == current_game
 
+    @pytest.mark.asyncio
+    async def test_committed_before_presentation(self, bot: Bot, tmp_path: Path) -> None:
+        await add_ihl_role(bot, "IHL Admin")
+        core: Core = bot.get_cog("Core")
+        core.database = core.scoreboard.database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        for id in (1, 2):
+            core.database.add(id, f"PLAYER{id}", 3000)
+
+        winner: Player
+        loser: Player
+        winner, loser = core.database.get_many([1, 2])[0]
+        game: Game = core.current_game
+        game._in_progress = True
+        game.radiant = (winner,)
+        game.dire = (loser,)
+        game._bets.append(Bet(Side.RADIANT, 100, "PLAYER1", 1))
+
+        wins_seen: list[int] = []
+        steps: list[str] = []
+        both_started: asyncio.Event = asyncio.Event()
+
+        async def step(*args) -> None:
+            wins_seen.append(core.database.get(winner["id"])["win"])
+            steps.append("started")
+            if len(steps) == 2:
+                both_started.set()
+
+            await asyncio.wait_for(both_started.wait(), timeout=1)
+            steps.append("finished")
+
+        core.channels.move_back_to_lobby = AsyncMock(side_effect=step)
+        core._announce_result = AsyncMock(side_effect=step)
+
+        await dpytest.message(f"!result {Side.RADIANT}")
+
+        # Both steps see the committed result and run at the same time rather than one after the other.
+        assert wins_seen == [winner["win"] + 1] * 2
+        assert steps == ["started", "started", "finished", "finished"]
+        assert core.previous_game is game
+
+        # Bets are settled by player id, and reported by name.
+        assert core.database.get(1)["rbucks"] == winner["rbucks"] + Betting.REWARD_ON_WIN + 200
+        assert core._announce_result.await_args.args[3] == {"PLAYER1": 100}
+
+        core.database.cog_unload()
+
+    @pytest.mark.asyncio
+    async def test_presentation_failure_logged(self, bot: Bot, tmp_path: Path) -> None:
+        await add_ihl_role(bot, "IHL Admin")
+        core: Core = bot.get_cog("Core")
+        core.database = core.scoreboard.database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        for id in (1, 2):
+            core.database.add(id, f"PLAYER{id}", 3000)
+
+        game: Game = core.current_game
+        game._in_progress = True
+        game.radiant, game.dire = ((player,) for player in core.database.get_many([1, 2])[0])
+
+        core.channels.move_back_to_lobby = AsyncMock(side_effect=OneHeadException("no lobby channel"))
+        core._announce_result = AsyncMock()
+
+        with capture_logs() as logs:
+            await dpytest.message(f"!result {Side.RADIANT}")
+
+        assert {"event": "Failed to complete result handling due to no lobby channel.", "log_level": "error"} in logs
+        core._announce_result.assert_awaited_once()
+
+        core.database.cog_unload()
+
 
 class TestStatus:
     @pytest.mark.asyncio
@@ -232,3 +364,47 @@ class TestStatus:
                 "**Current Game** ```\nradiant    dire\n---------  ------\nA          F\nB          G\nC          H\nD          I\nE          J```"
             )
         )
+
+
+class TestConfig:
+    @pytest.mark.asyncio
+    async def test_invalid_market(self, bot: Bot, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr("onehead.core.load_config", lambda: {"betting": {"market": "fixd"}})
+
+        with pytest.raises(ValueError):
+            Core(bot, "token")
+
+
+class TestGameRegistry:
+    @pytest.mark.asyncio
+    async def test_routes_players_and_channels(self, bot: Bot) -> None:
+        core: Core = bot.get_cog("Core")
+        first: Game = core._new_game()
+        first.radiant = tuple(Player(id=i) for i in range(5))
+        first.dire = tuple(Player(id=i) for i in range(5, 10))
+        second: Game = core._new_game()
+        second.radiant = tuple(Player(id=i) for i in range(10, 15))
+        second.dire = tuple(Player(id=i) for i in range(15, 20))
+
+        core.register_game(first)
+        core.register_game(second)
+        core.register_channels(second, [Mock(id=100), Mock(id=101)])
+
+        assert core.game_for(Mock(author=Mock(id=3))) is first
+        assert core.game_for(Mock(author=Mock(id=17))) is second
+        assert core.game_for(Mock(author=Mock(id=99, voice=Mock(channel=Mock(id=101))))) is second
+
+        await core.reset(Mock(), second)
+
+        assert core.game_for_player(17) is None
+        assert core.game_for(Mock(author=Mock(id=99, voice=Mock(channel=Mock(id=101))))) is first
+        assert core.previous_game_for(Mock(author=Mock(id=17))) is second
+
+        # Starting their next game drops a player's previous game.
+        third: Game = core._new_game()
+        third.radiant = tuple(Player(id=i) for i in range(15, 20))
+        third.dire = tuple(Player(id=i) for i in range(20, 25))
+        core.register_game(third)
+
+        assert 17 not in core._previous_games
+        assert core._previous_games[12] is second
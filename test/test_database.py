@@ -0,0 +1,323 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from tinydb import Query, TinyDB
+
+from onehead.betting import Betting
+from onehead.common import OneHeadException
+from onehead.database import Database, ledger_entry
+from onehead.protocols.database import Durability, LedgerReason, Operation, WriteClass
+from onehead.storage import JournaledStorage, TablesView
+
+
+class TestJournaledStorage:
+    def test_replay_after_restart(self, tmp_path: Path) -> None:
+        db_path: Path = tmp_path / "db.json"
+
+        db: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        db.table("players").insert({"id": 1, "rbucks": 100})
+        db.table("players").update({"rbucks": 150}, Query().id == 1)
+
+        # Simulate a crash, the journal is the only thing on disk.
+        assert db_path.exists() is False
+
+        recovered: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        assert recovered.table("players").get(Query().id == 1)["rbucks"] == 150
+
+        db.close()
+        recovered.close()
+
+    def test_journal_records_only_changes(self, tmp_path: Path) -> None:
+        db_path: Path = tmp_path / "db.json"
+
+        db: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        players = db.table("players")
+        players.insert_multiple({"id": id, "rbucks": 100} for id in range(50))
+        db.close()
+
+        journal_path: Path = tmp_path / "db.json.journal"
+        size_before: int = journal_path.stat().st_size
+
+        db = TinyDB(db_path, storage=JournaledStorage)
+        db.table("players").update({"rbucks": 0}, Query().id == 7)
+        db.close()
+
+        lines: list[str] = journal_path.read_text().splitlines()
+        assert json.loads(lines[-1]) == {"t": "players", "k": "8", "v": {"id": 7, "rbucks": 0}}
+        assert journal_path.stat().st_size - size_before < 100
+
+    def test_compaction(self, tmp_path: Path) -> None:
+        db_path: Path = tmp_path / "db.json"
+
+        db: TinyDB = TinyDB(db_path, storage=JournaledStorage, compaction_threshold=256)
+        players = db.table("players")
+        for id in range(20):
+            players.insert({"id": id, "rbucks": 100})
+        db.close()
+
+        assert db_path.exists()
+        assert (tmp_path / "db.json.journal.compacting").exists() is False
+
+        recovered: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        assert len(recovered.table("players")) == 20
+        recovered.close()
+
+    def test_failed_compaction_is_carried_over(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        db_path: Path = tmp_path / "db.json"
+
+        def fail(self: JournaledStorage, snapshot: dict) -> None:
+            raise OSError("disk full")
+
+        monkeypatch.setattr(JournaledStorage, "_compact", fail)
+
+        # Rotates the journal several times, and every compaction fails.
+        db: TinyDB = TinyDB(db_path, storage=JournaledStorage, compaction_threshold=256)
+        players = db.table("players")
+        for id in range(20):
+            players.insert({"id": id, "rbucks": 100})
+        db.close()
+
+        monkeypatch.undo()
+        assert db_path.exists() is False
+
+        recovered: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        assert len(recovered.table("players")) == 20
+        recovered.close()
+
+    def test_reads_copy_only_the_table_used(self, tmp_path: Path) -> None:
+        db: TinyDB = TinyDB(tmp_path / "db.json", storage=JournaledStorage)
+        db.table("ledger").insert_multiple({"id": id % 10, "amount": 1} for id in range(1000))
+        db.table("players").insert({"id": 1, "rbucks": 100})
+
+        view: TablesView = db.storage.read()
+        assert view["players"] == {"1": {"id": 1, "rbucks": 100}}
+        assert set(view) == {"ledger", "players"}
+        assert list(view.touched) == ["players"]
+
+        # Copies are private, changing one does not change the database until it is written back.
+        view["players"]["1"]["rbucks"] = 0
+        assert db.table("players").get(doc_id=1)["rbucks"] == 100
+        db.close()
+
+    def test_torn_record_is_ignored(self, tmp_path: Path) -> None:
+        db_path: Path = tmp_path / "db.json"
+
+        db: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        db.table("players").insert({"id": 1, "rbucks": 100})
+        db.close()
+
+        with open(tmp_path / "db.json.journal", "a") as f:
+            f.write('{"t": "players", "k": "1", "v": {"id"')
+
+        recovered: TinyDB = TinyDB(db_path, storage=JournaledStorage)
+        assert recovered.table("players").get(Query().id == 1)["rbucks"] == 100
+        recovered.table("players").insert({"id": 2, "rbucks": 100})
+        recovered.close()
+
+        recovered = TinyDB(db_path, storage=JournaledStorage)
+        assert len(recovered.table("players")) == 2
+        recovered.close()
+
+    def test_group_commit_coalesces_writes(self, tmp_path: Path) -> None:
+        db: TinyDB = TinyDB(tmp_path / "db.json", storage=JournaledStorage, group_commit_ms=50)
+        storage: JournaledStorage = db.storage
+
+        players = db.table("players")
+        for id in range(5):
+            with storage.batch(Durability.GROUP):
+                players.insert({"id": id, "rbucks": 100})
+
+        assert storage.metrics.commits == 0
+
+        with storage.batch(Durability.STRICT):
+            players.insert({"id": 5, "rbucks": 100})
+
+        assert storage.metrics.commits == 1
+        assert storage.metrics.batch_sizes[6] == 1
+        db.close()
+
+    def test_relaxed_writes_synced_on_close(self, tmp_path: Path) -> None:
+        db: TinyDB = TinyDB(tmp_path / "db.json", storage=JournaledStorage)
+        storage: JournaledStorage = db.storage
+
+        with storage.batch(Durability.RELAXED):
+            db.table("players").insert({"id": 1, "commends": 1})
+        assert storage.metrics.commits == 0
+
+        db.close()
+        assert storage.metrics.commits == 1
+
+
+class TestGetMany:
+    def test_found_and_missing(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        database.add(1, "RBEEZAY", 5000)
+        database.add(2, "HARRY", 4000)
+        database.add(3, "JEFFERSON", 3000)
+
+        players, missing = database.get_many([3, 4, 1, 5])
+
+        assert [player["name"] for player in players] == ["JEFFERSON", "RBEEZAY"]
+        assert missing == [4, 5]
+        assert database.get_many([]) == ([], [])
+        database.cog_unload()
+
+
+class TestDurability:
+    def test_write_class_not_inherited(self, tmp_path: Path) -> None:
+        database: Database = Database(
+            {"tinydb": {"path": str(tmp_path / "db.json"), "journal": {"group_commit_ms": 10000}}}
+        )
+        database.add(1, "RBEEZAY", 5000)
+        commits: int = database.storage.metrics.commits
+
+        # A cosmetic write is left unsynced, and must not make the result written after it relaxed as well.
+        database.modify(1, "commends", 1, Operation.ADD, WriteClass.COSMETIC)
+        assert database.storage.metrics.commits == commits
+
+        with database.transaction() as transaction:
+            transaction.modify(1, "win", 1, Operation.ADD)
+        assert database.storage.metrics.commits == commits + 1
+        database.cog_unload()
+
+
+class TestTransaction:
+    def test_staged_changes_not_visible_until_commit(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        database.add(1, "RBEEZAY", 5000)
+        database.add(2, "HARRY", 4000)
+
+        with database.transaction() as transaction:
+            transaction.modify(1, "win", 1, Operation.ADD)
+            transaction.modify(2, "loss", 1, Operation.ADD)
+
+            assert database.get(1)["win"] == 0
+            assert database.get(2)["loss"] == 0
+
+        assert database.get(1)["win"] == 1
+        assert database.get(2)["loss"] == 1
+        database.cog_unload()
+
+    def test_missing_player_aborts_commit(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        database.add(1, "RBEEZAY", 5000)
+
+        with pytest.raises(OneHeadException):
+            with database.transaction() as transaction:
+                transaction.credit(1, 100, LedgerReason.BET_PAYOUT)
+                transaction.credit(2, 100, LedgerReason.BET_PAYOUT)
+
+        assert database.get(1)["rbucks"] == Betting.INITIAL_BALANCE
+        assert len(database.get_ledger(1)) == 1
+        database.cog_unload()
+
+
+class TestDebitIfSufficient:
+    def test_debit(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        database.add(1, "RBEEZAY", 5000)
+
+        assert database.debit_if_sufficient(1, Betting.INITIAL_BALANCE, LedgerReason.BET) is True
+        assert database.get(1)["rbucks"] == 0
+        assert database.debit_if_sufficient(1, 1, LedgerReason.BET) is False
+        assert database.get(1)["rbucks"] == 0
+        assert [entry["amount"] for entry in database.get_ledger(1)] == [
+            Betting.INITIAL_BALANCE,
+            -Betting.INITIAL_BALANCE,
+        ]
+        database.cog_unload()
+
+    @pytest.mark.asyncio
+    async def test_lock_serialises_same_player(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        order: list[str] = []
+
+        async def hold(id: int, label: str) -> None:
+            async with database.lock(id):
+                order.append(f"{label} start")
+                await asyncio.sleep(0)
+                order.append(f"{label} end")
+
+        await asyncio.gather(hold(1, "a"), hold(1, "b"), hold(2, "c"))
+
+        assert order.index("a end") < order.index("b start")
+        assert order.index("c start") < order.index("a end")
+        database.cog_unload()
+
+
+class TestLedger:
+    def test_entries_written_with_balance(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        database.add(1, "RBEEZAY", 5000)
+        database.debit_if_sufficient(1, 60, LedgerReason.BET, game_id=3)
+
+        with database.transaction() as transaction:
+            transaction.credit(1, Betting.REWARD_ON_WIN, LedgerReason.WIN_REWARD, 3)
+            transaction.credit(1, 120, LedgerReason.BET_PAYOUT, 3)
+
+        with pytest.raises(OneHeadException):
+            database.modify(1, "rbucks", 1000)
+
+        assert [(entry["reason"], entry["amount"]) for entry in database.get_ledger(1, limit=3)] == [
+            ("bet", -60),
+            ("win reward", Betting.REWARD_ON_WIN),
+            ("bet payout", 120),
+        ]
+        assert database.get(1)["rbucks"] == Betting.INITIAL_BALANCE - 60 + Betting.REWARD_ON_WIN + 120
+        assert database.reconcile() == {}
+        database.cog_unload()
+
+        # The ledger is kept out of the database, and the index is rebuilt from its file on restart.
+        db: TinyDB = TinyDB(tmp_path / "db.json", storage=JournaledStorage)
+        assert "ledger" not in db.tables()
+        db.close()
+        assert len((tmp_path / "db.ledger.jsonl").read_text().splitlines()) == 4
+
+        database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        assert len(database.get_ledger(1)) == 4
+        assert database.reconcile() == {}
+        database.cog_unload()
+
+    def test_torn_entry_and_unwritten_balance(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        database.add(1, "RBEEZAY", 5000)
+        database.cog_unload()
+
+        # A crash after an entry is appended but before the balance is written, then one partway through an append.
+        with open(tmp_path / "db.ledger.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(ledger_entry(1, -60, LedgerReason.BET, 3)) + "\n")
+            f.write('{"id": 1, "amo')
+
+        # The mismatch is only reported on startup, it is up to an admin to repair it.
+        database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        assert [entry["amount"] for entry in database.get_ledger(1)] == [Betting.INITIAL_BALANCE, -60]
+        assert database.get(1)["rbucks"] == Betting.INITIAL_BALANCE
+        assert database.reconcile(repair=True) == {1: (Betting.INITIAL_BALANCE, Betting.INITIAL_BALANCE - 60)}
+        assert database.get(1)["rbucks"] == Betting.INITIAL_BALANCE - 60
+
+        database.debit_if_sufficient(1, 40, LedgerReason.BET, game_id=3)
+        database.cog_unload()
+
+        database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        assert [entry["amount"] for entry in database.get_ledger(1)] == [Betting.INITIAL_BALANCE, -60, -40]
+        assert database.reconcile() == {}
+        database.cog_unload()
+
+    def test_opening_balances_and_reconcile(self, tmp_path: Path) -> None:
+        db: TinyDB = TinyDB(tmp_path / "db.json", storage=JournaledStorage)
+        db.table("players").insert({"id": 1, "rbucks": 700})
+        db.close()
+
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json")}})
+        assert [(entry["reason"], entry["amount"]) for entry in database.get_ledger(1)] == [("opening balance", 700)]
+
+        database.players.update({"rbucks": 900}, Query().id == 1)
+        assert database.reconcile(ids=[2]) == {}
+        assert database.reconcile(ids=[1]) == {1: (900, 700)}
+        assert database.reconcile() == {1: (900, 700)}
+        assert database.reconcile(repair=True) == {1: (900, 700)}
+        assert database.get(1)["rbucks"] == 700
+        assert database.reconcile() == {}
+        database.cog_unload()
@@ -0,0 +1,91 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from onehead.game import Game, TimerWheel, Window
+
+
+class TestTimerWheel:
+    @pytest.mark.asyncio
+    async def test_callbacks_run_in_deadline_order(self) -> None:
+        timers: TimerWheel = TimerWheel()
+        fired: list[str] = []
+
+        async def fire(name: str) -> None:
+            fired.append(name)
+
+        timers.schedule(0.03, lambda: fire("late"))
+        cancelled: int = timers.schedule(0.02, lambda: fire("cancelled"))
+        timers.schedule(0.01, lambda: fire("early"))
+        timers.cancel(cancelled)
+
+        await asyncio.sleep(0.05)
+        assert fired == ["early", "late"]
+        assert timers._pending == set()
+
+    @pytest.mark.asyncio
+    async def test_cancel_all(self) -> None:
+        timers: TimerWheel = TimerWheel()
+        callback: AsyncMock = AsyncMock()
+
+        timers.schedule(0.01, callback)
+        timers.schedule(0.02, callback)
+        timers.cancel_all()
+
+        await asyncio.sleep(0.03)
+        callback.assert_not_called()
+
+
+class TestGame:
+    @pytest.mark.asyncio
+    async def test_concurrent_windows(self) -> None:
+        game: Game = Game({Window.TRANSFER: 1, Window.BETTING: 1}, ((Window.TRANSFER, Window.BETTING),))
+        game.start()
+        ctx: AsyncMock = AsyncMock()
+
+        runner: asyncio.Task = asyncio.create_task(game.run_windows(ctx))
+        await asyncio.sleep(0)
+        assert game.transfer_window_open() and game.betting_window_open()
+
+        await game.close_window(Window.TRANSFER)
+        assert game.betting_window_open()
+        assert runner.done() is False
+
+        await game.close_window(Window.BETTING)
+        await asyncio.wait_for(runner, timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_closing_leaves_no_timers_behind(self) -> None:
+        game: Game = Game({Window.TRANSFER: 0, Window.BETTING: 1}, ((Window.TRANSFER,), (Window.BETTING,)))
+        game.start()
+
+        runner: asyncio.Task = asyncio.create_task(game.run_windows(AsyncMock()))
+        await asyncio.sleep(0.01)
+
+        # The transfer window was closed by its own timer and the betting window early, by hand.
+        assert game.betting_window_open()
+        await game.close_window(Window.BETTING)
+        await asyncio.wait_for(runner, timeout=1)
+        assert game._timers._pending == set()
+
+    @pytest.mark.asyncio
+    async def test_extend_window(self) -> None:
+        game: Game = Game({Window.TRANSFER: 1, Window.BETTING: 1}, ((Window.BETTING,),))
+        game.start()
+
+        runner: asyncio.Task = asyncio.create_task(game.run_windows(AsyncMock()))
+        await asyncio.sleep(0)
+
+        assert game.extend_window(Window.BETTING, 60) > 60
+        await asyncio.sleep(1.1)
+        assert game.betting_window_open()
+
+        game.cancel()
+        await asyncio.wait_for(runner, timeout=1)
+        assert game.betting_window_open() is False
+
+    def test_window_durations_merge_with_defaults(self) -> None:
+        game: Game = Game({Window.BETTING: 30})
+
+        assert game._window_durations == {Window.TRANSFER: 120, Window.BETTING: 30}
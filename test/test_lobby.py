@@ -1,15 +1,25 @@
+import asyncio
 from typing import Sequence
 from unittest.mock import AsyncMock, Mock
 
 import discord.ext.test as dpytest
 import pytest
 from conftest import TEST_USER, add_ihl_role
+from discord import Status
 from discord.ext.commands import Bot, errors
 from discord.guild import Guild
+from discord.member import Member
 from discord.role import Role
 
-import onehead.lobby
-from onehead.lobby import Lobby
+from onehead.lobby import Lobby, MessageFilter, SignupQueue, on_message, on_presence_update
+
+
+def get_test_member(bot: Bot) -> Member:
+    return list(bot.get_all_members())[0]
+
+
+def letters(count: int) -> SignupQueue:
+    return SignupQueue({id: chr(ord("A") + id - 1) for id in range(1, count + 1)})
 
 
 class TestSummon:
@@ -75,7 +85,7 @@ class TestSignup:
 
         lobby: Lobby = bot.get_cog("Lobby")
         lobby._signups_disabled = False
-        lobby._signups.append(TEST_USER)
+        lobby._signups.add(get_test_member(bot).id, TEST_USER)
 
         lobby.database.get = Mock()
         lobby.database.get.return_value = {"name": TEST_USER}
@@ -129,7 +139,7 @@ class TestSignout:
     async def test_success(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups.append(TEST_USER)
+        lobby._signups.add(get_test_member(bot).id, TEST_USER)
         await dpytest.message("!so")
         assert len(lobby.get_signups()) == 0
 
@@ -150,7 +160,7 @@ class TestRemove:
     async def test_success(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL Admin")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups.append("RBEEZAY")
+        lobby._signups.add(1, "RBEEZAY")
         await dpytest.message("!rm RBEEZAY")
         assert (
             dpytest.verify()
@@ -177,7 +187,7 @@ class TestReady:
     async def test_ready_check_not_in_progress(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups.append(TEST_USER)
+        lobby._signups.add(get_test_member(bot).id, TEST_USER)
         await dpytest.message("!ready")
         assert dpytest.verify().message().content("No ready check initiated.")
 
@@ -185,7 +195,7 @@ class TestReady:
     async def test_success(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups.append(TEST_USER)
+        lobby._signups.add(get_test_member(bot).id, TEST_USER)
         lobby._ready_check_in_progress = True
         await dpytest.message("!ready")
         assert dpytest.verify().message().content(f"{TEST_USER} is ready.")
@@ -201,7 +211,7 @@ class TestReadyCheck:
     async def test_not_enough_signups(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups.append(TEST_USER)
+        lobby._signups.add(get_test_member(bot).id, TEST_USER)
         await dpytest.message("!ready_check")
         assert dpytest.verify().message().content("Only 1 Signup(s), require 9 more.")
 
@@ -209,9 +219,9 @@ class TestReadyCheck:
     async def test_waiting_on_players(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K"]
-        lobby._players_ready = ["A", "B", "C", "D"]
-        onehead.lobby.sleep = AsyncMock()
+        lobby._signups = letters(11)
+        lobby._players_ready = {1, 2, 3, 4}
+        lobby._ready_check_timeout = 0
 
         await dpytest.message("!ready_check")
         assert (
@@ -231,20 +241,200 @@ class TestReadyCheck:
     async def test_success(self, bot: Bot) -> None:
         await add_ihl_role(bot, "IHL")
         lobby: Lobby = bot.get_cog("Lobby")
-        lobby._signups = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J"]
-        lobby._players_ready = lobby._signups
-        onehead.lobby.sleep = AsyncMock()
+        lobby._signups = letters(10)
+        lobby._players_ready = set(range(1, 10))
+
+        ready_check: asyncio.Task = asyncio.create_task(dpytest.message("!ready_check"))
+        await asyncio.sleep(0.1)
+        assert ready_check.done() is False
+
+        lobby._players_ready.add(10)
+        lobby._check_all_ready()
+        await asyncio.wait_for(ready_check, timeout=1)
 
-        await dpytest.message("!ready_check")
-        assert (
-            dpytest.verify()
-            .message()
-            .content("Ready Check Started, 30s remaining - type '!ready' to ready up.")
-        )
         assert (
             dpytest.verify()
             .message()
-            .content("Ready Check Complete - All players ready.")
+            .content("Ready check started - `30s` remaining - type `!ready` to ready up.")
         )
+        assert dpytest.verify().message().content("Ready check complete.")
         assert lobby._ready_check_in_progress is False
-        assert lobby._players_ready == []
+        assert lobby._players_ready == set()
+
+    @pytest.mark.asyncio
+    async def test_auto_start(self, bot: Bot) -> None:
+        await add_ihl_role(bot, "IHL")
+        await add_ihl_role(bot, "IHL Admin")
+        lobby: Lobby = bot.get_cog("Lobby")
+        lobby._signups = letters(10)
+        lobby._players_ready = set(lobby._signups)
+        lobby._auto_start = True
+
+        start: AsyncMock = AsyncMock()
+        bot.get_command("start")._callback = start
+
+        await dpytest.message("!ready_check")
+        start.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_auto_start_requires_admin(self, bot: Bot) -> None:
+        await add_ihl_role(bot, "IHL")
+        lobby: Lobby = bot.get_cog("Lobby")
+        lobby._signups = letters(10)
+        lobby._players_ready = set(lobby._signups)
+        lobby._auto_start = True
+
+        start: AsyncMock = AsyncMock()
+        bot.get_command("start")._callback = start
+
+        await dpytest.message("!ready_check")
+        start.assert_not_awaited()
+        assert dpytest.verify().message().contains().content("Ready check started")
+        assert dpytest.verify().message().content("Ready check complete.")
+        assert dpytest.verify().message().content("Ready check complete - an admin can now `!start` the game.")
+
+
+class TestSignupQueue:
+    def test_keyed_by_id(self) -> None:
+        signups: SignupQueue = SignupQueue()
+
+        assert signups.add(1, "RBEEZAY")
+        assert signups.add(2, "HARRY")
+        assert signups.add(1, "RBEEZAY2") is False
+
+        assert 1 in signups
+        assert signups.names() == ["RBEEZAY2", "HARRY"]
+        assert signups.find("RBEEZAY2") == 1
+        assert signups.remove(1) == "RBEEZAY2"
+        assert signups.remove(1) is None
+        assert list(signups) == [2]
+
+    def test_select_prioritises_benched_players(self) -> None:
+        signups: SignupQueue = letters(12)
+        behaviour: dict[int, int] = {id: 10000 for id in range(1, 13)}
+        behaviour[12] = 9500
+
+        # Ties on behaviour score go to whoever signed up first.
+        assert signups.select(behaviour, 10) == ["K", "L"]
+        assert list(signups) == list(range(1, 11))
+
+        # Having been benched once lifts K above everyone else, L is level with them and signed up last.
+        signups.clear()
+        for id, name in letters(12).items():
+            signups.add(id, name)
+
+        assert signups.select(behaviour, 10) == ["J", "L"]
+
+        # L has now been benched twice, which outweighs the difference in behaviour score.
+        signups.clear()
+        for id, name in letters(12).items():
+            signups.add(id, name)
+
+        assert signups.select(behaviour, 10) == ["I", "K"]
+
+
+class TestLobbyStatus:
+    @pytest.mark.asyncio
+    async def test_updates_coalesced(self, bot: Bot, monkeypatch: pytest.MonkeyPatch) -> None:
+        lobby: Lobby = bot.get_cog("Lobby")
+        status_message: Mock = Mock(edit=AsyncMock())
+        channel: Mock = Mock(send=AsyncMock(return_value=status_message))
+        monkeypatch.setattr(Lobby, "STATUS_DEBOUNCE_SECONDS", 0.01)
+
+        for id, name in letters(15).items():
+            lobby._signups.add(id, name)
+            lobby._update_status(channel)
+        await asyncio.sleep(0.05)
+
+        channel.send.assert_awaited_once()
+        assert "`15` players signed up" in channel.send.await_args.args[0]
+
+        lobby._signups.remove(1)
+        lobby._update_status(channel)
+        lobby._signups.remove(2)
+        lobby._update_status(channel)
+        await asyncio.sleep(0.05)
+
+        channel.send.assert_awaited_once()
+        status_message.edit.assert_awaited_once()
+        assert "`13` players signed up" in status_message.edit.await_args.kwargs["content"]
+
+
+class TestPresenceUpdate:
+    @pytest.mark.asyncio
+    async def test_signouts_coalesced(self, bot: Bot, monkeypatch: pytest.MonkeyPatch) -> None:
+        lobby: Lobby = bot.get_cog("Lobby")
+        lobby._context = Mock(send=AsyncMock())
+        lobby._signups = letters(3)
+        monkeypatch.setattr(Lobby, "SIGNOUT_COALESCE_SECONDS", 0)
+
+        guild: Guild = bot.guilds[0]
+
+        def member(id: int, name: str, status: Status) -> Mock:
+            return Mock(id=id, guild=guild, display_name=name, mention=f"@{name}", status=status)
+
+        await on_presence_update(Mock(), member(4, "D", Status.offline))
+        await on_presence_update(Mock(), member(1, "A", Status.online))
+        await on_presence_update(Mock(), member(1, "A", Status.idle))
+        await on_presence_update(Mock(), member(3, "C", Status.offline))
+        await asyncio.sleep(0.01)
+
+        assert lobby.get_signups() == ["B"]
+        assert list(lobby._signups) == [2]
+        assert lobby.presence_metrics.filtered == 2
+        assert lobby.presence_metrics.handled == 2
+        lobby._context.send.assert_awaited_once_with(
+            "@A (Idle), @C (Offline) have been signed out due to being idle or offline."
+        )
+
+
+class TestMessageFilter:
+    def message(self, author: str, content: str) -> Mock:
+        return Mock(author=Mock(display_name=author, bot=False), content=content)
+
+    @pytest.mark.asyncio
+    async def test_restricted_author(self, bot: Bot) -> None:
+        message_filter: MessageFilter = MessageFilter({"discord": {"message_filter": {"restricted_authors": ["ERIC"]}}})
+
+        assert message_filter.allow(self.message("ERIC", "hello"), bot)
+        assert message_filter.allow(self.message("ERIC", "!su"), bot)
+        assert message_filter.allow(self.message("ERIC", "!signup please"), bot)
+        assert message_filter.allow(self.message("ERIC", "!nonsense"), bot) is False
+        assert message_filter.allow(self.message("ERIC", "!"), bot) is False
+        assert message_filter.allow(self.message("GEE", "!nonsense"), bot)
+
+    @pytest.mark.asyncio
+    async def test_default_restricted_authors(self, bot: Bot) -> None:
+        assert MessageFilter({}).allow(self.message("SCOUT", "!nonsense"), bot) is False
+
+        message_filter: MessageFilter = MessageFilter({"discord": {"message_filter": {"restricted_authors": []}}})
+        assert message_filter.allow(self.message("SCOUT", "!nonsense"), bot)
+
+    @pytest.mark.asyncio
+    async def test_rebuilt_when_cogs_change(self, bot: Bot) -> None:
+        lobby: Lobby = bot.get_cog("Lobby")
+        lobby.message_filter = MessageFilter({"discord": {"message_filter": {"restricted_authors": ["ERIC"]}}})
+        assert lobby.message_filter.allow(self.message("ERIC", "!commend"), bot)
+
+        await bot.remove_cog("Behaviour")
+        assert lobby.message_filter.allow(self.message("ERIC", "!commend"), bot) is False
+
+    @pytest.mark.asyncio
+    async def test_benchmark_on_message(self, bot: Bot, monkeypatch: pytest.MonkeyPatch) -> None:
+        lobby: Lobby = bot.get_cog("Lobby")
+        lobby.message_filter = MessageFilter({"discord": {"message_filter": {"restricted_authors": ["ERIC"]}}})
+        monkeypatch.setattr(bot, "process_commands", AsyncMock())
+        # Every message is from one of two authors, so measure the filter without the throttle turning them away.
+        monkeypatch.setattr(bot.get_cog("Throttle"), "limits", {})
+
+        messages: list[Mock] = [
+            self.message("ERIC", "!su"),
+            self.message("ERIC", "!who is signed up"),
+            self.message("GEE", "!bet radiant 100"),
+            self.message("ERIC", "gg"),
+        ] * 2500
+
+        for message in messages:
+            await on_message(message)
+
+        assert bot.process_commands.await_count == len(messages)
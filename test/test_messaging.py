@@ -0,0 +1,98 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from discord import Embed
+
+from onehead.messaging import Outbox, Priority
+
+
+def channel(name: str, sent: list[tuple[str, str]]) -> Mock:
+    async def send(content: str, embed: Embed | None = None) -> Mock:
+        sent.append((name, content))
+        return Mock(content=content)
+
+    return Mock(send=AsyncMock(side_effect=send))
+
+
+class TestOutbox:
+    @pytest.mark.asyncio
+    async def test_priority_and_merging(self) -> None:
+        outbox: Outbox = Outbox()
+        sent: list[tuple[str, str]] = []
+        lobby: Mock = channel("lobby", sent)
+        general: Mock = channel("general", sent)
+
+        outbox.enqueue(lobby, "commended", Priority.COSMETIC)
+        outbox.enqueue(lobby, "window closed", Priority.GAME)
+        outbox.enqueue(lobby, "Radiant victory!", Priority.ADMIN)
+        outbox.enqueue(lobby, "Updating scores...", Priority.ADMIN)
+        done: asyncio.Future = outbox.enqueue(general, "Season ended!", Priority.ADMIN)
+
+        assert (await done).content == "Season ended!"
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert sent == [
+            ("lobby", "Radiant victory!\nUpdating scores..."),
+            ("general", "Season ended!"),
+            ("lobby", "window closed"),
+            ("lobby", "commended"),
+        ]
+        assert outbox.metrics.sends == 4
+        assert outbox.metrics.merged == 1
+        assert outbox.depth() == 0
+        outbox.close()
+
+    @pytest.mark.asyncio
+    async def test_cosmetic_shed_under_load(self) -> None:
+        outbox: Outbox = Outbox()
+        sent: list[tuple[str, str]] = []
+        lobby: Mock = channel("lobby", sent)
+
+        duplicate: asyncio.Future = outbox.enqueue(lobby, "mental health", Priority.COSMETIC)
+        assert outbox.enqueue(lobby, "mental health", Priority.COSMETIC) is duplicate
+
+        for i in range(Outbox.MAX_QUEUED_MESSAGES - 1):
+            outbox.enqueue(lobby, f"bet {i}", Priority.GAME)
+
+        # The oldest cosmetic message makes way for newer ones, and for anything more important.
+        commended: asyncio.Future = outbox.enqueue(lobby, "commended", Priority.COSMETIC)
+        assert await duplicate is None
+
+        result: asyncio.Future = outbox.enqueue(lobby, "Radiant victory!", Priority.ADMIN)
+        assert await commended is None
+        assert await result is not None
+
+        assert outbox.metrics.shed == 2
+        assert sent[0] == ("lobby", "Radiant victory!")
+        outbox.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_send_keeps_worker_running(self) -> None:
+        outbox: Outbox = Outbox()
+        sent: list[tuple[str, str]] = []
+        lobby: Mock = channel("lobby", sent)
+        broken: Mock = Mock(send=AsyncMock(side_effect=ValueError("broken")))
+
+        failed: asyncio.Future = outbox.enqueue(broken, "window closed", Priority.GAME)
+        done: asyncio.Future = outbox.enqueue(lobby, "commended", Priority.COSMETIC)
+
+        with pytest.raises(ValueError):
+            await failed
+        assert (await done).content == "commended"
+        outbox.close()
+
+    @pytest.mark.asyncio
+    async def test_embeds_are_not_merged(self) -> None:
+        outbox: Outbox = Outbox()
+        sent: list[tuple[str, str]] = []
+        lobby: Mock = channel("lobby", sent)
+
+        outbox.enqueue(lobby, "Radiant victory!", Priority.ADMIN)
+        outbox.enqueue(lobby, "", Priority.ADMIN, Embed(title="Bets"))
+        await outbox.enqueue(lobby, "Season ended!", Priority.ADMIN)
+
+        assert sent == [("lobby", "Radiant victory!"), ("lobby", None), ("lobby", "Season ended!")]
+        assert lobby.send.await_args_list[1].kwargs["embed"].title == "Bets"
+        outbox.close()
@@ -1,3 +1,4 @@
+import random
 from unittest.mock import Mock
 
 import discord.ext.test as dpytest
@@ -7,6 +8,7 @@ from discord.ext.commands import Bot, errors
 
 from onehead.common import OneHeadException
 from onehead.scoreboard import ScoreBoard
+from onehead.statistics import Statistics
 
 
 class TestScoreboard:
@@ -460,3 +462,47 @@ class TestScoreboard:
                 "**IGC Leaderboard** ```\n\n 19  EDD            0       4    0        1300             0              4        10000```"
             )
         )
+
+
+class TestLeaderboardDelta:
+    @staticmethod
+    def player(id: int, name: str, win: int, loss: int) -> dict:
+        return {"id": id, "name": name, "win": win, "loss": loss}
+
+    def test_participants_and_shifted_ranks(self) -> None:
+        league: list[dict] = [
+            self.player(1, "A", 5, 0),
+            self.player(2, "B", 3, 0),
+            self.player(3, "C", 2, 0),
+            self.player(4, "D", 1, 0),
+            self.player(5, "E", 0, 0),
+            self.player(6, "F", 0, 1),
+        ]
+        scoreboard: ScoreBoard = ScoreBoard(Mock(get_all=Mock(return_value=league)))
+
+        scoreboard.prepare_delta([6, 2])
+        rows: list[dict] = scoreboard.apply_delta([self.player(6, "F", 1, 1), self.player(2, "B", 3, 1)])
+
+        assert rows == [
+            {"#": 2, "name": "B", "rating": "1650 -> 1600", "rank": "2 -> 2"},
+            {"#": 2, "name": "C", "rating": "1600 -> 1600", "rank": "3 -> 2"},
+            {"#": 5, "name": "F", "rating": "1450 -> 1500", "rank": "6 -> 5"},
+        ]
+
+    def test_matches_full_sort(self) -> None:
+        rng: random.Random = random.Random(7)
+        league: list[dict] = [self.player(id, str(id), rng.randint(0, 20), rng.randint(0, 20)) for id in range(200)]
+        scoreboard: ScoreBoard = ScoreBoard(Mock(get_all=Mock(return_value=[dict(player) for player in league])))
+
+        participants: list[int] = rng.sample(range(200), 10)
+        scoreboard.prepare_delta(participants)
+        for i, id in enumerate(participants):
+            league[id]["win" if i < 5 else "loss"] += 1
+
+        rows: list[dict] = scoreboard.apply_delta([dict(league[id]) for id in participants])
+
+        Statistics.calculate_rating(league)
+        positions: list[dict] = ScoreBoard._calculate_positions(league, "rating")
+        ranks: dict[str, int] = {player["name"]: player["#"] for player in positions}
+        assert all(row["#"] == ranks[row["name"]] for row in rows)
+        assert {str(id) for id in participants} <= {row["name"] for row in rows}
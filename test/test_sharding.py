@@ -0,0 +1,50 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from onehead.common import current_guild_id
+from onehead.database import Database
+from onehead.lobby import Lobby
+from onehead.protocols.database import Operation
+
+GUILD_COUNT: int = 48
+PLAYERS_PER_GUILD: int = 10
+
+
+class TestGuildSharding:
+    @pytest.mark.asyncio
+    async def test_many_guilds_in_one_process(self, tmp_path: Path) -> None:
+        database: Database = Database({"tinydb": {"path": str(tmp_path / "db.json"), "shard_by_guild": True}})
+        lobby: Lobby = Lobby(database, {})
+
+        async def run_guild(guild_id: int) -> None:
+            current_guild_id.set(guild_id)
+
+            for player_id in range(PLAYERS_PER_GUILD):
+                database.add(player_id, f"{guild_id}-{player_id}", 1000 + guild_id)
+                lobby._signups.add(player_id, f"{guild_id}-{player_id}")
+                await asyncio.sleep(0)
+
+            with database.transaction() as transaction:
+                for player_id in range(PLAYERS_PER_GUILD):
+                    transaction.modify(player_id, "win", 1, Operation.ADD)
+
+                metadata = database.get_metadata()
+                metadata["game_id"] += guild_id
+                transaction.update_metadata(metadata)
+
+        await asyncio.gather(*(run_guild(guild_id) for guild_id in range(1, GUILD_COUNT + 1)))
+
+        for guild_id in range(1, GUILD_COUNT + 1):
+            current_guild_id.set(guild_id)
+
+            assert lobby.get_signups() == [f"{guild_id}-{player_id}" for player_id in range(PLAYERS_PER_GUILD)]
+            assert database.get_metadata()["game_id"] == 1 + guild_id
+            assert [player["mmr"] for player in database.get_all()] == [1000 + guild_id] * PLAYERS_PER_GUILD
+            assert all(player["win"] == 1 for player in database.get_all())
+            assert (tmp_path / f"db.{guild_id}.json.journal").exists()
+
+        assert len(database._guilds) == GUILD_COUNT
+
+        database.cog_unload()
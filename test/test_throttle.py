@@ -0,0 +1,65 @@
+import discord.ext.test as dpytest
+import pytest
+from conftest import add_ihl_role
+from discord.ext.commands import Bot
+
+from onehead.common import OneHeadException
+from onehead.throttle import Throttle, TokenBucket
+
+
+class TestTokenBucket:
+    def test_burst_then_refill(self) -> None:
+        bucket: TokenBucket = TokenBucket(capacity=2, rate=0.1, tokens=2, updated=0)
+
+        assert bucket.take(0)
+        assert bucket.take(1)
+        assert bucket.take(2) is False
+        assert bucket.retry_after() == pytest.approx(8)
+
+        assert bucket.take(10)
+        assert bucket.take(10) is False
+
+        # Refilling never goes past capacity.
+        bucket.refill(1000)
+        assert bucket.tokens == 2
+
+
+class TestThrottle:
+    @pytest.mark.asyncio
+    async def test_single_notice_when_over_limit(self, bot: Bot) -> None:
+        await add_ihl_role(bot, "IHL")
+        throttle: Throttle = bot.get_cog("Throttle")
+
+        for _ in range(2):
+            await dpytest.message("!bets")
+        await dpytest.empty_queue()
+
+        for _ in range(3):
+            await dpytest.message("!bets")
+
+        assert dpytest.verify().message().contains().content("Slow down! `!bets` can be used again in")
+        assert dpytest.verify().message().nothing()
+
+        assert throttle.metrics.allowed == 2
+        assert throttle.metrics.throttled == 3
+        assert throttle.metrics.notices == 1
+
+    @pytest.mark.asyncio
+    async def test_role_multiplier(self, bot: Bot) -> None:
+        throttle: Throttle = Throttle({"throttle": {"role_multipliers": {"IHL": 2}}})
+        await bot.remove_cog("Throttle")
+        await bot.add_cog(throttle)
+        await add_ihl_role(bot, "IHL")
+
+        for _ in range(4):
+            await dpytest.message("!bets")
+
+        assert throttle.metrics.allowed == 4
+        assert throttle.metrics.throttled == 0
+
+    def test_invalid_config(self) -> None:
+        with pytest.raises(OneHeadException):
+            Throttle({"throttle": {"role_multipliers": {"IHL": 0}}})
+
+        with pytest.raises(OneHeadException):
+            Throttle({"throttle": {"commands": {"bets": {"capacity": 0, "per": 30}}}})
@@ -70,11 +70,13 @@ class TestShuffle:
         current_game.radiant = []
         current_game.dire = []
 
-        core.lobby.get_signups = Mock()
-        core.lobby.get_signups.return_value = [TEST_USER]
+        core.lobby.is_signed_up = Mock()
+        core.lobby.is_signed_up.return_value = True
 
         core.database.get = Mock()
         core.database.get.return_value = {"rbucks": 0}
+        core.database.debit_if_sufficient = Mock()
+        core.database.debit_if_sufficient.return_value = False
 
         await dpytest.message("!shuffle")
         assert (
@@ -96,12 +98,13 @@ class TestShuffle:
         current_game.radiant = []
         current_game.dire = []
 
-        core.lobby.get_signups = Mock()
-        core.lobby.get_signups.return_value = [TEST_USER]
+        core.lobby.is_signed_up = Mock()
+        core.lobby.is_signed_up.return_value = True
 
         core.database.get = Mock()
         core.database.get.return_value = {"rbucks": Transfers.SHUFFLE_COST + 100}
-        core.database.modify = Mock()
+        core.database.debit_if_sufficient = Mock()
+        core.database.debit_if_sufficient.return_value = True
 
         core.matchmaking.balance = AsyncMock()
         core.matchmaking.balance.return_value = [{"name": "A"}], [{"name": "B"}]